@@ -0,0 +1,8 @@
+from analysis.order_tracking import OrderTracker, SampleClock, \
+    angle_resample, order_spectrum, order_amplitudes, bearing_orders
+from analysis.tsa import SynchronousAverager, decode_average
+from analysis.fft import FftEngine, get_window
+from analysis.welch import WelchAverager, decode_psd
+from analysis.envelope import EnvelopeAnalyzer, band_mask
+from analysis.peaks import find_peaks, parabolic_interpolate, \
+    harmonic_levels, harmonic_families, PeakTracker
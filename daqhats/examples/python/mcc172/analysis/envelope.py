@@ -0,0 +1,175 @@
+"""
+    Envelope (demodulation) analysis for bearing faults.
+
+    A bearing defect excites a structural resonance at every impact, so the
+    defect frequency shows up as the amplitude modulation of a high
+    frequency band rather than as a line of its own.  Per block:
+
+    1. the spectrum of the block is band-passed around the resonance with a
+       cosine-tapered mask, which also doubles the positive frequencies, so
+       the inverse complex FFT of the masked half spectrum is the analytic
+       (Hilbert) signal of the band,
+    2. its magnitude is the envelope; the envelope spectrum is taken with a
+       Hann window,
+    3. the amplitudes at the bearing defect frequencies (orders from
+       :py:func:`analysis.bearing_orders` times the shaft speed) and their
+       harmonics are the largest envelope spectrum lines within a tolerance
+       around them.
+
+    The mask, the windows and all buffers are built once per block shape.
+"""
+import numpy as np
+from analysis.fft import FftEngine
+
+
+def band_mask(num_samples, scan_rate, band, transition=None):
+    """
+    Return the analytic band-pass mask of the rfft bins.
+
+    Args:
+        num_samples (int): Samples per block.
+        scan_rate (float): The scan rate in S/s.
+        band (tuple): (low, high) pass band edges in Hz.
+        transition (float): Width of the cosine tapers outside the band in
+            Hz; 10 % of the band width by default.
+
+    Returns:
+        numpy.ndarray: 2 in the pass band, tapering to 0.
+
+    Raises:
+        ValueError: The band is not within 0 and the Nyquist frequency.
+    """
+    low, high = band
+    if not 0.0 < low < high <= scan_rate / 2.0:
+        raise ValueError('band must be within 0 - {} Hz'.format(
+            scan_rate / 2.0))
+    if transition is None:
+        transition = 0.1 * (high - low)
+    freqs = np.fft.rfftfreq(num_samples, 1.0 / scan_rate)
+    # Distance outside the band, 0 inside.
+    outside = np.maximum(low - freqs, freqs - high)
+    mask = np.where(outside <= 0.0, 2.0, 0.0)
+    if transition > 0:
+        taper = (outside > 0.0) & (outside < transition)
+        mask[taper] = 1.0 + np.cos(np.pi * outside[taper] / transition)
+    mask[0] = 0.0
+    mask.flags.writeable = False
+    return mask
+
+
+class EnvelopeAnalyzer(object):
+    """
+    Envelope spectra and bearing defect amplitudes of fixed-size blocks.
+
+    Args:
+        num_samples (int): Samples per channel of each block.
+        num_channels (int): The number of channels (rows).
+        scan_rate (float): The scan rate in S/s.
+        band (tuple): (low, high) resonance band in Hz.
+        orders (dict): Defect name -> frequency in shaft orders, e.g.
+            :py:func:`analysis.bearing_orders`.
+        harmonics (int): The number of harmonics of every defect frequency.
+        tolerance (float): Search range around each defect frequency as a
+            fraction of it (speed measurement and slip), at least one bin.
+    """
+    # pylint: disable=too-many-arguments, too-many-instance-attributes
+
+    def __init__(self, num_samples, num_channels, scan_rate, band, orders,
+                 harmonics=3, tolerance=0.02):
+        self.num_samples = num_samples
+        self.num_channels = num_channels
+        self.scan_rate = scan_rate
+        self.band = band
+        self.names = list(orders)
+        self.orders = np.array([orders[name] for name in self.names],
+                               dtype=np.float64)
+        self.harmonics = harmonics
+        self.tolerance = tolerance
+
+        self._mask = band_mask(num_samples, scan_rate, band)
+        # Block spectrum (rectangular window, the band edges are tapered by
+        # the mask) and envelope spectrum (Hann).
+        self._block_fft = FftEngine(num_samples, num_channels,
+                                    window='rectangular')
+        self._envelope_fft = FftEngine(num_samples, num_channels)
+        num_bins = self._block_fft.num_bins
+        # Negative frequencies stay 0 for the analytic signal.
+        self._analytic = np.zeros((num_channels, num_samples),
+                                  dtype=np.complex128)
+        self._band = self._analytic[:, :num_bins]
+        self._envelope = np.empty((num_channels, num_samples))
+        self.resolution = scan_rate / num_samples
+        self.spectrum = None
+
+    def frequencies(self):
+        """ Return the envelope spectrum bin frequencies in Hz. """
+        return self._envelope_fft.frequencies(self.scan_rate)
+
+    def envelope(self, data):
+        """
+        Return the envelope of the band, shaped (channels, samples); an
+        internal buffer, overwritten by the next call.
+        """
+        np.multiply(self._block_fft.transform(data), self._mask,
+                    out=self._band)
+        np.abs(np.fft.ifft(self._analytic, axis=1), out=self._envelope)
+        return self._envelope
+
+    def defect_amplitudes(self, rpm, spectrum=None):
+        """
+        Return the envelope spectrum amplitudes at the defect frequencies.
+
+        Args:
+            rpm (float): The shaft speed.
+            spectrum (numpy.ndarray): An envelope spectrum shaped (channels,
+                bins); the last one calculated by default.
+
+        Returns:
+            numpy.ndarray: Amplitudes shaped (channels, defects,
+            harmonics), 0 for frequencies beyond the envelope band (the
+            width of the resonance band, or the last bin if lower).
+        """
+        if spectrum is None:
+            spectrum = self.spectrum
+        # The envelope of the band has no content above the band width.
+        num_bins = min(spectrum.shape[1],
+                       int((self.band[1] - self.band[0]) /
+                           self.resolution) + 1)
+        # Defect frequencies in bins, shaped (defects, harmonics).
+        centers = np.outer(self.orders * rpm / 60.0,
+                           np.arange(1, self.harmonics + 1)) / self.resolution
+        half = np.maximum(np.ceil(centers * self.tolerance), 1).astype(int)
+        reach = int(half.max()) if half.size else 1
+        offsets = np.arange(-reach, reach + 1)
+        index = np.rint(centers).astype(int)[..., None] + offsets
+        valid = (np.abs(offsets) <= half[..., None]) & (index >= 1) & \
+            (index < num_bins)
+        values = spectrum[:, np.clip(index, 0, num_bins - 1)]
+        values = np.where(valid, values, 0.0)
+        return values.max(axis=-1)
+
+    def analyze(self, data, rpm=None):
+        """
+        Calculate the envelope spectrum of a block.
+
+        Args:
+            data (numpy.ndarray): Samples shaped (channels, samples).
+            rpm (float): The shaft speed; the defect amplitudes are left
+                out if None or 0.
+
+        Returns:
+            dict: 'rms' (channels,) of the envelope AC part, 'spectrum'
+            (channels, bins) peak amplitudes (an internal buffer) and
+            'amplitudes', defect name -> (channels, harmonics).
+        """
+        envelope = self.envelope(data)
+        envelope -= envelope.mean(axis=1, keepdims=True)
+        result = {'rms': np.sqrt(np.mean(envelope * envelope, axis=1))}
+        self.spectrum = self._envelope_fft.magnitude(envelope)
+        result['spectrum'] = self.spectrum
+        result['amplitudes'] = {}
+        if rpm:
+            amplitudes = self.defect_amplitudes(rpm)
+            result['amplitudes'] = {name: amplitudes[:, i]
+                                    for i, name in enumerate(self.names)}
+        return result
@@ -0,0 +1,145 @@
+"""
+    Batched real FFT with cached windows.
+
+    Windows and the per-bin amplitude scale factors are calculated once per
+    (window, length) and shared by all engines.  An :py:class:`FftEngine`
+    owns preallocated buffers for one block shape, so computing the spectra
+    of all channels of a block is one windowing multiply, one
+    ``numpy.fft.rfft`` call over the channel axis and a few in-place
+    operations, without per-sample Python code or new arrays per block.
+"""
+import numpy as np
+
+_WINDOWS = {}
+
+# Floor of the magnitudes before the conversion to dB (-300 dB).
+_MIN_MAGNITUDE = 1e-15
+
+
+def _make_window(kind, length):
+    if kind == 'hann':
+        # Periodic Hann window, 0.5 - 0.5 cos(2 pi i / n).
+        return 0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(length) / length)
+    if kind == 'hamming':
+        return 0.54 - 0.46 * np.cos(2.0 * np.pi * np.arange(length) / length)
+    if kind == 'rectangular':
+        return np.ones(length)
+    raise ValueError('Unknown window {}'.format(kind))
+
+
+def get_window(kind, length):
+    """
+    Return a cached window and its amplitude scale factors.
+
+    Args:
+        kind (str): 'hann', 'hamming' or 'rectangular'.
+        length (int): The number of samples.
+
+    Returns:
+        tuple: (window, bin scale, equivalent noise bandwidth in bins).  The
+        bin scale converts rfft magnitudes of windowed data to peak
+        amplitudes: 1 / sum(window) for DC, 2 / sum(window) for the other
+        bins (and Nyquist for odd lengths).
+    """
+    key = (kind, length)
+    cached = _WINDOWS.get(key)
+    if cached is None:
+        window = _make_window(kind, length)
+        window.flags.writeable = False
+        gain = window.sum()
+        scale = np.full(length // 2 + 1, 2.0 / gain)
+        scale[0] = 1.0 / gain
+        if length % 2 == 0:
+            scale[-1] = 1.0 / gain
+        scale.flags.writeable = False
+        enbw = length * np.sum(window * window) / (gain * gain)
+        cached = _WINDOWS[key] = (window, scale, enbw)
+    return cached
+
+
+class FftEngine(object):
+    """
+    Amplitude spectra of fixed-size multi-channel blocks.
+
+    Args:
+        num_samples (int): Samples per channel of each block.
+        num_channels (int): The number of channels (rows).
+        full_scale (float): Value that corresponds to 0 dBFS, for example
+            mcc172.info().AI_MAX_RANGE.
+        window (str): The window, see :py:func:`get_window`.
+    """
+
+    def __init__(self, num_samples, num_channels=1, full_scale=1.0,
+                 window='hann'):
+        self.num_samples = num_samples
+        self.num_channels = num_channels
+        self.full_scale = full_scale
+        self.window, self.scale, self.enbw = get_window(window, num_samples)
+        self.num_bins = num_samples // 2 + 1
+        self._windowed = np.empty((num_channels, num_samples))
+        self._complex = np.empty((num_channels, self.num_bins),
+                                 dtype=np.complex128)
+        self._magnitude = np.empty((num_channels, self.num_bins))
+        self._db = np.empty((num_channels, self.num_bins))
+        try:
+            np.fft.rfft(self._windowed, axis=1, out=self._complex)
+            self._fft_out = True
+        except TypeError:
+            # NumPy < 2.0 has no out argument.
+            self._fft_out = False
+
+    def frequencies(self, scan_rate):
+        """ Return the bin frequencies in Hz. """
+        return np.fft.rfftfreq(self.num_samples, 1.0 / scan_rate)
+
+    def transform(self, data):
+        """
+        Window the data and calculate the complex spectra.
+
+        Args:
+            data (numpy.ndarray): Samples shaped (channels, samples), or
+                (samples,) for one channel.
+
+        Returns:
+            numpy.ndarray: The complex rfft of every channel (an internal
+            buffer, overwritten by the next call).
+        """
+        data = np.asarray(data).reshape(self.num_channels, self.num_samples)
+        np.multiply(data, self.window, out=self._windowed)
+        if self._fft_out:
+            np.fft.rfft(self._windowed, axis=1, out=self._complex)
+        else:
+            self._complex[:] = np.fft.rfft(self._windowed, axis=1)
+        return self._complex
+
+    def magnitude(self, data):
+        """
+        Return the peak amplitude spectra relative to full scale.
+
+        Args:
+            data (numpy.ndarray): Samples shaped (channels, samples).
+
+        Returns:
+            numpy.ndarray: Amplitudes shaped (channels, bins); an internal
+            buffer, copy it to keep it past the next call.
+        """
+        np.abs(self.transform(data), out=self._magnitude)
+        self._magnitude *= self.scale / self.full_scale
+        return self._magnitude
+
+    def spectrum_db(self, data):
+        """
+        Return the amplitude spectra in dB relative to full scale (dBFS).
+
+        Args:
+            data (numpy.ndarray): Samples shaped (channels, samples).
+
+        Returns:
+            numpy.ndarray: dBFS shaped (channels, bins); an internal
+            buffer, copy it to keep it past the next call.
+        """
+        magnitude = self.magnitude(data)
+        np.maximum(magnitude, _MIN_MAGNITUDE, out=self._db)
+        np.log10(self._db, out=self._db)
+        self._db *= 20.0
+        return self._db
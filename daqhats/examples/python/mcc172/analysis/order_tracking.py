@@ -0,0 +1,273 @@
+"""
+    Order tracking by angular resampling.
+
+    The tachometer pulse times (see :py:mod:`rpm.tachometer`) give the shaft
+    angle at discrete instants: pulse k is at k / pulses_per_rev revolutions.
+    The MCC 172 sample clock gives the time of every vibration sample.  A
+    block is resampled to a fixed number of samples per revolution by
+    interpolating, for a uniform grid of angles, first the time (from the
+    pulses) and then the signal (from the samples), both vectorized.
+
+    In the angle domain a component that is locked to the shaft stays in one
+    bin while the speed drifts, so the order spectrum of a batch of
+    revolutions has sharp 1x, 2x and bearing order lines where the time
+    domain spectrum would smear them.
+
+    ``samples_per_rev`` should be at least the number of time samples per
+    revolution at the highest speed, otherwise vibration above the new
+    Nyquist order aliases.
+"""
+import time
+import numpy as np
+
+
+def bearing_orders(balls, ball_diameter, pitch_diameter, contact_angle=0.0):
+    """
+    Return the rolling bearing defect frequencies as shaft orders.
+
+    Args:
+        balls (int): The number of rolling elements.
+        ball_diameter (float): The rolling element diameter.
+        pitch_diameter (float): The pitch diameter (same unit).
+        contact_angle (float): The contact angle in degrees.
+
+    Returns:
+        dict: bpfo, bpfi, bsf and ftf in multiples of the shaft speed.
+    """
+    ratio = ball_diameter / pitch_diameter * \
+        float(np.cos(np.radians(contact_angle)))
+    return {
+        'bpfo': balls / 2.0 * (1.0 - ratio),
+        'bpfi': balls / 2.0 * (1.0 + ratio),
+        'bsf': pitch_diameter / (2.0 * ball_diameter) * (1.0 - ratio * ratio),
+        'ftf': 0.5 * (1.0 - ratio),
+    }
+
+
+def angle_resample(data, start_time, scan_rate, pulse_times, pulses_per_rev,
+                   samples_per_rev=512):
+    """
+    Resample a block of samples to a uniform shaft angle grid.
+
+    The grid starts at the first pulse inside the block and covers the
+    whole revolutions up to the last pulse inside the block.
+
+    Args:
+        data (numpy.ndarray): Samples shaped (channels, samples).
+        start_time (float): The time of the first sample, on the clock of
+            the pulse times.
+        scan_rate (float): The sample rate in Hz.
+        pulse_times (numpy.ndarray): Increasing pulse times.
+        pulses_per_rev (int): Pulses per revolution.
+        samples_per_rev (int): Samples per revolution of the result.
+
+    Returns:
+        tuple: (resampled data shaped (channels, revs * samples_per_rev),
+        times of the revolution starts).  Both are empty if the block holds
+        less than one revolution.
+    """
+    data = np.atleast_2d(data)
+    end_time = start_time + (data.shape[1] - 1) / scan_rate
+    pulses = pulse_times[(pulse_times >= start_time) &
+                         (pulse_times <= end_time)]
+    revs = (len(pulses) - 1) // pulses_per_rev
+    if revs < 1:
+        return np.empty((data.shape[0], 0)), np.empty(0)
+    pulses = pulses[:revs * pulses_per_rev + 1]
+
+    pulse_angles = np.arange(len(pulses)) / float(pulses_per_rev)
+    angles = np.arange(revs * samples_per_rev) / float(samples_per_rev)
+    times = np.interp(angles, pulse_angles, pulses)
+
+    position = (times - start_time) * scan_rate
+    index = np.minimum(position.astype(np.int64), data.shape[1] - 2)
+    frac = position - index
+    resampled = data[:, index] * (1.0 - frac) + data[:, index + 1] * frac
+    return resampled, pulses[::pulses_per_rev][:revs]
+
+
+def order_spectrum(resampled, samples_per_rev):
+    """
+    Calculate the amplitude spectrum of angle domain data.
+
+    Args:
+        resampled (numpy.ndarray): Samples shaped (channels, samples) from
+            :py:func:`angle_resample`.
+        samples_per_rev (int): Samples per revolution.
+
+    Returns:
+        tuple: (orders, amplitudes shaped (channels, orders)); amplitudes
+        are peak values of a Hann windowed spectrum.
+    """
+    resampled = np.atleast_2d(resampled)
+    count = resampled.shape[1]
+    window = np.hanning(count)
+    centered = resampled - resampled.mean(axis=1, keepdims=True)
+    spectrum = np.abs(np.fft.rfft(centered * window, axis=1))
+    spectrum *= 2.0 / window.sum()
+    return np.fft.rfftfreq(count, 1.0 / samples_per_rev), spectrum
+
+
+def order_amplitudes(orders, spectrum, targets):
+    """
+    Pick the amplitudes of given orders from an order spectrum.
+
+    Args:
+        orders (numpy.ndarray): The order axis.
+        spectrum (numpy.ndarray): Amplitudes shaped (channels, orders).
+        targets (dict): Name to order, e.g. {'1x': 1.0}.
+
+    Returns:
+        dict: Name to the amplitude per channel (the largest within one bin
+        of the target, which covers non-integer bearing orders).
+    """
+    step = orders[1] - orders[0]
+    result = {}
+    for name, order in targets.items():
+        center = int(round(order / step))
+        low = max(0, center - 1)
+        high = min(len(orders), center + 2)
+        result[name] = spectrum[:, low:high].max(axis=1) \
+            if low < high else np.zeros(len(spectrum))
+    return result
+
+
+class SampleClock(object):
+    """
+    Map the MCC 172 sample index to time.monotonic().
+
+    Every read returns the samples available at that moment, so the last
+    sample was taken shortly before the read returned.  The earliest
+    estimate of the clock offset is kept, allowing for a small drift
+    between the two clocks.
+
+    Args:
+        scan_rate (float): The sample rate in Hz.
+        drift (float): Allowed relative drift between the clocks.
+    """
+
+    def __init__(self, scan_rate, drift=100e-6):
+        self.scan_rate = scan_rate
+        self.drift = drift
+        self.offset = None
+        self._last = None
+
+    def update(self, total_samples, read_time=None):
+        """
+        Add one observation.
+
+        Args:
+            total_samples (int): Samples per channel read since the start.
+            read_time (float): time.monotonic() when the read returned.
+        """
+        if read_time is None:
+            read_time = time.monotonic()
+        offset = read_time - total_samples / self.scan_rate
+        if self.offset is None:
+            self.offset = offset
+        else:
+            allowance = (read_time - self._last) * self.drift
+            self.offset = min(self.offset + allowance, offset)
+        self._last = read_time
+
+    def time_of(self, sample_index):
+        """ Return the time.monotonic() time of a sample index. """
+        return self.offset + sample_index / self.scan_rate
+
+
+class OrderTracker(object):
+    """
+    Produce order spectra of batches of revolutions from acquired blocks.
+
+    Args:
+        tachometer (Tachometer): The source of pulse times.
+        scan_rate (float): The sample rate in Hz.
+        num_channels (int): The number of rows of the pushed blocks.
+        samples_per_rev (int): Angle domain samples per revolution.
+        revs_per_batch (int): Revolutions per order spectrum.
+        orders (dict): Name to order of the tracked amplitudes; 1x and 2x
+            by default.
+        max_seconds (float): Samples kept while waiting for pulses.
+    """
+
+    def __init__(self, tachometer, scan_rate, num_channels,
+                 samples_per_rev=512, revs_per_batch=16, orders=None,
+                 max_seconds=10.0):
+        # pylint: disable=too-many-arguments
+        self.tachometer = tachometer
+        self.scan_rate = scan_rate
+        self.num_channels = num_channels
+        self.samples_per_rev = samples_per_rev
+        self.revs_per_batch = revs_per_batch
+        self.orders = {'1x': 1.0, '2x': 2.0} if orders is None else orders
+        self.max_samples = int(max_seconds * scan_rate)
+        self.clock = SampleClock(scan_rate)
+        self._buffer = np.empty((num_channels, 0))
+        self._buffer_start = 0
+        self._total = 0
+
+    def push(self, block, read_time=None):
+        """
+        Add a block and return the batches that are complete.
+
+        Args:
+            block (numpy.ndarray): Samples shaped (channels, samples).
+            read_time (float): time.monotonic() when the block was read.
+
+        Returns:
+            list[dict]: Per batch: time (time.time() of the first
+            revolution), rpm, resampled (the angle domain data), orders,
+            spectrum (channels, orders) and amplitudes (name to value per
+            channel).
+        """
+        self._total += block.shape[1]
+        self.clock.update(self._total, read_time)
+        self._buffer = np.concatenate((self._buffer, block), axis=1)
+
+        results = []
+        pulses_per_rev = self.tachometer.pulses_per_rev
+        while True:
+            start = self.clock.time_of(self._buffer_start)
+            end = self.clock.time_of(self._buffer_start +
+                                     self._buffer.shape[1] - 1)
+            pulses = self.tachometer.timestamps(start, end)
+            needed = self.revs_per_batch * pulses_per_rev + 1
+            if len(pulses) < needed:
+                break
+            batch_end = pulses[needed - 1]
+            used = int((batch_end - start) * self.scan_rate) + 2
+            resampled, rev_times = angle_resample(
+                self._buffer[:, :used], start, self.scan_rate,
+                pulses[:needed], pulses_per_rev, self.samples_per_rev)
+            orders, spectrum = order_spectrum(resampled, self.samples_per_rev)
+            results.append({
+                'time': time.time() - (time.monotonic() - rev_times[0]),
+                'rpm': 60.0 * self.revs_per_batch /
+                       float(batch_end - rev_times[0]),
+                'resampled': resampled,
+                'orders': orders,
+                'spectrum': spectrum,
+                'amplitudes': order_amplitudes(orders, spectrum,
+                                               self.orders),
+            })
+            self._drop(used - 2)
+
+        if self._buffer.shape[1] > self.max_samples:
+            # No pulses, e.g. the motor is stopped.
+            self._drop(self._buffer.shape[1] - self.max_samples)
+        return results
+
+    def reset(self, scan_rate, num_channels):
+        """ Start over after the scan was restarted. """
+        self.max_samples = int(self.max_samples * scan_rate /
+                               self.scan_rate)
+        self.scan_rate = scan_rate
+        self.num_channels = num_channels
+        self.clock = SampleClock(scan_rate)
+        self._buffer = np.empty((num_channels, 0))
+        self._buffer_start = 0
+        self._total = 0
+
+    def _drop(self, count):
+        self._buffer = self._buffer[:, count:]
+        self._buffer_start += count
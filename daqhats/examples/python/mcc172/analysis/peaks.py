@@ -0,0 +1,233 @@
+"""
+    Spectral peaks, harmonic families and peak tracking.
+
+    All functions work on spectra shaped (channels, bins) at once: the
+    local maxima of every channel are found with array comparisons, the N
+    largest are selected with ``argpartition`` and refined with parabolic
+    interpolation of the three bins around each peak, so the cost per
+    spectrum is a few passes over the bins and no Python loop over them.
+    Peaks are given as fractional bins; multiply by the bin spacing for Hz.
+"""
+import numpy as np
+
+
+def parabolic_interpolate(left, center, right):
+    """
+    Refine peaks from the values of the bins around them.
+
+    Args:
+        left, center, right (numpy.ndarray): The values of the bins below,
+            at and above each peak (e.g. in dB).
+
+    Returns:
+        tuple: (offset from the center bin, -0.5 - 0.5, interpolated peak
+        value).
+    """
+    denominator = left - 2.0 * center + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(denominator < 0.0,
+                          0.5 * (left - right) / denominator, 0.0)
+    offset = np.clip(offset, -0.5, 0.5)
+    return offset, center - 0.25 * (left - right) * offset
+
+
+def find_peaks(spectra, count=5, threshold=None):
+    """
+    Find the largest local maxima of every channel.
+
+    Args:
+        spectra (numpy.ndarray): Spectra shaped (channels, bins), or
+            (bins,) for one channel.
+        count (int): The number of peaks per channel.
+        threshold (float): Ignore peaks below this value.
+
+    Returns:
+        tuple: (bins, values), both shaped (channels, count) and sorted by
+        decreasing value.  Bins are fractional; missing peaks have bin NaN
+        and value -inf.
+    """
+    spectra = np.atleast_2d(spectra)
+    num_channels, num_bins = spectra.shape
+    inner = spectra[:, 1:-1]
+    candidates = np.full((num_channels, num_bins), -np.inf)
+    is_peak = (inner > spectra[:, :-2]) & (inner >= spectra[:, 2:])
+    if threshold is not None:
+        is_peak &= inner >= threshold
+    candidates[:, 1:-1] = np.where(is_peak, inner, -np.inf)
+
+    count = min(count, num_bins)
+    index = np.argpartition(candidates, num_bins - count,
+                            axis=1)[:, num_bins - count:]
+    order = np.argsort(-np.take_along_axis(candidates, index, axis=1),
+                       axis=1)
+    index = np.take_along_axis(index, order, axis=1)
+    found = np.isfinite(np.take_along_axis(candidates, index, axis=1))
+
+    # Edge indices only occur for missing peaks; clip for the gather.
+    index = np.clip(index, 1, num_bins - 2)
+    rows = np.arange(num_channels)[:, None]
+    offset, values = parabolic_interpolate(spectra[rows, index - 1],
+                                           spectra[rows, index],
+                                           spectra[rows, index + 1])
+    bins = np.where(found, index + offset, np.nan)
+    return bins, np.where(found, values, -np.inf)
+
+
+def harmonic_levels(spectra, fundamentals, harmonics=8):
+    """
+    Return the spectrum values at the harmonics of the fundamentals.
+
+    Args:
+        spectra (numpy.ndarray): Spectra shaped (channels, bins).
+        fundamentals (numpy.ndarray): Fractional fundamental bin of every
+            channel.
+        harmonics (int): The highest harmonic (the fundamental is 1).
+
+    Returns:
+        tuple: (bins, values) shaped (channels, harmonics - 1) for the
+        harmonics 2, 3, ...; harmonics beyond the last bin have bin NaN
+        and value NaN.
+    """
+    spectra = np.atleast_2d(spectra)
+    num_bins = spectra.shape[1]
+    bins = np.outer(np.atleast_1d(fundamentals), np.arange(2, harmonics + 1))
+    valid = bins <= num_bins - 1
+    index = np.clip(np.nan_to_num(np.floor(bins + 0.5)), 0,
+                    num_bins - 1).astype(int)
+    values = np.take_along_axis(spectra, index, axis=1)
+    return np.where(valid, bins, np.nan), np.where(valid, values, np.nan)
+
+
+def harmonic_families(bins, values, tolerance=0.02, max_order=16):
+    """
+    Group peaks into harmonic families.
+
+    The strongest peak that is not yet in a family starts a new family;
+    every other free peak close to an integer multiple of it (within
+    ``tolerance`` of the multiple) joins it.
+
+    Args:
+        bins (numpy.ndarray): Peak bins shaped (channels, peaks), sorted by
+            decreasing value as returned by :py:func:`find_peaks`.
+        values (numpy.ndarray): The peak values.
+        tolerance (float): Relative frequency tolerance.
+        max_order (int): The highest harmonic order joined.
+
+    Returns:
+        tuple: (family, order), both shaped (channels, peaks): the index of
+        the family's fundamental peak (-1 for missing peaks) and the
+        harmonic order of each peak.
+    """
+    bins = np.atleast_2d(bins)
+    num_channels, num_peaks = bins.shape
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # ratio[c, i, j]: peak j as a multiple of peak i.
+        ratio = bins[:, None, :] / bins[:, :, None]
+        order = np.rint(ratio)
+        related = (order >= 2) & (order <= max_order) & \
+            (np.abs(ratio - order) <= tolerance * order)
+    family = np.full((num_channels, num_peaks), -1)
+    family[~np.isfinite(np.atleast_2d(values)) | np.isnan(bins)] = -2
+    harmonic = np.zeros((num_channels, num_peaks), dtype=int)
+    rows = np.arange(num_channels)
+    # One step per fundamental candidate, vectorized over channels.
+    for i in range(num_peaks):
+        starts = family[:, i] == -1
+        family[rows[starts], i] = i
+        harmonic[rows[starts], i] = 1
+        joins = related[:, i, :] & (family == -1) & starts[:, None]
+        family[joins] = i
+        harmonic[joins] = order[:, i, :][joins]
+    family[family == -2] = -1
+    return family, harmonic
+
+
+class PeakTracker(object):
+    """
+    Follow peaks from spectrum to spectrum.
+
+    Every track has an id that stays the same while its frequency moves by
+    less than ``max_jump`` between spectra; a track that is not matched in
+    ``max_missed`` consecutive spectra is dropped.
+
+    Args:
+        num_channels (int): The number of channels.
+        max_jump (float): The largest frequency change between spectra, in
+            the unit of the peaks (bins or Hz).
+        max_missed (int): Spectra without a match before a track ends.
+    """
+
+    def __init__(self, num_channels, max_jump=2.0, max_missed=3):
+        self.num_channels = num_channels
+        self.max_jump = max_jump
+        self.max_missed = max_missed
+        self._next_id = 0
+        # Per channel: arrays of id, frequency, value, age and missed.
+        self.tracks = [self._empty() for _ in range(num_channels)]
+
+    @staticmethod
+    def _empty():
+        return {'id': np.empty(0, dtype=int), 'frequency': np.empty(0),
+                'value': np.empty(0), 'age': np.empty(0, dtype=int),
+                'missed': np.empty(0, dtype=int)}
+
+    def update(self, frequencies, values):
+        """
+        Match the peaks of a new spectrum to the tracks.
+
+        Args:
+            frequencies (numpy.ndarray): Peaks shaped (channels, peaks);
+                NaN for missing peaks.
+            values (numpy.ndarray): The peak values.
+
+        Returns:
+            numpy.ndarray: The track id of every peak (-1 for missing
+            peaks), shaped like frequencies.
+        """
+        frequencies = np.atleast_2d(frequencies)
+        values = np.atleast_2d(values)
+        ids = np.full(frequencies.shape, -1)
+        for channel in range(self.num_channels):
+            ids[channel] = self._update_channel(
+                channel, frequencies[channel], values[channel])
+        return ids
+
+    def _update_channel(self, channel, frequencies, values):
+        tracks = self.tracks[channel]
+        present = ~np.isnan(frequencies)
+        ids = np.full(len(frequencies), -1)
+
+        # Greedy matching of the closest (track, peak) pairs first.
+        distance = np.abs(tracks['frequency'][:, None] - frequencies[None, :])
+        distance[:, ~present] = np.inf
+        track_matched = np.zeros(len(tracks['id']), dtype=bool)
+        peak_matched = np.zeros(len(frequencies), dtype=bool)
+        for flat in np.argsort(distance, axis=None):
+            track, peak = np.unravel_index(flat, distance.shape)
+            if distance[track, peak] > self.max_jump:
+                break
+            if track_matched[track] or peak_matched[peak]:
+                continue
+            track_matched[track] = peak_matched[peak] = True
+            ids[peak] = tracks['id'][track]
+            tracks['frequency'][track] = frequencies[peak]
+            tracks['value'][track] = values[peak]
+
+        tracks['age'][track_matched] += 1
+        tracks['missed'][track_matched] = 0
+        tracks['missed'][~track_matched] += 1
+        keep = tracks['missed'] <= self.max_missed
+        for name in tracks:
+            tracks[name] = tracks[name][keep]
+
+        new = present & ~peak_matched
+        count = int(np.count_nonzero(new))
+        ids[new] = self._next_id + np.arange(count)
+        self._next_id += count
+        for name, added in (('id', ids[new]),
+                            ('frequency', frequencies[new]),
+                            ('value', values[new]),
+                            ('age', np.ones(count, dtype=int)),
+                            ('missed', np.zeros(count, dtype=int))):
+            tracks[name] = np.concatenate((tracks[name], added))
+        return ids
@@ -0,0 +1,73 @@
+"""
+    Tests of the envelope analysis.
+
+    Run from the mcc172 directory with ``python -m pytest analysis`` or
+    ``python -m unittest analysis.test_envelope``.
+"""
+import unittest
+import numpy as np
+from analysis.envelope import EnvelopeAnalyzer, band_mask
+
+
+class EnvelopeTest(unittest.TestCase):
+    """ Amplitude modulated resonances. """
+
+    scan_rate = 10240.0
+    num_samples = 10240
+
+    def _modulated(self, defect, depth, carrier=3000.0, seed=0):
+        """ A carrier modulated at the defect frequency, plus a 30 Hz line
+        outside the band and some noise. """
+        t = np.arange(self.num_samples) / self.scan_rate
+        rng = np.random.default_rng(seed)
+        return (1.0 + depth * np.sin(2 * np.pi * defect * t)) * \
+            np.sin(2 * np.pi * carrier * t) + \
+            2.0 * np.sin(2 * np.pi * 30.0 * t) + \
+            rng.normal(0.0, 0.01, size=self.num_samples)
+
+    def test_defect_amplitude(self):
+        # 1800 rpm (30 Hz) and an outer race order of 3.5: 105 Hz.
+        analyzer = EnvelopeAnalyzer(self.num_samples, 2, self.scan_rate,
+                                    (2800.0, 3200.0), {'bpfo': 3.5,
+                                                       'bpfi': 5.5},
+                                    harmonics=4)
+        data = np.vstack((self._modulated(105.0, 0.5),
+                          self._modulated(105.0, 0.0, seed=1)))
+        result = analyzer.analyze(data, rpm=1800.0)
+        frequencies = analyzer.frequencies()
+        self.assertEqual(frequencies[np.argmax(result['spectrum'][0])],
+                         105.0)
+        bpfo = result['amplitudes']['bpfo']
+        self.assertEqual(bpfo.shape, (2, 4))
+        self.assertAlmostEqual(bpfo[0, 0], 0.5, delta=0.02)
+        self.assertLess(bpfo[0, 1], 0.05)
+        # 420 Hz is beyond the 400 Hz band width.
+        self.assertEqual(bpfo[0, 3], 0.0)
+        self.assertLess(bpfo[1, 0], 0.05)
+        self.assertLess(result['amplitudes']['bpfi'][0, 0], 0.05)
+        # Envelope RMS of 0.5 sin.
+        self.assertAlmostEqual(result['rms'][0], 0.5 / np.sqrt(2),
+                               delta=0.02)
+        self.assertLess(result['rms'][1], 0.05)
+
+    def test_no_rpm(self):
+        analyzer = EnvelopeAnalyzer(self.num_samples, 1, self.scan_rate,
+                                    (2000.0, 4000.0), {'bpfo': 3.5})
+        result = analyzer.analyze(self._modulated(105.0, 0.5)[None, :])
+        self.assertEqual(result['amplitudes'], {})
+
+    def test_band_mask(self):
+        mask = band_mask(1024, 1024.0, (100.0, 200.0), transition=20.0)
+        freqs = np.fft.rfftfreq(1024, 1.0 / 1024.0)
+        np.testing.assert_array_equal(mask[(freqs >= 100) & (freqs <= 200)],
+                                      2.0)
+        np.testing.assert_array_equal(mask[(freqs <= 80) | (freqs >= 220)],
+                                      0.0)
+        self.assertAlmostEqual(mask[90], 1.0)
+        for band in ((0.0, 100.0), (200.0, 100.0), (100.0, 600.0)):
+            with self.assertRaises(ValueError):
+                band_mask(1024, 1024.0, band)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+    Tests of the spectral peaks, harmonic families and peak tracking.
+
+    Run from the mcc172 directory with ``python -m pytest analysis`` or
+    ``python -m unittest analysis.test_peaks``.
+"""
+import unittest
+import numpy as np
+from analysis.peaks import PeakTracker, find_peaks, harmonic_families, \
+    harmonic_levels
+
+
+def _spectrum(num_bins, peaks, curvature=2.0, floor=-100.0):
+    """ Parabolic peaks (in dB) at fractional bins: (bin, level) pairs. """
+    bins = np.arange(num_bins, dtype=np.float64)
+    spectrum = np.full(num_bins, floor)
+    for center, level in peaks:
+        spectrum = np.maximum(spectrum,
+                              level - curvature * (bins - center) ** 2)
+    return spectrum
+
+
+class FindPeaksTest(unittest.TestCase):
+    """ Largest local maxima with parabolic interpolation. """
+
+    def test_interpolation(self):
+        peaks = [(20.3, -10.0), (41.75, -3.0), (63.5, -20.0), (90.0, -15.0)]
+        spectra = np.array([_spectrum(128, peaks), _spectrum(128, [])])
+        bins, values = find_peaks(spectra, count=3)
+        # The bins of a parabola are interpolated exactly.
+        np.testing.assert_allclose(bins[0], [41.75, 20.3, 90.0])
+        np.testing.assert_allclose(values[0], [-3.0, -10.0, -15.0])
+        # No peaks on a flat spectrum.
+        self.assertTrue(np.all(np.isnan(bins[1])))
+        self.assertTrue(np.all(values[1] == -np.inf))
+
+    def test_threshold(self):
+        spectrum = _spectrum(128, [(20.0, -10.0), (60.0, -30.0)])
+        bins, values = find_peaks(spectrum, count=3, threshold=-20.0)
+        np.testing.assert_allclose(bins[0, :1], [20.0])
+        self.assertTrue(np.all(np.isnan(bins[0, 1:])))
+        self.assertTrue(np.all(values[0, 1:] == -np.inf))
+
+    def test_fft_tone(self):
+        # A tone between two bins of a Hann windowed FFT.
+        scan_rate, num_samples = 1024.0, 1024
+        t = np.arange(num_samples) / scan_rate
+        window = np.hanning(num_samples)
+        spectrum = 20 * np.log10(np.abs(np.fft.rfft(
+            window * np.sin(2 * np.pi * 100.4 * t))) + 1e-12)
+        bins, _ = find_peaks(spectrum, count=1)
+        self.assertAlmostEqual(bins[0, 0], 100.4, delta=0.05)
+
+
+class HarmonicsTest(unittest.TestCase):
+    """ Harmonic families and levels. """
+
+    def test_families(self):
+        # Sorted by decreasing value: 10 Hz with its 2nd and 3rd harmonic,
+        # 7 Hz with its 2nd, and 10.3 Hz, which is not the 1st harmonic of
+        # 10 Hz but a family of its own.
+        bins = np.array([[10.0, 20.1, 7.0, 30.0, 14.0, 10.3, np.nan]])
+        values = np.array([[0.0, -1.0, -2.0, -3.0, -4.0, -5.0, -np.inf]])
+        family, order = harmonic_families(bins, values)
+        np.testing.assert_array_equal(family, [[0, 0, 2, 0, 2, 5, -1]])
+        np.testing.assert_array_equal(order, [[1, 2, 1, 3, 2, 1, 0]])
+
+    def test_tolerance(self):
+        bins = np.array([[10.0, 20.5]])
+        family, _ = harmonic_families(bins, np.zeros((1, 2)),
+                                      tolerance=0.02)
+        np.testing.assert_array_equal(family, [[0, 1]])
+        family, order = harmonic_families(bins, np.zeros((1, 2)),
+                                          tolerance=0.05)
+        np.testing.assert_array_equal(family, [[0, 0]])
+        np.testing.assert_array_equal(order, [[1, 2]])
+
+    def test_levels(self):
+        spectra = np.vstack((np.arange(40.0), -np.arange(40.0)))
+        bins, values = harmonic_levels(spectra, [10.2, 15.0], harmonics=4)
+        np.testing.assert_allclose(bins, [[20.4, 30.6, np.nan],
+                                          [30.0, np.nan, np.nan]])
+        np.testing.assert_allclose(values, [[20.0, 31.0, np.nan],
+                                            [-30.0, np.nan, np.nan]])
+
+
+class PeakTrackerTest(unittest.TestCase):
+    """ Track ids follow moving peaks. """
+
+    def test_ids(self):
+        tracker = PeakTracker(1, max_jump=2.0, max_missed=2)
+        nothing = np.array([[np.nan]])
+        np.testing.assert_array_equal(
+            tracker.update([[10.0, 50.0, np.nan]], [[1.0, 2.0, 0.0]]),
+            [[0, 1, -1]])
+        # Reordered and drifting peaks keep their ids; a new one is added.
+        np.testing.assert_array_equal(
+            tracker.update([[51.5, 11.0, 80.0]], [[2.0, 1.0, 3.0]]),
+            [[1, 0, 2]])
+        # A jump larger than max_jump starts a new track.
+        np.testing.assert_array_equal(
+            tracker.update([[11.5, 55.0]], [[1.0, 2.0]]), [[0, 3]])
+        self.assertEqual(sorted(tracker.tracks[0]['id']), [0, 1, 2, 3])
+        for _ in range(3):
+            tracker.update(nothing, nothing)
+        self.assertEqual(len(tracker.tracks[0]['id']), 0)
+        np.testing.assert_array_equal(tracker.update([[11.5]], [[1.0]]),
+                                      [[4]])
+
+
+if __name__ == '__main__':
+    unittest.main()
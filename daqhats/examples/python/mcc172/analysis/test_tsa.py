@@ -0,0 +1,70 @@
+"""
+    Tests of the time-synchronous average.
+
+    Run from the mcc172 directory with ``python -m pytest analysis`` or
+    ``python -m unittest analysis.test_tsa``.
+"""
+import unittest
+import numpy as np
+from analysis.tsa import SynchronousAverager, decode_average
+
+
+def _revolutions(num_revs, samples_per_rev, noise, seed=0):
+    """ A 1x and 2x locked signal plus noise, shaped (2, samples). """
+    angle = 2 * np.pi * np.arange(num_revs * samples_per_rev) / \
+        samples_per_rev
+    locked = np.array([0.5 * np.sin(angle + 0.3),
+                       0.2 * np.cos(2 * angle)])
+    rng = np.random.default_rng(seed)
+    return locked + rng.normal(0.0, noise, size=locked.shape)
+
+
+class SynchronousAveragerTest(unittest.TestCase):
+    """ Locked signals survive the average, noise does not. """
+
+    def test_locked_signal(self):
+        averager = SynchronousAverager(2, samples_per_rev=256, depth=64)
+        averager.add(_revolutions(64, 256, noise=1.0), rpm=1800.0)
+        self.assertEqual(averager.revolutions, 64)
+        features = averager.features()
+        # Noise of 1.0 RMS is averaged down to 1 / sqrt(64).
+        np.testing.assert_allclose(features['tsa_1x'], [0.5, 0.0],
+                                   atol=0.03)
+        np.testing.assert_allclose(features['tsa_2x'], [0.0, 0.2],
+                                   atol=0.03)
+        # sin(angle + 0.3) is cos(angle + 0.3 - 90 deg).
+        self.assertAlmostEqual(features['tsa_phase_1x'][0],
+                               np.degrees(0.3) - 90.0, delta=5.0)
+        self.assertLess(features['tsa_ratio'][0], 0.5)
+
+    def test_ring(self):
+        # More revolutions than the depth, added in uneven pieces, average
+        # the same as the last depth revolutions.
+        data = _revolutions(50, 32, noise=0.5, seed=1)
+        averager = SynchronousAverager(2, samples_per_rev=32, depth=8)
+        for first, count in ((0, 3), (3, 11), (14, 1), (15, 35)):
+            averager.add(data[:, first * 32:(first + count) * 32])
+        expected = data[:, -8 * 32:].reshape(2, 8, 32).mean(axis=1)
+        np.testing.assert_allclose(averager.average, expected)
+        averager.reset()
+        self.assertEqual(averager.revolutions, 0)
+        np.testing.assert_array_equal(averager.average, 0.0)
+
+    def test_round_trip(self):
+        averager = SynchronousAverager(2, samples_per_rev=128, depth=16)
+        averager.add(_revolutions(20, 128, noise=0.1), rpm=1496.5)
+        channel, revs, rpm, values = decode_average(averager.encode(1, 3))
+        self.assertEqual((channel, revs), (3, 16))
+        self.assertAlmostEqual(rpm, 1496.5, places=3)
+        np.testing.assert_array_equal(values,
+                                      averager.average[1].astype(np.float32))
+
+    def test_errors(self):
+        payload = SynchronousAverager(1, samples_per_rev=8).encode(0, 0)
+        for broken in (payload[:5], b'XX' + payload[2:]):
+            with self.assertRaises(ValueError):
+                decode_average(broken)
+
+
+if __name__ == '__main__':
+    unittest.main()
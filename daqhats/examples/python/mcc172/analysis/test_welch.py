@@ -0,0 +1,82 @@
+"""
+    Tests of the streaming Welch PSD.
+
+    Run from the mcc172 directory with ``python -m pytest analysis`` or
+    ``python -m unittest analysis.test_welch``.
+"""
+import unittest
+import numpy as np
+from analysis.welch import WelchAverager, decode_psd
+
+
+class WelchAveragerTest(unittest.TestCase):
+    """ PSD levels of synthetic signals and the message round trip. """
+
+    scan_rate = 10240.0
+
+    def _signal(self, num_samples, seed=0):
+        """ A 1 V 500 Hz sine on row 0 and 0.1 V RMS white noise on row 1. """
+        t = np.arange(num_samples) / self.scan_rate
+        rng = np.random.default_rng(seed)
+        return np.array([np.sin(2 * np.pi * 500.0 * t),
+                         rng.normal(0.0, 0.1, size=num_samples)])
+
+    def test_levels(self):
+        averager = WelchAverager(2, self.scan_rate, segment_length=1024,
+                                 interval=4.0)
+        signal = self._signal(int(4 * self.scan_rate) + 1024)
+        outputs = []
+        for start in range(0, signal.shape[1], 1000):
+            outputs.extend(averager.push(signal[:, start:start + 1000]))
+        self.assertEqual(len(outputs), 1)
+        psd = outputs[0]['psd']
+        self.assertEqual(outputs[0]['segments'],
+                         averager.segments_per_output)
+        frequencies = averager.frequencies()
+        # The tone lands in its bin and its power (0.5 V^2) is kept.
+        self.assertEqual(frequencies[np.argmax(psd[0])], 500.0)
+        self.assertAlmostEqual(np.sum(psd[0]) * averager.resolution, 0.5,
+                               delta=0.01)
+        # White noise: sigma^2 spread over 0 - fs/2.
+        level = 0.1 ** 2 / (self.scan_rate / 2)
+        self.assertAlmostEqual(np.mean(psd[1][1:-1]) / level, 1.0,
+                               delta=0.05)
+
+    def test_blocks(self):
+        # The block size does not change the result.
+        signal = self._signal(20000, seed=1)
+        whole = WelchAverager(2, self.scan_rate, segment_length=512,
+                              interval=1.0)
+        split = WelchAverager(2, self.scan_rate, segment_length=512,
+                              interval=1.0)
+        expected = whole.push(signal)
+        outputs = []
+        for start in range(0, 20000, 333):
+            outputs.extend(split.push(signal[:, start:start + 333]))
+        self.assertEqual(len(outputs), len(expected))
+        for output, reference in zip(outputs, expected):
+            self.assertEqual(output['sample'], reference['sample'])
+            np.testing.assert_allclose(output['psd'], reference['psd'])
+
+    def test_round_trip(self):
+        averager = WelchAverager(2, self.scan_rate, segment_length=512,
+                                 interval=1.0)
+        output = averager.push(self._signal(12000))[0]
+        decoded = decode_psd(averager.encode(output, 1, 3))
+        self.assertEqual(decoded['channel'], 3)
+        self.assertEqual(decoded['segments'], output['segments'])
+        self.assertAlmostEqual(decoded['resolution'], 20.0)
+        np.testing.assert_array_equal(decoded['psd'],
+                                      output['psd'][1].astype(np.float32))
+        with self.assertRaises(ValueError):
+            decode_psd(b'XX' + averager.encode(output, 0, 0)[2:])
+
+    def test_arguments(self):
+        with self.assertRaises(ValueError):
+            WelchAverager(1, self.scan_rate, averaging='median')
+        with self.assertRaises(ValueError):
+            WelchAverager(1, self.scan_rate, overlap=1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
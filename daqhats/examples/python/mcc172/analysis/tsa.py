@@ -0,0 +1,162 @@
+"""
+    Time-synchronous averaging.
+
+    The angle domain data of :py:class:`analysis.OrderTracker` holds a fixed
+    number of samples per revolution, so every revolution is one row of a
+    (revolutions, samples_per_rev) array.  Averaging the rows keeps what is
+    locked to the shaft angle (unbalance, misalignment) and cancels
+    everything else.  The average runs over the last ``depth`` revolutions,
+    kept in a preallocated ring with a running sum.
+
+    Averages are published as small binary messages (little endian,
+    version 1)::
+
+        magic 'TS' | version u8 | channel u8 | samples u16 | revs u16 |
+        rpm f32 | float32 samples
+"""
+import struct
+import numpy as np
+
+TSA_VERSION = 1
+
+_TSA_HEADER = struct.Struct('<2sBBHHf')
+
+
+class SynchronousAverager(object):
+    """
+    Running time-synchronous average over the last revolutions.
+
+    Args:
+        num_channels (int): The number of channels.
+        samples_per_rev (int): Samples per revolution of the added data.
+        depth (int): The number of revolutions averaged.
+    """
+
+    def __init__(self, num_channels, samples_per_rev=512, depth=64):
+        self.num_channels = num_channels
+        self.samples_per_rev = samples_per_rev
+        self.depth = depth
+        self._revs = np.zeros((depth, num_channels, samples_per_rev))
+        # Mean square of each revolution, for the synchronous ratio.
+        self._power = np.zeros((depth, num_channels))
+        self._sum = np.zeros((num_channels, samples_per_rev))
+        self._count = 0
+        self.rpm = 0.0
+
+    @property
+    def revolutions(self):
+        """ The number of revolutions in the average. """
+        return min(self._count, self.depth)
+
+    @property
+    def average(self):
+        """ The average revolution, shaped (channels, samples_per_rev). """
+        if not self._count:
+            return np.zeros_like(self._sum)
+        return self._sum / self.revolutions
+
+    def add(self, resampled, rpm=None):
+        """
+        Add whole revolutions of angle domain data.
+
+        Args:
+            resampled (numpy.ndarray): Samples shaped (channels,
+                revs * samples_per_rev), starting at a revolution start.
+            rpm (float): The speed of the revolutions, kept for the output.
+        """
+        revs = np.atleast_2d(resampled).reshape(
+            self.num_channels, -1, self.samples_per_rev).transpose(1, 0, 2)
+        if len(revs) > self.depth:
+            revs = revs[-self.depth:]
+        count = len(revs)
+        slots = (self._count + np.arange(count)) % self.depth
+        # Replace the oldest revolutions in the running sum.
+        if self._count >= self.depth:
+            self._sum -= self._revs[slots].sum(axis=0)
+        elif self._count + count > self.depth:
+            old = slots[self._count + np.arange(count) >= self.depth]
+            self._sum -= self._revs[old].sum(axis=0)
+        self._revs[slots] = revs
+        self._power[slots] = np.mean(revs * revs, axis=2)
+        self._sum += revs.sum(axis=0)
+        self._count += count
+        if self._count % (self.depth * 256) < count:
+            # Clear the rounding errors of the running sum now and then.
+            self._sum = self._revs[:self.revolutions].sum(axis=0)
+        if rpm is not None:
+            self.rpm = rpm
+
+    def reset(self):
+        """ Forget all revolutions, e.g. after a speed or setup change. """
+        self._revs[:] = 0
+        self._power[:] = 0
+        self._sum[:] = 0
+        self._count = 0
+
+    def features(self):
+        """
+        Return summary features of the average.
+
+        Returns:
+            dict: Name to value per channel: tsa_rms, tsa_p2p (peak to
+            peak), tsa_1x and tsa_2x (amplitudes of the first two shaft
+            orders), tsa_phase_1x (degrees) and tsa_ratio (synchronous
+            share of the total RMS).
+        """
+        average = self.average
+        centered = average - average.mean(axis=1, keepdims=True)
+        rms = np.sqrt(np.mean(centered * centered, axis=1))
+        spectrum = np.fft.rfft(centered, axis=1) * \
+            (2.0 / self.samples_per_rev)
+        revs = self.revolutions
+        total = np.sqrt(self._power[:revs].mean(axis=0)) if revs else \
+            np.zeros(self.num_channels)
+        return {
+            'tsa_rms': rms,
+            'tsa_p2p': centered.max(axis=1) - centered.min(axis=1),
+            'tsa_1x': np.abs(spectrum[:, 1]),
+            'tsa_2x': np.abs(spectrum[:, 2]),
+            'tsa_phase_1x': np.degrees(np.angle(spectrum[:, 1])),
+            'tsa_ratio': np.divide(rms, total, out=np.zeros_like(rms),
+                                   where=total > 0),
+        }
+
+    def encode(self, row, channel):
+        """
+        Encode the average of one channel for publishing.
+
+        Args:
+            row (int): The channel row.
+            channel (int): The channel number written to the message.
+
+        Returns:
+            bytes: The message.
+        """
+        return _TSA_HEADER.pack(b'TS', TSA_VERSION, channel,
+                                self.samples_per_rev, self.revolutions,
+                                self.rpm) + \
+            self.average[row].astype('<f4').tobytes()
+
+
+def decode_average(payload):
+    """
+    Decode a message produced by :py:meth:`SynchronousAverager.encode`.
+
+    Args:
+        payload (bytes): The MQTT message payload.
+
+    Returns:
+        tuple: (channel, revolutions, rpm, float32 average).
+
+    Raises:
+        ValueError: The payload is not a version 1 average.
+    """
+    if len(payload) < _TSA_HEADER.size:
+        raise ValueError('TSA message too short')
+    magic, version, channel, samples, revs, rpm = \
+        _TSA_HEADER.unpack_from(payload)
+    if magic != b'TS' or version != TSA_VERSION:
+        raise ValueError('Not a TSA message')
+    values = np.frombuffer(payload, dtype='<f4', count=samples,
+                           offset=_TSA_HEADER.size)
+    return channel, revs, rpm, values
@@ -0,0 +1,202 @@
+"""
+    Streaming Welch power spectral density.
+
+    Continuous scan blocks of any size are copied into a staging buffer of
+    one segment per channel; every ``hop`` samples a full segment is
+    windowed and transformed for all channels at once by an
+    :py:class:`analysis.FftEngine` and its power is added to the average in
+    place.  After ``interval`` seconds of data the averaged one-sided PSD
+    (V^2/Hz) is emitted.  The memory is one segment of samples and two
+    spectra per channel, however long the scan runs.
+
+    Two kinds of averaging are supported:
+
+    - linear: the mean of the segments since the previous output, then the
+      sum restarts,
+    - exponential: a running average with weight 1 / ``averages`` for the
+      newest segment, never restarted, so old segments fade out.
+
+    Spectra are published as small binary messages (little endian,
+    version 1)::
+
+        magic 'PS' | version u8 | channel u8 | bins u16 | segments u16 |
+        resolution f32 (Hz) | float32 PSD
+"""
+import struct
+import numpy as np
+from analysis.fft import FftEngine
+
+PSD_VERSION = 1
+
+_PSD_HEADER = struct.Struct('<2sBBHHf')
+
+AVERAGING = ('linear', 'exponential')
+
+
+class WelchAverager(object):
+    """
+    Averaged PSD of a continuous multi-channel scan.
+
+    Args:
+        num_channels (int): The number of channels.
+        scan_rate (float): The scan rate in S/s.
+        segment_length (int): Samples per FFT segment.
+        overlap (float): Overlap of consecutive segments, 0 <= overlap < 1.
+        interval (float): Seconds of data between outputs.
+        averaging (str): 'linear' or 'exponential'.
+        averages (int): Weight of the exponential average, in segments.
+        window (str): The window, see :py:func:`analysis.get_window`.
+    """
+    # pylint: disable=too-many-arguments, too-many-instance-attributes
+
+    def __init__(self, num_channels, scan_rate, segment_length=4096,
+                 overlap=0.5, interval=10.0, averaging='linear', averages=16,
+                 window='hann'):
+        if averaging not in AVERAGING:
+            raise ValueError('averaging must be one of {}'.format(AVERAGING))
+        if not 0.0 <= overlap < 1.0:
+            raise ValueError('overlap must be 0 - 1')
+        self.num_channels = num_channels
+        self.scan_rate = scan_rate
+        self.segment_length = segment_length
+        self.hop = max(1, int(round(segment_length * (1.0 - overlap))))
+        self.averaging = averaging
+        self.alpha = 1.0 / max(1, averages)
+        # Segments between outputs.
+        self.segments_per_output = max(
+            1, int(round(interval * scan_rate / self.hop)))
+
+        self._engine = FftEngine(segment_length, num_channels, window=window)
+        window_values = self._engine.window
+        # One-sided PSD: |X|^2 * 2 / (fs * sum(w^2)); DC and Nyquist once.
+        self._scale = np.full(self._engine.num_bins,
+                              2.0 / (scan_rate * np.sum(window_values ** 2)))
+        self._scale[0] /= 2.0
+        if segment_length % 2 == 0:
+            self._scale[-1] /= 2.0
+
+        self._stage = np.zeros((num_channels, segment_length))
+        self._fill = 0
+        self._power = np.empty((num_channels, self._engine.num_bins))
+        self._average = np.zeros((num_channels, self._engine.num_bins))
+        self._count = 0
+        self._since_output = 0
+        self.samples = 0
+        self.segments = 0
+
+    @property
+    def resolution(self):
+        """ The bin spacing in Hz. """
+        return self.scan_rate / self.segment_length
+
+    def frequencies(self):
+        """ Return the bin frequencies in Hz. """
+        return self._engine.frequencies(self.scan_rate)
+
+    def reset(self):
+        """ Discard the buffered samples and the average. """
+        self._fill = 0
+        self._average[:] = 0.0
+        self._count = 0
+        self._since_output = 0
+
+    def psd(self):
+        """ Return a copy of the current average, shaped (channels, bins). """
+        if self.averaging == 'linear' and self._count:
+            return self._average / self._count
+        return self._average.copy()
+
+    def push(self, block):
+        """
+        Add a block of samples.
+
+        Args:
+            block (numpy.ndarray): Samples shaped (channels, samples).
+
+        Returns:
+            list: A dict per output completed by this block: 'sample' (the
+            sample count at the end of the last segment), 'segments' (the
+            number of segments averaged) and 'psd' (channels, bins).
+        """
+        block = np.atleast_2d(block)
+        length = block.shape[1]
+        outputs = []
+        position = 0
+        while position < length:
+            take = min(self.segment_length - self._fill, length - position)
+            self._stage[:, self._fill:self._fill + take] = \
+                block[:, position:position + take]
+            self._fill += take
+            position += take
+            if self._fill < self.segment_length:
+                break
+            output = self._add_segment(self.samples + position)
+            if output is not None:
+                outputs.append(output)
+            # Keep the overlap for the next segment.
+            keep = self.segment_length - self.hop
+            self._stage[:, :keep] = self._stage[:, self.hop:]
+            self._fill = keep
+        self.samples += length
+        return outputs
+
+    def _add_segment(self, sample):
+        np.abs(self._engine.transform(self._stage), out=self._power)
+        self._power *= self._power
+        self._power *= self._scale
+        if self.averaging == 'linear':
+            self._average += self._power
+        elif self._count:
+            self._average += self.alpha * (self._power - self._average)
+        else:
+            self._average[:] = self._power
+        self._count += 1
+        self._since_output += 1
+        self.segments += 1
+
+        if self._since_output < self.segments_per_output:
+            return None
+        output = {'sample': sample, 'psd': self.psd(),
+                  'segments': min(self._count, 0xFFFF)}
+        self._since_output = 0
+        if self.averaging == 'linear':
+            self._average[:] = 0.0
+            self._count = 0
+        return output
+
+    def encode(self, psd, row, channel):
+        """
+        Encode one channel of an output PSD for publishing.
+
+        Args:
+            psd (dict): An output of :py:meth:`push`.
+            row (int): The row of the channel in the PSD.
+            channel (int): The MCC 172 channel number.
+
+        Returns:
+            bytes: The message.
+        """
+        values = psd['psd'][row].astype('<f4')
+        return _PSD_HEADER.pack(b'PS', PSD_VERSION, channel, len(values),
+                                psd['segments'], self.resolution) + \
+            values.tobytes()
+
+
+def decode_psd(payload):
+    """
+    Decode a message of :py:meth:`WelchAverager.encode`.
+
+    Returns:
+        dict: channel, segments, resolution and the PSD (numpy.ndarray).
+
+    Raises:
+        ValueError: The payload is not a PSD message.
+    """
+    magic, version, channel, bins, segments, resolution = \
+        _PSD_HEADER.unpack_from(payload)
+    if magic != b'PS' or version != PSD_VERSION:
+        raise ValueError('not a PSD message')
+    psd = np.frombuffer(payload, dtype='<f4', count=bins,
+                        offset=_PSD_HEADER.size)
+    return {'channel': channel, 'segments': segments,
+            'resolution': resolution, 'psd': psd}
@@ -1 +1,20 @@
-from diagnosis.diagnosis import diagnosis, preprocessing, load_model
\ No newline at end of file
+from diagnosis.features import block_features, feature_names
+from diagnosis.prefilter import AnomalyGate, WelfordStats
+
+# The CNN functions need TensorFlow Lite.  They are imported on first use,
+# so the feature and gate users (telemetry, recording, streaming) do not
+# load the interpreter.
+_MODEL_FUNCTIONS = ('diagnosis', 'preprocessing', 'load_model')
+
+
+def __getattr__(name):
+    if name not in _MODEL_FUNCTIONS:
+        raise AttributeError(
+            "module 'diagnosis' has no attribute '{}'".format(name))
+    import importlib
+    model = importlib.import_module('diagnosis.diagnosis')
+    # The import binds the submodule to the name 'diagnosis'; bind the
+    # functions instead.
+    globals().update({function: getattr(model, function)
+                      for function in _MODEL_FUNCTIONS})
+    return globals()[name]
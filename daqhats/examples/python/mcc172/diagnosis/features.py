@@ -0,0 +1,76 @@
+"""
+    Vectorized summary features for blocks of vibration data.
+
+    The features are cheap to compute (a handful of NumPy reductions and one
+    real FFT per block) and are shared by the anomaly gate, the telemetry
+    encoder and the recording index.
+"""
+import numpy as np
+
+# Default band edges in Hz used for band energies.
+DEFAULT_BANDS = ((10.0, 100.0), (100.0, 500.0), (500.0, 2000.0),
+                 (2000.0, 5000.0))
+
+BASE_FEATURES = ('rms', 'peak', 'crest', 'kurtosis')
+
+
+def feature_names(bands=DEFAULT_BANDS):
+    """
+    Return the names of the features produced by :py:func:`block_features`.
+
+    Args:
+        bands (tuple): The (low, high) band edges in Hz.
+
+    Returns:
+        list[str]: The feature names in column order.
+    """
+    return list(BASE_FEATURES) + \
+        ['band_{:g}_{:g}'.format(low, high) for low, high in bands]
+
+
+def block_features(data, scan_rate, bands=DEFAULT_BANDS):
+    """
+    Calculate summary features for one or more channels of samples.
+
+    Args:
+        data (numpy.ndarray): A 1-D array of samples for one channel or a
+            2-D array shaped (channels, samples).
+        scan_rate (float): The sample rate of the data in Hz.
+        bands (tuple): The (low, high) band edges in Hz for band energies.
+
+    Returns:
+        numpy.ndarray: A float64 array shaped (channels, features), or
+        (features,) for 1-D input, in the order given by
+        :py:func:`feature_names`.
+    """
+    block = np.asarray(data, dtype=np.float64)
+    squeeze = block.ndim == 1
+    block = np.atleast_2d(block)
+    num_samples = block.shape[1]
+
+    centered = block - block.mean(axis=1, keepdims=True)
+    power = np.mean(block * block, axis=1)
+    rms = np.sqrt(power)
+    peak = np.max(np.abs(block), axis=1)
+    crest = np.divide(peak, rms, out=np.zeros_like(peak), where=rms > 0)
+    var = np.mean(centered * centered, axis=1)
+    fourth = np.mean(centered ** 4, axis=1)
+    kurtosis = np.divide(fourth, var * var, out=np.zeros_like(var),
+                         where=var > 0)
+
+    out = np.empty((block.shape[0], len(BASE_FEATURES) + len(bands)))
+    out[:, 0] = rms
+    out[:, 1] = peak
+    out[:, 2] = crest
+    out[:, 3] = kurtosis
+
+    if bands:
+        spectrum = np.abs(np.fft.rfft(centered, axis=1)) ** 2
+        spectrum *= 2.0 / (num_samples * num_samples)
+        freqs = np.fft.rfftfreq(num_samples, 1.0 / scan_rate)
+        for index, (low, high) in enumerate(bands):
+            in_band = (freqs >= low) & (freqs < high)
+            out[:, len(BASE_FEATURES) + index] = \
+                spectrum[:, in_band].sum(axis=1)
+
+    return out[0] if squeeze else out
@@ -0,0 +1,153 @@
+"""
+    Streaming statistical gate in front of the neural network diagnosis.
+
+    Each motor learns a baseline of its block features with Welford running
+    mean/variance statistics.  A window is forwarded to ``diagnosis()`` only
+    when one of its features deviates from the baseline by more than the
+    configured number of standard deviations, or when the maximum interval
+    since the last inference has elapsed.  Everything else is counted as a
+    skipped inference.
+"""
+import time
+import numpy as np
+
+
+class WelfordStats(object):
+    """
+    Running mean and variance of a feature vector (Welford's algorithm).
+
+    Args:
+        num_features (int): The length of the feature vector.
+    """
+
+    def __init__(self, num_features):
+        self.count = 0
+        self.mean = np.zeros(num_features)
+        self._m2 = np.zeros(num_features)
+
+    def update(self, values):
+        """ Add one feature vector to the statistics. """
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (values - self.mean)
+
+    @property
+    def variance(self):
+        """ The sample variance of each feature. """
+        if self.count < 2:
+            return np.zeros_like(self._m2)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        """ The sample standard deviation of each feature. """
+        return np.sqrt(self.variance)
+
+    def zscore(self, values):
+        """
+        Return the absolute z-score of each feature against the statistics.
+        Features with no spread are scored relative to the mean instead, so a
+        perfectly stable baseline still flags a change.
+        """
+        std = self.std
+        scale = np.where(std > 0, std, np.maximum(np.abs(self.mean), 1e-12))
+        return np.abs(values - self.mean) / scale
+
+
+class AnomalyGate(object):
+    """
+    Decide which windows of one motor are worth running the CNN on.
+
+    Args:
+        num_features (int): The length of the feature vectors passed to
+            :py:meth:`check`.
+        threshold (float): The z-score above which a window is forwarded.
+        warmup (int): Number of windows used to learn the baseline before
+            deviations are evaluated.  During warm-up only the maximum
+            interval forwards windows.
+        max_interval (float): Maximum time in seconds between two forwarded
+            windows, regardless of the statistics.
+    """
+
+    def __init__(self, num_features, threshold=4.0, warmup=10,
+                 max_interval=600.0):
+        self.threshold = threshold
+        self.warmup = warmup
+        self.max_interval = max_interval
+        self.baseline = WelfordStats(num_features)
+        self.forwarded = 0
+        self.skipped = 0
+        self.deviations = 0
+        self.timeouts = 0
+        self.last_score = 0.0
+        self._last_forward = None
+
+    def reset(self):
+        """
+        Forget the baseline and warm up again, for example after the scan
+        rate or channels changed the meaning of the features.  The next
+        window is forwarded; the counters are kept.
+        """
+        self.baseline = WelfordStats(len(self.baseline.mean))
+        self.last_score = 0.0
+        self._last_forward = None
+
+    def check(self, features, now=None):
+        """
+        Evaluate one window.
+
+        Windows that do not deviate are added to the baseline; deviating
+        windows are not, so a developing fault does not become "normal".
+
+        Args:
+            features (numpy.ndarray): The feature vector of the window.  For
+                multi-channel features pass the flattened array.
+            now (float): Optional timestamp (time.monotonic() by default).
+
+        Returns:
+            bool: True if the window should be passed to ``diagnosis()``.
+        """
+        if now is None:
+            now = time.monotonic()
+        values = np.ravel(np.asarray(features, dtype=np.float64))
+
+        deviating = False
+        if self.baseline.count >= self.warmup:
+            self.last_score = float(np.max(self.baseline.zscore(values)))
+            deviating = self.last_score > self.threshold
+        if not deviating:
+            self.baseline.update(values)
+
+        expired = (self._last_forward is None or
+                   now - self._last_forward >= self.max_interval)
+
+        if deviating:
+            self.deviations += 1
+        elif expired:
+            self.timeouts += 1
+        else:
+            self.skipped += 1
+            return False
+
+        self.forwarded += 1
+        self._last_forward = now
+        return True
+
+    def stats(self):
+        """
+        Return the gate counters.
+
+        Returns:
+            dict: forwarded, skipped, deviations and timeouts counts, the
+            fraction of skipped inferences and the last z-score.
+        """
+        total = self.forwarded + self.skipped
+        return {
+            'forwarded': self.forwarded,
+            'skipped': self.skipped,
+            'deviations': self.deviations,
+            'timeouts': self.timeouts,
+            'skip_ratio': self.skipped / total if total else 0.0,
+            'last_score': self.last_score,
+        }
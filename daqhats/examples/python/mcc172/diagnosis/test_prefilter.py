@@ -0,0 +1,95 @@
+"""
+    Tests of the statistical gate in front of the CNN diagnosis.
+
+    Run from the mcc172 directory with ``python -m pytest diagnosis`` or
+    ``python -m unittest diagnosis.test_prefilter``.
+"""
+import unittest
+import numpy as np
+from diagnosis.prefilter import AnomalyGate, WelfordStats
+
+
+class WelfordStatsTest(unittest.TestCase):
+    """ Running statistics match the batch ones. """
+
+    def test_mean_variance(self):
+        values = np.random.default_rng(0).normal(3.0, 2.0, size=(500, 5))
+        stats = WelfordStats(5)
+        for row in values:
+            stats.update(row)
+        self.assertEqual(stats.count, 500)
+        np.testing.assert_allclose(stats.mean, values.mean(axis=0))
+        np.testing.assert_allclose(stats.variance,
+                                   values.var(axis=0, ddof=1))
+        np.testing.assert_allclose(stats.zscore(values[0]),
+                                   np.abs(values[0] - values.mean(axis=0)) /
+                                   values.std(axis=0, ddof=1))
+
+    def test_no_spread(self):
+        stats = WelfordStats(2)
+        for _ in range(3):
+            stats.update(np.array([2.0, 0.0]))
+        np.testing.assert_array_equal(stats.variance, [0.0, 0.0])
+        # Relative to the mean when the baseline is perfectly stable.
+        self.assertAlmostEqual(stats.zscore(np.array([3.0, 0.0]))[0], 0.5)
+
+
+class AnomalyGateTest(unittest.TestCase):
+    """ Baseline learning, deviations and reset. """
+
+    def _learn(self, gate, rng, count=20):
+        for i in range(count):
+            gate.check(rng.normal(1.0, 0.01, size=4), now=float(i))
+
+    def test_warmup_and_timeout(self):
+        rng = np.random.default_rng(2)
+        gate = AnomalyGate(4, threshold=4.0, warmup=10, max_interval=5.0)
+        forwarded = [gate.check(rng.normal(1.0, 0.01, size=4), now=float(i))
+                     for i in range(20)]
+        # The first window and then one every max_interval seconds.
+        self.assertEqual([i for i, sent in enumerate(forwarded) if sent],
+                         [0, 5, 10, 15])
+        stats = gate.stats()
+        self.assertEqual(stats['timeouts'], 4)
+        self.assertEqual(stats['deviations'], 0)
+        self.assertEqual(stats['skipped'], 16)
+        self.assertAlmostEqual(stats['skip_ratio'], 0.8)
+
+    def test_deviation_not_learned(self):
+        rng = np.random.default_rng(3)
+        gate = AnomalyGate(4, threshold=4.0, warmup=10, max_interval=1e6)
+        self._learn(gate, rng)
+        count = gate.baseline.count
+        fault = np.array([1.0, 1.0, 1.5, 1.0])
+        for i in range(3):
+            self.assertTrue(gate.check(fault, now=100.0 + i))
+        self.assertEqual(gate.baseline.count, count)
+        self.assertEqual(gate.deviations, 3)
+        self.assertGreater(gate.last_score, 4.0)
+
+    def test_reset(self):
+        rng = np.random.default_rng(1)
+        gate = AnomalyGate(4, threshold=4.0, warmup=10, max_interval=1e6)
+        self._learn(gate, rng)
+        # New settings: every feature moved far from the old baseline.
+        shifted = rng.normal(5.0, 0.01, size=4)
+        self.assertTrue(gate.check(shifted, now=30.0))
+        self.assertEqual(gate.deviations, 1)
+
+        gate.reset()
+        self.assertEqual(gate.baseline.count, 0)
+        # The first window after the reset is forwarded and the warm-up
+        # learns the new level without counting deviations.
+        self.assertTrue(gate.check(shifted, now=31.0))
+        for i in range(9):
+            self.assertFalse(gate.check(rng.normal(5.0, 0.01, size=4),
+                                        now=32.0 + i))
+        self.assertEqual(gate.deviations, 1)
+        # The old level is now the deviation.
+        self.assertTrue(gate.check(rng.normal(1.0, 0.01, size=4),
+                                   now=50.0))
+        self.assertEqual(gate.deviations, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,11 +25,11 @@
 from __future__ import print_function
 from time import sleep
 from sys import version_info
-from math import fabs
 import numpy
 from daqhats import mcc172, OptionFlags, SourceType, HatIDs, HatError
 from daqhats_utils import select_hat_device, enum_mask_to_string, \
 chan_list_to_mask
+from analysis import FftEngine, find_peaks, harmonic_levels
 
 CURSOR_BACK_2 = '\x1b[2D'
 ERASE_TO_END_OF_LINE = '\x1b[0K'
@@ -135,62 +135,6 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
     except (HatError, ValueError) as err:
         print('\n', err)
 
-def window(index, max_index):
-    """ Hann window function. """
-    return 0.5 - 0.5*numpy.cos(2*numpy.pi*index / max_index)
-
-def window_compensation():
-    """ Hann window compensation factor. """
-    return 2.0
-
-def calculate_real_fft(data):
-    """ Calculate a real-only FFT, returning the spectrum in dBFS. """
-    n_samples = len(data)
-    in_data = numpy.empty(n_samples, dtype=numpy.float64)
-
-    # Apply the window and normalize the time data.
-    max_v = mcc172.info().AI_MAX_RANGE
-    for i in range(n_samples):
-        in_data[i] = window(i, n_samples) * data[i] / max_v
-
-    # Perform the FFT.
-    out = numpy.fft.rfft(in_data)
-
-    # Convert the complex results to real and convert to dBFS.
-    spectrum = numpy.empty(len(out), dtype=numpy.float64)
-
-    real_part = numpy.real(out)
-    imag_part = numpy.imag(out)
-    for i in range(len(out)):
-        if i == 0:
-            # Don't multiply DC value times 2.
-            spectrum[i] = 20*numpy.log10(
-                window_compensation() *
-                numpy.sqrt(real_part[i] * real_part[i] + imag_part[i] * imag_part[i]) /
-                n_samples)
-        else:
-            spectrum[i] = 20*numpy.log10(
-                window_compensation() * 2 *
-                numpy.sqrt(real_part[i] * real_part[i] + imag_part[i] * imag_part[i]) /
-                n_samples)
-
-    return spectrum
-
-def quadratic_interpolate(bin0, bin1, bin2):
-    """
-    Interpolate between the bins of an FFT peak to find a more accurate
-    frequency.  bin1 is the FFT value at the detected peak, bin0 and bin2
-    are the values from adjacent bins above and below the peak. Returns
-    the offset value from the index of bin1.
-    """
-    y_1 = fabs(bin0)
-    y_2 = fabs(bin1)
-    y_3 = fabs(bin2)
-
-    result = (y_3 - y_1) / (2 * (2 * y_2 - y_1 - y_3))
-
-    return result
-
 def order_suffix(index):
     """ Return the suffix order string. """
     if index == 1:
@@ -232,56 +176,42 @@ def read_and_display_data(hat, channels, samples_per_channel, scan_rate):
     # Separate the data by channel
     read_data = read_result.data.reshape((len(channels), -1), order='F')
 
-    for channel in channels:
-        print('===== Channel {}:\n'.format(channel))
+    # Calculate the spectra of all channels in dBFS.
+    engine = FftEngine(samples_per_channel, len(channels),
+                       mcc172.info().AI_MAX_RANGE)
+    spectra = engine.spectrum_db(read_data)
+    frequencies = engine.frequencies(scan_rate)
+    bin_width = scan_rate / samples_per_channel
 
-        # Calculate the FFT.
-        spectrum = calculate_real_fft(read_data[channels.index(channel)])
+    # Find the peaks and the levels of their 2nd - 7th harmonics.
+    peak_bins, peak_vals = find_peaks(spectra, count=1)
+    harmonic_bins, harmonic_vals = harmonic_levels(spectra, peak_bins[:, 0],
+                                                   harmonics=7)
+
+    for index, channel in enumerate(channels):
+        print('===== Channel {}:\n'.format(channel))
 
-        # Calculate dBFS and find peak.
-        f_i = 0.0
-        peak_index = 0
-        peak_val = -1000.0
+        spectrum = spectra[index]
 
         # Save data to CSV file
         logname = "fft_scan_{}.csv".format(channel)
-        logfile = open(logname, "w")
-        logfile.write("Time data (V), Frequency (Hz), Spectrum (dBFS)\n")
-
-        for i, spec_val in enumerate(spectrum):
-            # Find the peak value and index.
-            if spec_val > peak_val:
-                peak_val = spec_val
-                peak_index = i
-
-            # Save to the CSV file.
-            logfile.write("{0:.6f},{1:.3f},{2:.6f}\n".format(
-                read_result.data[i], f_i, spec_val))
-
-            f_i += scan_rate / samples_per_channel
-
-        logfile.close()
-
-        # Interpolate for a more precise peak frequency.
-        peak_offset = quadratic_interpolate(
-            spectrum[peak_index - 1], spectrum[peak_index], spectrum[peak_index + 1])
-        peak_freq = ((peak_index + peak_offset) * scan_rate /
-                     samples_per_channel)
-        print("Peak: {0:.1f} dBFS at {1:.1f} Hz".format(peak_val, peak_freq))
-
-        # Find and display harmonic levels.
-        i = 2
-        h_freq = 0
-        nyquist = scan_rate / 2.0
-        while (i < 8) and (h_freq <= nyquist):
-            # Stop when frequency exceeds Nyquist rate or at the 8th harmonic.
-            h_freq = peak_freq * i
-            if h_freq <= nyquist:
-                h_index = int(h_freq * samples_per_channel / scan_rate + 0.5)
-                h_val = spectrum[h_index]
-                print("{0:d}{1:s} harmonic: {2:.1f} dBFS at {3:.1f} Hz".format(
-                    i, order_suffix(i), h_val, h_freq))
-            i += 1
+        columns = numpy.column_stack(
+            (read_result.data[:len(spectrum)], frequencies, spectrum))
+        numpy.savetxt(logname, columns, fmt=('%.6f', '%.3f', '%.6f'),
+                      delimiter=',', comments='',
+                      header="Time data (V), Frequency (Hz), Spectrum (dBFS)")
+
+        peak_freq = peak_bins[index, 0] * bin_width
+        print("Peak: {0:.1f} dBFS at {1:.1f} Hz".format(peak_vals[index, 0],
+                                                        peak_freq))
+
+        # Display the harmonic levels up to the Nyquist rate.
+        for order, (h_bin, h_val) in enumerate(
+                zip(harmonic_bins[index], harmonic_vals[index]), 2):
+            if numpy.isnan(h_bin):
+                break
+            print("{0:d}{1:s} harmonic: {2:.1f} dBFS at {3:.1f} Hz".format(
+                order, order_suffix(order), h_val, h_bin * bin_width))
 
         print('Data and FFT saved in {}\n'.format(logname))
 
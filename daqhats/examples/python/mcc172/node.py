@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#  -*- coding: utf-8 -*-
+
+"""
+    Sensor node runtime.
+
+    Runs the MCC 172 vibration acquisition (scan_with_diagnosis_mqtt.py),
+    the MAX31865 temperature reader and the RPM counter in one process,
+    instead of the daq, temperature and rpm services:
+
+    - one MQTT connection (the acquisition's publisher),
+    - one GPIO setup: the tachometer of the order tracking also provides
+      the RPM telemetry,
+    - one scheduler for the periodic tasks,
+    - one metrics message on "motor_node/metrics" with the publisher,
+      recorder and scheduler statistics.
+
+    The latest values of all sensors are kept in a shared SensorState, which
+    gives cross-sensor features: vibration per 1000 RPM and an RMS capture
+    threshold that rises with the motor temperature.
+"""
+from __future__ import print_function
+import json
+import resource
+import signal
+import time
+import scan_with_diagnosis_mqtt as daq
+from scheduler import Scheduler
+from telemetry import TelemetryBatcher
+from temperature.max31865 import MAX31865, FaultError
+
+TEMPERATURE_INTERVAL = 5.0
+RPM_INTERVAL = 60.0
+CROSS_INTERVAL = 10.0
+METRICS_INTERVAL = 60.0
+
+# The MAX31865 on SPI1 with GPIO 7 as chip select (as in pt100.py).
+SPI_BUS = 1
+CS_PIN = 7
+
+# The RMS capture threshold is scaled by 1 + TEMP_COEFF * (T - TEMP_REF),
+# within THRESHOLD_SCALE, as a warm motor runs with more vibration.
+TEMP_REF = 25.0
+TEMP_COEFF = 0.01
+THRESHOLD_SCALE = (0.5, 2.0)
+
+publisher = daq.publisher
+state = daq.state
+scheduler = Scheduler()
+temperature_telemetry = TelemetryBatcher(
+    publisher, "motor_telemetry/temperature", interval=60.0)
+rpm_telemetry = TelemetryBatcher(publisher, "motor_telemetry/rpm",
+                                 interval=300.0)
+cross_telemetry = TelemetryBatcher(publisher, "motor_telemetry/node",
+                                   interval=60.0)
+
+
+class TemperatureTask(object):
+    """ Read the motor temperature. """
+
+    def __init__(self):
+        self.sensor = MAX31865(bus=SPI_BUS, device=0, wires=3,
+                               cs_pin=CS_PIN)
+        self.sensor.start()
+        self.faults = 0
+
+    def __call__(self):
+        try:
+            temperature = self.sensor.read()
+        except FaultError as err:
+            self.faults += 1
+            print('\n* temperature:', err)
+            return
+        state.update(temperature=temperature)
+        temperature_telemetry.add(0, {'temperature': temperature})
+        # Plain-text reading for the subscribers of pt100.py.
+        publisher.publish("motor_inner_temp", str(temperature))
+
+    def close(self):
+        """ Stop the converter. """
+        self.sensor.close()
+
+
+def publish_rpm():
+    """ Publish the speed statistics of the last interval. """
+    now = time.monotonic()
+    stats = daq.tachometer.period_stats(RPM_INTERVAL, now)
+    state.update(rpm=stats['rpm'])
+    rpm_telemetry.add(0, {'rpm': stats['rpm'],
+                          'rpm_instant': daq.tachometer.rpm(now),
+                          'rpm_min': stats['rpm_min'],
+                          'rpm_max': stats['rpm_max']})
+    # Plain-text speed for the subscribers of rpm.py.
+    publisher.publish("motor_rpm", str(int(round(stats['rpm']))))
+
+
+def cross_features():
+    """ Calculate the features that combine sensors. """
+    temperature = state.get('temperature', max_age=60.0)
+    if temperature is not None:
+        scale = 1.0 + TEMP_COEFF * (temperature - TEMP_REF)
+        state.update(capture_scale=min(max(scale, THRESHOLD_SCALE[0]),
+                                       THRESHOLD_SCALE[1]))
+
+    rpm = daq.tachometer.smoothed_rpm(CROSS_INTERVAL)
+    rms = state.get('rms', {}, max_age=CROSS_INTERVAL)
+    if rpm > 0:
+        for channel, value in rms.items():
+            cross_telemetry.add(channel,
+                                {'rms_per_krpm': value * 1000.0 / rpm})
+
+
+def publish_metrics():
+    """ Publish the node metrics (retained). """
+    metrics = {
+        'time': time.time(),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'cpu_time': time.process_time(),
+        'publisher': publisher.metrics(),
+        'recorder': daq.recorder.metrics(),
+        'tasks': scheduler.stats(),
+        'pulses': daq.tachometer.count,
+        'capture_scale': state.get('capture_scale', 1.0),
+    }
+    publisher.publish("motor_node/metrics", json.dumps(metrics), qos=1,
+                      retain=True)
+
+
+def _terminate(_signum, _frame):
+    # systemd stops the service with SIGTERM; shut down like Ctrl-C.
+    raise KeyboardInterrupt
+
+
+def main():
+    """ Run the node until interrupted. """
+    signal.signal(signal.SIGTERM, _terminate)
+    publisher.start()
+
+    temperature = None
+    try:
+        temperature = TemperatureTask()
+        scheduler.add('temperature', TEMPERATURE_INTERVAL, temperature)
+    except (OSError, RuntimeError) as err:
+        print('\nTemperature disabled:', err)
+    scheduler.add('rpm', RPM_INTERVAL, publish_rpm, delay=RPM_INTERVAL)
+    scheduler.add('cross', CROSS_INTERVAL, cross_features,
+                  delay=CROSS_INTERVAL)
+    scheduler.add('metrics', METRICS_INTERVAL, publish_metrics,
+                  delay=METRICS_INTERVAL)
+    scheduler.start()
+
+    try:
+        # The acquisition runs on the main thread until Ctrl-C / SIGTERM.
+        daq.main(shared=True)
+    finally:
+        scheduler.stop()
+        if temperature is not None:
+            temperature.close()
+        for batcher in (temperature_telemetry, rpm_telemetry,
+                        cross_telemetry):
+            batcher.stop()
+        publish_metrics()
+        publisher.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+from recording.store import RecordingWriter, RecordingReader, \
+    hat_calibration, to_codes, register_codec, CODEC_NONE, CODEC_ZLIB, \
+    FILE_SUFFIX
+from recording.writer import AsyncRecorder, POLICY_BLOCK, POLICY_DROP, \
+    POLICY_DEGRADE, FSYNC_NEVER, FSYNC_CLOSE, FSYNC_INTERVAL, FSYNC_BATCH
+from recording.segments import SegmentRecorder, SegmentIndex
+from recording.capture import TriggerCapture
+from recording.compression import CODEC_PRED
@@ -0,0 +1,119 @@
+"""
+    Compare the recording codecs on recorded data.
+
+    Usage (from the mcc172 directory)::
+
+        python -m recording.benchmark [file.mcr | file.csv ...]
+
+    Recordings (.mcr) are benchmarked in their stored sample type.  CSV files
+    written by the old collection script hold volts; they are converted to
+    int32 codes with the nominal MCC 172 LSB, which is how the collection
+    script now records.  Without arguments a synthetic 25.6 kS/s vibration
+    signal with 24-bit noise is used.
+
+    For every codec the compression ratio, encode (including the write to
+    the page cache) and decode throughput (MB/s of raw samples) and the days of 2-channel 25.6 kS/s recording that fit
+    on a 32 GB card are printed.
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from recording.store import RecordingReader, RecordingWriter, \
+    CODEC_NONE, CODEC_ZLIB, MCC172_LSB, FILE_SUFFIX
+from recording.compression import CODEC_PRED
+
+CODECS = (('none', CODEC_NONE), ('zlib', CODEC_ZLIB), ('pred', CODEC_PRED))
+
+CARD_BYTES = 32e9
+DAY_BYTES = 2 * 25600 * 4 * 86400.0
+
+
+def load(path):
+    """ Load samples shaped (channels, samples) from a .mcr or .csv file. """
+    if path.endswith('.csv'):
+        with open(path, 'r') as data:
+            values = [float(value) for row in csv.reader(data)
+                      for value in row if value]
+        return np.rint(np.array(values) / MCC172_LSB).astype(
+            np.int32).reshape(1, -1)
+    with RecordingReader(path) as reader:
+        return np.array(reader.read())
+
+
+def synthetic(seconds=10.0, scan_rate=25600.0):
+    """ A motor-like signal: shaft harmonics, a resonance and noise. """
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * scan_rate)) / scan_rate
+    volts = 0.3 * np.sin(2 * np.pi * 29.5 * t) + \
+        0.1 * np.sin(2 * np.pi * 59.0 * t + 0.4) + \
+        0.02 * np.sin(2 * np.pi * 3100.0 * t) * \
+        (1 + np.sin(2 * np.pi * 7 * t))
+    volts = np.vstack((volts, 0.5 * volts))
+    volts += rng.normal(0.0, 50 * MCC172_LSB, volts.shape)
+    return np.rint(volts / MCC172_LSB).astype(np.int32)
+
+
+def run(samples, chunk_samples=25600, repeat=3):
+    """
+    Benchmark every codec on a sample array.
+
+    Args:
+        samples (numpy.ndarray): int32 or float32 samples shaped
+            (channels, samples).
+        chunk_samples (int): Samples per channel in each chunk.
+        repeat (int): Runs per codec; the fastest one is reported.
+
+    Returns:
+        list[tuple]: (name, ratio, encode MB/s, decode MB/s) per codec.
+    """
+    samples = np.ascontiguousarray(samples)
+    channels = list(range(samples.shape[0]))
+    results = []
+    for name, codec in CODECS:
+        path = os.path.join(tempfile.gettempdir(),
+                            'codec_benchmark' + FILE_SUFFIX)
+        encode_time = decode_time = float('inf')
+        for _i in range(repeat):
+            with RecordingWriter(path, 25600, channels,
+                                 dtype=samples.dtype.name,
+                                 chunk_samples=chunk_samples,
+                                 codec=codec) as writer:
+                started = time.perf_counter()
+                writer.write(samples)
+                writer.flush()
+                encode_time = min(encode_time,
+                                  time.perf_counter() - started)
+            with RecordingReader(path) as reader:
+                started = time.perf_counter()
+                decoded = np.array(reader.read())
+                decode_time = min(decode_time,
+                                  time.perf_counter() - started)
+            if not np.array_equal(decoded, samples):
+                raise ValueError('{} is not lossless'.format(name))
+        stored = os.path.getsize(path)
+        os.remove(path)
+        results.append((name, samples.nbytes / stored,
+                        samples.nbytes / encode_time / 1e6,
+                        samples.nbytes / decode_time / 1e6))
+    return results
+
+
+def main():
+    """ Print the benchmark for the files on the command line. """
+    sources = sys.argv[1:] or [None]
+    for source in sources:
+        samples = synthetic() if source is None else load(source)
+        print('{} ({} x {} {})'.format(source or 'synthetic', *samples.shape,
+                                       samples.dtype))
+        print('    codec    ratio   encode MB/s   decode MB/s   days/32GB')
+        for name, ratio, encode, decode in run(samples):
+            print('    {:6} {:7.2f} {:13.1f} {:13.1f} {:11.1f}'.format(
+                name, ratio, encode, decode,
+                CARD_BYTES * ratio / DAY_BYTES))
+
+
+if __name__ == '__main__':
+    main()
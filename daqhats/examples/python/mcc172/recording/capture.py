@@ -0,0 +1,201 @@
+"""
+    Event-triggered capture with pre-trigger history.
+
+    The acquisition loop pushes every block into a preallocated ring that
+    holds the last ``pre_seconds`` of each channel.  When an event arrives
+    (a feature threshold, a diagnosis result or an MQTT command), the ring
+    contents and the following ``post_seconds`` are written to one recording
+    file through the background :py:class:`AsyncRecorder`, so acquisition is
+    never paused.  An event during a running capture extends its post-trigger
+    window.
+
+    :py:meth:`TriggerCapture.trigger` may be called from any thread; the
+    event is picked up by the acquisition thread at the next
+    :py:meth:`TriggerCapture.push`.
+"""
+import os
+import re
+import time
+from threading import Lock
+import numpy as np
+from recording.store import FILE_SUFFIX
+from recording.writer import AsyncRecorder
+
+
+class TriggerCapture(object):
+    """
+    Persist raw waveforms around events.
+
+    Args:
+        directory (str): The output directory.
+        scan_rate (float): The sample rate in Hz.
+        channels (list[int]): The channel numbers, in block row order.
+        pre_seconds (float): History kept before the trigger.
+        post_seconds (float): Samples recorded after the trigger.
+        max_seconds (float): Longest post-trigger recording when events keep
+            extending it.
+        recorder (AsyncRecorder): The writer to use; a private one is
+            started if None.
+        on_capture (callable): Optional callback(path) run by the writer
+            thread when a capture file is complete.
+        **kwargs: Additional :py:class:`RecordingWriter` arguments (dtype,
+            chunk_samples, codec, calibration).
+    """
+
+    def __init__(self, directory, scan_rate, channels, pre_seconds=30.0,
+                 post_seconds=10.0, max_seconds=300.0, recorder=None,
+                 on_capture=None, **kwargs):
+        # pylint: disable=too-many-arguments
+        self.directory = os.path.expanduser(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_seconds = max_seconds
+        self.on_capture = on_capture
+        self.metadata = kwargs.pop('metadata', None) or {}
+        self.writer_args = kwargs
+        self.dtype = np.dtype(kwargs.get('dtype', 'float32'))
+
+        self._own_recorder = recorder is None
+        self.recorder = AsyncRecorder() if recorder is None else recorder
+        if self._own_recorder:
+            self.recorder.start()
+
+        self._lock = Lock()
+        self._pending = []
+        self._stream = None
+        self._post_remaining = 0
+        self._capture_left = 0
+        self.triggers = 0
+        self.captures = 0
+        self.reset(scan_rate, channels)
+
+    def reset(self, scan_rate, channels):
+        """
+        Finish a running capture and start a new timeline, for example after
+        the scan was restarted with new settings.
+
+        Args:
+            scan_rate (float): The sample rate in Hz.
+            channels (list[int]): The channel numbers, in block row order.
+        """
+        self._finish()
+        self.scan_rate = scan_rate
+        self.channels = list(channels)
+        self.pre_samples = max(1, int(round(self.pre_seconds * scan_rate)))
+        self._ring = np.zeros((len(self.channels), self.pre_samples),
+                              dtype=self.dtype)
+        self._ring_pos = 0
+        self._ring_fill = 0
+        self._sample_index = 0
+        self._time_origin = None
+
+    @property
+    def active(self):
+        """ True while a capture is being written. """
+        return self._stream is not None
+
+    def trigger(self, reason='event'):
+        """
+        Request a capture.  Thread safe and never blocks on disk.
+
+        Args:
+            reason (str): Stored in the file metadata and name.
+        """
+        with self._lock:
+            self._pending.append((str(reason), time.time()))
+            self.triggers += 1
+
+    def push(self, block, timestamp=None):
+        """
+        Add a block to the history and to a running capture.
+
+        Args:
+            block (numpy.ndarray): Samples shaped (channels, samples).
+            timestamp (float): Time of the first sample of the block.  Only
+                used for the first block after a reset.
+        """
+        block = np.asarray(block)
+        count = block.shape[1]
+        if self._time_origin is None:
+            if timestamp is None:
+                timestamp = time.time() - count / self.scan_rate
+            self._time_origin = timestamp
+
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+        for reason, when in pending:
+            self._start(reason, when)
+
+        if self._stream is not None:
+            take = min(count, self._post_remaining, self._capture_left)
+            if take:
+                self.recorder.write(self._stream, block[:, :take])
+            self._post_remaining -= take
+            self._capture_left -= take
+            if not self._post_remaining or not self._capture_left:
+                self._finish()
+
+        self._store(block)
+        self._sample_index += count
+
+    def close(self):
+        """ Finish a running capture (and the private writer). """
+        self._finish()
+        if self._own_recorder:
+            self.recorder.stop()
+
+    def _store(self, block):
+        """ Copy the newest samples of a block into the ring. """
+        if block.shape[1] >= self.pre_samples:
+            self._ring[:] = block[:, -self.pre_samples:]
+            self._ring_pos = 0
+            self._ring_fill = self.pre_samples
+            return
+        first = min(block.shape[1], self.pre_samples - self._ring_pos)
+        self._ring[:, self._ring_pos:self._ring_pos + first] = \
+            block[:, :first]
+        rest = block.shape[1] - first
+        if rest:
+            self._ring[:, :rest] = block[:, first:]
+        self._ring_pos = (self._ring_pos + block.shape[1]) % self.pre_samples
+        self._ring_fill = min(self.pre_samples,
+                              self._ring_fill + block.shape[1])
+
+    def _start(self, reason, when):
+        post_samples = int(round(self.post_seconds * self.scan_rate))
+        if self._stream is not None:
+            self._post_remaining = max(self._post_remaining, post_samples)
+            return
+
+        start_sample = self._sample_index - self._ring_fill
+        start_time = self._time_origin + start_sample / self.scan_rate
+        name = 'event_{}_{}{}'.format(
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(when)),
+            re.sub(r'[^A-Za-z0-9]+', '-', reason).strip('-')[:32] or 'event',
+            FILE_SUFFIX)
+        metadata = dict(self.metadata)
+        metadata.update({'reason': reason, 'trigger_time': when,
+                         'trigger_sample': self._sample_index})
+        self._stream = self.recorder.open(
+            os.path.join(self.directory, name), on_close=self.on_capture,
+            scan_rate=self.scan_rate, channels=self.channels,
+            start_time=start_time, start_sample=start_sample,
+            metadata=metadata, **self.writer_args)
+
+        # History, oldest first.
+        if self._ring_fill == self.pre_samples:
+            self.recorder.write(self._stream, self._ring[:, self._ring_pos:])
+        if self._ring_pos:
+            self.recorder.write(self._stream, self._ring[:, :self._ring_pos])
+        self._post_remaining = post_samples
+        self._capture_left = int(round(self.max_seconds * self.scan_rate))
+        self.captures += 1
+
+    def _finish(self):
+        if self._stream is None:
+            return
+        self.recorder.close(self._stream)
+        self._stream = None
+        self._post_remaining = 0
@@ -0,0 +1,201 @@
+"""
+    Lossless compression codec for recording chunks.
+
+    MCC 172 samples are 24-bit ADC codes and neighbouring samples are
+    strongly correlated, so a few bits of each 32-bit word carry all the
+    information.  CODEC_PRED stores int32 codes as:
+
+        1. a fixed linear predictor per channel and chunk (order 0, 1 or 2,
+           whichever gives the smallest residuals),
+        2. zigzag mapping of the residuals to unsigned integers,
+        3. bit packing in blocks of 128 residuals, each block with the
+           smallest bit width that holds its largest residual.
+
+    Every step is vectorized with NumPy; blocks of the same bit width are
+    packed and unpacked together.
+
+    Float32 volts are not integers and cannot be predicted exactly, so they
+    are byte-shuffled (the exponent and high mantissa bytes of all samples
+    next to each other) and deflated.
+
+    Importing the module registers the codec with the recording store.
+"""
+import struct
+import zlib
+import numpy as np
+from recording.store import register_codec
+
+CODEC_PRED = 2
+
+BLOCK = 128
+
+_KIND_INT = 0
+_KIND_FLOAT = 1
+
+# kind, channels
+_HEADER = struct.Struct('<BxH')
+
+
+def _residuals(values, order):
+    """ Prediction residuals of one channel (int64). """
+    residuals = values
+    for _i in range(order):
+        residuals = np.diff(residuals, prepend=0)
+    return residuals
+
+
+def _predict(channel):
+    """ Choose the predictor order with the smallest residuals. """
+    values = channel.astype(np.int64)
+    best = None
+    for order in (0, 1, 2):
+        residuals = _residuals(values, order)
+        cost = int(np.abs(residuals[order:]).sum())
+        if best is None or cost < best[0]:
+            best = (cost, order, residuals)
+    return best[1], best[2]
+
+
+def _zigzag(values):
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _unzigzag(values):
+    return (values >> np.uint64(1)).astype(np.int64) ^ \
+        -(values & np.uint64(1)).astype(np.int64)
+
+
+def _bit_widths(blocks):
+    """ Bits needed for the largest value of each block. """
+    # Residuals of 32-bit codes stay far below 2**53, so the float64
+    # exponent is the exact bit length.
+    return np.frexp(blocks.max(axis=1).astype(np.float64))[1].astype(
+        np.uint8)
+
+
+def pack(values):
+    """
+    Bit-pack unsigned integers in blocks of :py:data:`BLOCK`.
+
+    Args:
+        values (numpy.ndarray): 1-D uint64 values.
+
+    Returns:
+        tuple: (uint8 bit width per block, packed bytes).
+    """
+    blocks = np.zeros(-(-len(values) // BLOCK) * BLOCK, dtype=np.uint64)
+    blocks[:len(values)] = values
+    blocks = blocks.reshape(-1, BLOCK)
+    widths = _bit_widths(blocks)
+    sizes = widths.astype(np.int64) * (BLOCK // 8)
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    out = np.zeros(int(sizes.sum()), dtype=np.uint8)
+    for width in np.unique(widths):
+        if not width:
+            continue
+        rows = np.flatnonzero(widths == width)
+        shifts = np.arange(width, dtype=np.uint64)
+        bits = ((blocks[rows][:, :, None] >> shifts) & np.uint64(1))
+        packed = np.packbits(bits.astype(np.uint8).reshape(len(rows), -1),
+                             axis=1, bitorder='little')
+        out[offsets[rows][:, None] + np.arange(packed.shape[1])] = packed
+    return widths, out
+
+
+def unpack(widths, data, count):
+    """
+    Reverse :py:func:`pack`.
+
+    Args:
+        widths (numpy.ndarray): uint8 bit width per block.
+        data (numpy.ndarray): The packed bytes (uint8).
+        count (int): The number of values.
+
+    Returns:
+        numpy.ndarray: 1-D uint64 values.
+    """
+    blocks = np.zeros((len(widths), BLOCK), dtype=np.uint64)
+    sizes = widths.astype(np.int64) * (BLOCK // 8)
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    for width in np.unique(widths):
+        if not width:
+            continue
+        rows = np.flatnonzero(widths == width)
+        packed = data[offsets[rows][:, None] +
+                      np.arange(int(width) * (BLOCK // 8))]
+        bits = np.unpackbits(packed, axis=1, bitorder='little')
+        bits = bits.reshape(len(rows), BLOCK, width).astype(np.uint64)
+        blocks[rows] = (bits << np.arange(width, dtype=np.uint64)).sum(
+            axis=2, dtype=np.uint64)
+    return blocks.reshape(-1)[:count]
+
+
+def encode(samples):
+    """
+    Compress one chunk.
+
+    Args:
+        samples (numpy.ndarray): int32 or float32 samples shaped
+            (channels, samples).
+
+    Returns:
+        bytes: The compressed chunk payload.
+    """
+    channels = samples.shape[0]
+    if samples.dtype.kind == 'f':
+        shuffled = samples.view(np.uint8).reshape(
+            channels, -1, samples.dtype.itemsize).transpose(0, 2, 1)
+        return _HEADER.pack(_KIND_FLOAT, channels) + \
+            zlib.compress(np.ascontiguousarray(shuffled).tobytes(), 1)
+
+    orders = np.zeros(channels, dtype=np.uint8)
+    residuals = []
+    for row in range(channels):
+        orders[row], channel = _predict(samples[row])
+        residuals.append(channel)
+    widths, packed = pack(_zigzag(np.concatenate(residuals)))
+    return b''.join((_HEADER.pack(_KIND_INT, channels), orders.tobytes(),
+                     struct.pack('<I', len(widths)), widths.tobytes(),
+                     packed.tobytes()))
+
+
+def decode(data, dtype, shape):
+    """
+    Decompress one chunk.
+
+    Args:
+        data (bytes): The compressed chunk payload.
+        dtype (numpy.dtype): The sample type.
+        shape (tuple): (channels, samples).
+
+    Returns:
+        numpy.ndarray: The samples.
+    """
+    kind, channels = _HEADER.unpack_from(data)
+    pos = _HEADER.size
+    if kind == _KIND_FLOAT:
+        shuffled = np.frombuffer(zlib.decompress(data[pos:]), dtype=np.uint8)
+        shuffled = shuffled.reshape(channels, np.dtype(dtype).itemsize, -1)
+        return np.ascontiguousarray(shuffled.transpose(0, 2, 1)).view(
+            dtype).reshape(shape)
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    orders = buffer[pos:pos + channels]
+    pos += channels
+    (num_blocks,) = struct.unpack_from('<I', data, pos)
+    pos += 4
+    widths = buffer[pos:pos + num_blocks]
+    pos += num_blocks
+    residuals = _unzigzag(unpack(widths, buffer[pos:],
+                                 shape[0] * shape[1]))
+    values = residuals.reshape(shape)
+    out = np.empty(shape, dtype=dtype)
+    for row in range(channels):
+        channel = values[row]
+        for _i in range(int(orders[row])):
+            channel = np.cumsum(channel)
+        out[row] = channel
+    return out
+
+
+register_codec(CODEC_PRED, encode, decode)
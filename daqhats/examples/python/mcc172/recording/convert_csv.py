@@ -0,0 +1,342 @@
+"""
+    Convert legacy CSV recordings to the binary recording format.
+
+    Usage (from the mcc172 directory)::
+
+        python -m recording.convert_csv /home/raspberry/diagnosis_data \\
+            --out /home/raspberry/diagnosis_data/converted --workers 4
+
+    The old collection scripts wrote one CSV row per file:
+
+        motor_<mmdd-HH.MM.SS>.csv   scan_collect_data.py, 10240 S/s
+        <motor>_<mmdd-HH.MM.SS>     udp_scan.py, 25480 S/s
+
+    Both scanned channels 0 and 1 but stored the interleaved read buffer as
+    if it was one channel.  The layout of every file is detected from its
+    autocorrelation (interleaved data correlates better at lag 2 than at
+    lag 1) and interleaved files are split into two channels.
+
+    Files are parsed in blocks, never read whole, converted back to the
+    int32 ADC codes (see :py:func:`to_codes`) and written through
+    :py:class:`RecordingWriter` with :py:data:`CODEC_PRED`, which is
+    lossless for codes.  The legacy scripts did not store the calibration;
+    the nominal one (slope 1, offset 0, as recording/benchmark.py uses) is
+    assumed unless the HAT's calibration is given with --calibration, and
+    the largest difference between the CSV values and the stored codes is
+    reported in the journal.  Each output is written to a temporary file,
+    read back to validate the sample count and replaced into place; the
+    result is appended to a journal in the output directory, so an
+    interrupted run resumes with the files that are not done yet.
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+from multiprocessing import Pool
+import numpy as np
+from recording.store import RecordingReader, RecordingWriter, FILE_SUFFIX, \
+    MCC172_LSB, to_codes
+from recording.compression import CODEC_PRED
+
+JOURNAL = 'converted.jsonl'
+
+LAYOUT_AUTO = 'auto'
+LAYOUT_SINGLE = 'single'
+LAYOUT_INTERLEAVED = 'interleaved'
+
+# File name pattern -> (scan rate, metadata) of the legacy scripts.
+LEGACY_FILES = (
+    (re.compile(r'^motor_(\d{4}-\d\d\.\d\d\.\d\d)\.csv$'), 10240.0, {}),
+    (re.compile(r'^(\d+)_(\d{4}-\d\d\.\d\d\.\d\d)(\.csv)?$'), 25480.0,
+     {'motor': None}),
+)
+
+_READ_SIZE = 1 << 20
+
+# Calibration of a channel when the HAT's is unknown.
+NOMINAL_CALIBRATION = {'slope': 1.0, 'offset': 0.0, 'scale': MCC172_LSB}
+
+_SEPARATORS = re.compile(r'[\s,]+')
+_SEPARATOR_BYTES = np.frombuffer(b', \t\r\n', dtype=np.uint8)
+
+
+def legacy_info(path):
+    """
+    Return what the legacy file name tells about a recording.
+
+    Args:
+        path (str): The CSV file.
+
+    Returns:
+        tuple: (scan rate or None, write time or None, metadata dict).
+    """
+    name = os.path.basename(path)
+    mtime = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+    for pattern, scan_rate, metadata in LEGACY_FILES:
+        match = pattern.match(name)
+        if match is None:
+            continue
+        metadata = dict(metadata)
+        if 'motor' in metadata:
+            metadata['motor'] = int(match.group(1))
+        stamp = match.group(2 if 'motor' in metadata else 1)
+        written = datetime.datetime.strptime(stamp, '%m%d-%H.%M.%S').replace(
+            year=mtime.year)
+        if written > mtime + datetime.timedelta(days=1):
+            written = written.replace(year=mtime.year - 1)
+        return scan_rate, written.timestamp(), metadata
+    return None, mtime.timestamp(), {}
+
+
+def detect_layout(values):
+    """
+    Guess whether a block of samples holds two interleaved channels.
+
+    Args:
+        values (numpy.ndarray): The first samples of the file.
+
+    Returns:
+        str: LAYOUT_INTERLEAVED or LAYOUT_SINGLE.
+    """
+    values = values - values.mean()
+    energy = np.dot(values, values)
+    if len(values) < 16 or not energy:
+        return LAYOUT_SINGLE
+    lag1 = np.dot(values[1:], values[:-1]) / energy
+    lag2 = np.dot(values[2:], values[:-2]) / energy
+    return LAYOUT_INTERLEAVED if lag2 > lag1 + 0.1 else LAYOUT_SINGLE
+
+
+def iter_values(path, read_size=_READ_SIZE):
+    """
+    Parse a CSV file of numbers in blocks.
+
+    Args:
+        path (str): The CSV file.
+        read_size (int): Bytes read at a time.
+
+    Yields:
+        numpy.ndarray: float64 values, in file order.
+    """
+    with open(path, 'r') as csvfile:
+        rest = ''
+        while True:
+            text = csvfile.read(read_size)
+            if not text:
+                break
+            # One comma between values, whatever the line breaks and blank
+            # lines; the last value may continue in the next read.
+            text = _SEPARATORS.sub(',', rest + text)
+            cut = text.rfind(',')
+            rest = text[cut + 1:]
+            values = text[:cut].strip(',')
+            if values:
+                yield np.array(values.split(','), dtype=np.float64)
+        if rest:
+            yield np.array([rest], dtype=np.float64)
+
+
+def count_values(path, read_size=_READ_SIZE):
+    """ Count the numbers in a CSV file without parsing them. """
+    count = 0
+    in_value = False
+    with open(path, 'rb') as csvfile:
+        while True:
+            data = csvfile.read(read_size)
+            if not data:
+                break
+            value = ~np.isin(np.frombuffer(data, dtype=np.uint8),
+                             _SEPARATOR_BYTES)
+            # Every value starts where a separator (or the file) ends, so
+            # blank lines and trailing separators are not counted.
+            count += int(np.count_nonzero(value[1:] & ~value[:-1]))
+            count += int(value[0] and not in_value)
+            in_value = bool(value[-1])
+    return count
+
+
+def convert(path, output, scan_rate=None, layout=LAYOUT_AUTO,
+            calibration=None):
+    """
+    Convert one CSV recording.
+
+    Args:
+        path (str): The CSV file.
+        output (str): The recording file to create.
+        scan_rate (float): The sample rate, or None to use the rate of the
+            legacy script that wrote the file.
+        layout (str): LAYOUT_AUTO, LAYOUT_SINGLE or LAYOUT_INTERLEAVED.
+        calibration (list[dict]): The calibration of channels 0 and 1, see
+            :py:func:`hat_calibration`; nominal by default.
+
+    Returns:
+        dict: The journal entry (source, output, layout, values, samples,
+        values dropped from an odd interleaved count and the largest
+        difference in volts between a value and its stored code).
+
+    Raises:
+        ValueError: The file holds no samples, or the written recording
+            does not read back with the expected sample count.
+    """
+    legacy_rate, written, metadata = legacy_info(path)
+    scan_rate = scan_rate or legacy_rate
+    if scan_rate is None:
+        raise ValueError('unknown scan rate for {}'.format(path))
+
+    blocks = iter_values(path)
+    first = next(blocks, None)
+    if first is None or not len(first):
+        raise ValueError('{} holds no samples'.format(path))
+    if layout == LAYOUT_AUTO:
+        layout = detect_layout(first[:65536])
+    num_channels = 2 if layout == LAYOUT_INTERLEAVED else 1
+    calibration = list(calibration or [NOMINAL_CALIBRATION] * 2)
+    calibration = calibration[:num_channels]
+    offset = np.array([[item['offset']] for item in calibration])
+    gain = np.array([[item['slope'] * item['scale']] for item in calibration])
+
+    # The legacy file name is the time the file was written, i.e. the end
+    # of the data.
+    expected = count_values(path) // num_channels
+    metadata.update({'source': os.path.abspath(path), 'layout': layout})
+    temp = output + '.part'
+    values = 0
+    max_error = 0.0
+    carry = np.empty(0)
+    with RecordingWriter(temp, scan_rate, list(range(num_channels)),
+                         dtype='int32', codec=CODEC_PRED,
+                         calibration=calibration,
+                         start_time=written - expected / scan_rate,
+                         metadata=metadata) as writer:
+        block = first
+        while block is not None:
+            values += len(block)
+            if carry.size:
+                block = np.concatenate((carry, block))
+            usable = len(block) - len(block) % num_channels
+            carry = block[usable:]
+            volts = block[:usable].reshape(-1, num_channels).T
+            codes = to_codes(volts, calibration)
+            if codes.size:
+                max_error = max(max_error, float(np.max(np.abs(
+                    (codes - offset) * gain - volts))))
+            writer.write(codes)
+            block = next(blocks, None)
+    samples = writer.sample_index
+
+    with RecordingReader(temp, verify=True) as reader:
+        stored = reader.num_samples
+    if not stored == samples == expected == values // num_channels:
+        os.remove(temp)
+        raise ValueError('{}: {} values, {} samples expected, {} stored'
+                         .format(path, values, expected, stored))
+    os.replace(temp, output)
+    return {'source': path, 'output': output, 'layout': layout,
+            'values': values, 'samples': samples,
+            'dropped': values - samples * num_channels,
+            'max_error': max_error}
+
+
+def _convert_task(task):
+    """ Pool worker: convert one file, reporting errors instead of raising. """
+    path, output, scan_rate, layout, calibration = task
+    try:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        return convert(path, output, scan_rate, layout, calibration)
+    except (OSError, ValueError) as err:
+        return {'source': path, 'error': str(err)}
+
+
+def find_sources(paths):
+    """ Return the legacy CSV files below the given files or directories. """
+    sources = []
+    for path in paths:
+        if os.path.isfile(path):
+            sources.append(path)
+            continue
+        for root, _dirs, files in os.walk(path):
+            for name in sorted(files):
+                if any(pattern.match(name) for pattern, _rate, _meta
+                       in LEGACY_FILES) or name.endswith('.csv'):
+                    sources.append(os.path.join(root, name))
+    return sources
+
+
+def load_journal(path):
+    """ Return the sources already converted, from the journal. """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r') as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut off by an interruption.
+                continue
+            if 'error' not in entry and os.path.exists(entry['output']):
+                done.add(entry['source'])
+    return done
+
+
+def main():
+    """ Convert the files or directories given on the command line. """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('sources', nargs='+',
+                        help='CSV files or directories to convert')
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='parallel conversions')
+    parser.add_argument('--scan-rate', type=float,
+                        help='sample rate for files not named by the '
+                        'legacy scripts (or to override it)')
+    parser.add_argument('--layout', default=LAYOUT_AUTO,
+                        choices=(LAYOUT_AUTO, LAYOUT_SINGLE,
+                                 LAYOUT_INTERLEAVED))
+    parser.add_argument('--calibration',
+                        help='JSON file with the calibration of channels 0 '
+                        'and 1 as returned by hat_calibration()')
+    args = parser.parse_args()
+    calibration = None
+    if args.calibration:
+        with open(args.calibration, 'r') as cal_file:
+            calibration = json.load(cal_file)
+
+    os.makedirs(args.out, exist_ok=True)
+    journal_path = os.path.join(args.out, JOURNAL)
+    done = load_journal(journal_path)
+    tasks = []
+    for root in args.sources:
+        for source in find_sources([root]):
+            if source in done:
+                continue
+            relative = os.path.relpath(source, root) \
+                if os.path.isdir(root) else os.path.basename(source)
+            # udp_scan.py names have dots but no extension.
+            if relative.endswith('.csv'):
+                relative = relative[:-len('.csv')]
+            output = os.path.join(args.out, relative + FILE_SUFFIX)
+            tasks.append((source, output, args.scan_rate, args.layout,
+                          calibration))
+    print('{} files to convert, {} already done'.format(len(tasks),
+                                                        len(done)))
+
+    failed = 0
+    with Pool(args.workers) as pool, open(journal_path, 'a') as journal:
+        for count, entry in enumerate(pool.imap_unordered(_convert_task,
+                                                          tasks), 1):
+            journal.write(json.dumps(entry) + '\n')
+            journal.flush()
+            if 'error' in entry:
+                failed += 1
+                print('\n', entry['error'])
+            print('\r{}/{} converted, {} failed'.format(count, len(tasks),
+                                                        failed), end='')
+    print('')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
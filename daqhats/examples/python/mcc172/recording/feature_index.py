@@ -0,0 +1,227 @@
+"""
+    Historical feature index over recordings.
+
+    Summary features (RMS, peak, crest factor, kurtosis and band energies,
+    see :py:func:`diagnosis.features.block_features`) are computed once per
+    window (one minute by default) of every channel of a recording and
+    stored in SQLite, one row per window and one column per feature.  The
+    table is indexed by channel and time, so the trend of a feature over
+    months is one range scan instead of re-reading the recordings.
+
+    :py:class:`FeatureIndexer` maintains the index from a background thread:
+    completed recordings are queued with :py:meth:`FeatureIndexer.add`
+    (for example from the segment recorder's on_segment callback) and
+    existing directories can be indexed with :py:meth:`FeatureIndexer.scan`.
+    Files that are already indexed with the same size are skipped.  Rows
+    are kept when retention deletes a recording, so the trends reach back
+    further than the raw data.
+"""
+import os
+import sqlite3
+from collections import deque
+from threading import Condition, Lock, Thread
+import numpy as np
+from diagnosis.features import block_features, feature_names
+from recording.store import RecordingReader, FILE_SUFFIX
+
+FEATURES = feature_names()
+
+
+class FeatureIndex(object):
+    """
+    SQLite store of per-window features.
+
+    Args:
+        path (str): The database file.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._lock = Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, '
+            'path TEXT UNIQUE, size INTEGER, start_time REAL, '
+            'scan_rate REAL)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS features (file INTEGER, '
+            'channel INTEGER, time REAL, {})'.format(
+                ', '.join('{} REAL'.format(name) for name in FEATURES)))
+        self._db.execute('CREATE INDEX IF NOT EXISTS features_time '
+                         'ON features (channel, time)')
+        self._db.commit()
+
+    def close(self):
+        """ Close the database. """
+        with self._lock:
+            self._db.close()
+
+    def indexed(self, path):
+        """ True if a file is indexed with its current size. """
+        with self._lock:
+            row = self._db.execute('SELECT size FROM files WHERE path = ?',
+                                   (os.path.abspath(path),)).fetchone()
+        return row is not None and row[0] == os.path.getsize(path)
+
+    def add(self, path, window=60.0):
+        """
+        Compute and store the features of a recording, replacing earlier
+        rows of the same file.
+
+        Args:
+            path (str): The recording file.
+            window (float): Window length in seconds.
+
+        Returns:
+            int: The number of rows stored.
+        """
+        path = os.path.abspath(path)
+        rows = []
+        with RecordingReader(path) as reader:
+            rate = reader.scan_rate
+            size = max(1, int(round(window * rate)))
+            for start in range(0, reader.span, size):
+                count = min(size, reader.span - start)
+                # Short tails would skew the statistics of the trend.
+                if count < size // 2 and start:
+                    break
+                data = reader.read(start, count, scaled=True)
+                features = block_features(data, rate)
+                when = reader.start_time + start / rate
+                for row, channel in enumerate(reader.channels):
+                    rows.append((channel, when) +
+                                tuple(float(value)
+                                      for value in features[row]))
+            start_time = reader.start_time
+        with self._lock, self._db:
+            self._remove(path)
+            file_id = self._db.execute(
+                'INSERT INTO files (path, size, start_time, scan_rate) '
+                'VALUES (?, ?, ?, ?)',
+                (path, os.path.getsize(path), start_time, rate)).lastrowid
+            self._db.executemany(
+                'INSERT INTO features VALUES (?, ?, ?, {})'.format(
+                    ', '.join('?' * len(FEATURES))),
+                [(file_id,) + row for row in rows])
+        return len(rows)
+
+    def remove(self, path):
+        """ Delete the rows of a file, e.g. after retention removed it. """
+        with self._lock, self._db:
+            self._remove(os.path.abspath(path))
+
+    def series(self, feature, channel, start_time=None, end_time=None):
+        """
+        Return the time series of one feature.
+
+        Args:
+            feature (str): A feature name, see :py:data:`FEATURES`.
+            channel (int): The channel number.
+            start_time (float): Start of the range (time.time() scale), or
+                None for the beginning.
+            end_time (float): End of the range, or None for the end.
+
+        Returns:
+            tuple: (times, values) as float64 arrays, oldest first.
+
+        Raises:
+            ValueError: Unknown feature name.
+        """
+        if feature not in FEATURES:
+            raise ValueError('Unknown feature {}'.format(feature))
+        start_time = -np.inf if start_time is None else start_time
+        end_time = np.inf if end_time is None else end_time
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT time, {} FROM features WHERE channel = ? AND '
+                'time >= ? AND time < ? ORDER BY time'.format(feature),
+                (channel, start_time, end_time)).fetchall()
+        if not rows:
+            return np.empty(0), np.empty(0)
+        data = np.array(rows, dtype=np.float64)
+        return data[:, 0], data[:, 1]
+
+    def _remove(self, path):
+        row = self._db.execute('SELECT id FROM files WHERE path = ?',
+                               (path,)).fetchone()
+        if row is not None:
+            self._db.execute('DELETE FROM features WHERE file = ?', row)
+            self._db.execute('DELETE FROM files WHERE id = ?', row)
+
+
+class FeatureIndexer(object):
+    """
+    Keep a feature index up to date from a background thread.
+
+    Args:
+        path (str): The database file.
+        window (float): Window length in seconds.
+    """
+
+    def __init__(self, path, window=60.0):
+        self.index = FeatureIndex(path)
+        self.window = window
+        self.indexed = 0
+        self.errors = 0
+        self.last_error = None
+        self._queue = deque()
+        self._cond = Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """ Start the indexing thread. """
+        if self._running:
+            return
+        self._running = True
+        self._thread = Thread(target=self._run, name='feature-indexer',
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """
+        Index what is queued and stop the thread.
+
+        Args:
+            timeout (float): Maximum time to wait for the queue to drain.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def add(self, path):
+        """ Queue a completed recording. Safe to call from any thread. """
+        with self._cond:
+            self._queue.append(path)
+            self._cond.notify()
+
+    def scan(self, directory):
+        """ Queue every recording below a directory that is not indexed. """
+        for root, _dirs, files in os.walk(os.path.expanduser(directory)):
+            for name in sorted(files):
+                if name.endswith(FILE_SUFFIX):
+                    self.add(os.path.join(root, name))
+
+    def series(self, feature, channel, start_time=None, end_time=None):
+        """ See :py:meth:`FeatureIndex.series`. """
+        return self.index.series(feature, channel, start_time, end_time)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait(1.0)
+                if not self._queue:
+                    break
+                path = self._queue.popleft()
+            try:
+                if not self.index.indexed(path):
+                    self.index.add(path, self.window)
+                    self.indexed += 1
+            except (OSError, ValueError, sqlite3.Error) as err:
+                self.errors += 1
+                self.last_error = str(err)
@@ -0,0 +1,311 @@
+"""
+    Continuous rolling recording in time-indexed segments.
+
+    Every channel is recorded without interruption into segment files of a
+    fixed duration (``<directory>/ch<channel>/<segment>.mcr``).  When a
+    segment is complete it is appended to a compact binary index
+    (``<directory>/segments.idx``) that maps time to segment and sample
+    offset, and the oldest segments are deleted to stay within the retention
+    budget (bytes and/or hours).
+
+    Segment times are derived from the sample clock, not the wall clock of
+    each block, so they do not drift within a scan session.  A time range
+    query is a binary search in the in-memory index plus a memory-mapped read
+    of one or two segment files.
+"""
+import os
+import time
+from threading import Lock
+import numpy as np
+from recording.store import RecordingReader, FILE_SUFFIX
+from recording.writer import AsyncRecorder
+
+INDEX_NAME = 'segments.idx'
+
+# start time, scan rate, start sample, samples, bytes, segment, channel
+INDEX_DTYPE = np.dtype([
+    ('start_time', '<f8'), ('scan_rate', '<f8'), ('start_sample', '<i8'),
+    ('samples', '<i8'), ('bytes', '<i8'), ('segment', '<u4'),
+    ('channel', '<u1'), ('_pad', 'V3')])
+
+
+class SegmentIndex(object):
+    """
+    Time index of the segments in a recording directory.
+
+    Args:
+        directory (str): The recording directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_NAME)
+        self._lock = Lock()
+        if os.path.exists(self.path):
+            records = np.fromfile(self.path, dtype=INDEX_DTYPE)
+        else:
+            records = np.empty(0, dtype=INDEX_DTYPE)
+        self.records = np.sort(records, order=('channel', 'start_time'))
+
+    def segment_path(self, channel, segment):
+        """ Return the file of a segment. """
+        return os.path.join(self.directory, 'ch{}'.format(channel),
+                            '{:08d}{}'.format(segment, FILE_SUFFIX))
+
+    def append(self, record):
+        """
+        Add a completed segment.
+
+        Args:
+            record (numpy.void): An INDEX_DTYPE record.
+        """
+        with self._lock:
+            with open(self.path, 'ab') as index:
+                index.write(record.tobytes())
+            records = np.append(self.records, record)
+            self.records = np.sort(records, order=('channel', 'start_time'))
+
+    def remove(self, mask):
+        """
+        Delete segments and rewrite the index.
+
+        Args:
+            mask (numpy.ndarray): Boolean mask of the records to delete.
+        """
+        with self._lock:
+            for record in self.records[mask]:
+                try:
+                    os.remove(self.segment_path(int(record['channel']),
+                                                int(record['segment'])))
+                except FileNotFoundError:
+                    pass
+            self.records = self.records[~mask]
+            temp = self.path + '.tmp'
+            self.records.tofile(temp)
+            os.replace(temp, self.path)
+
+    def next_segment(self):
+        """ Return the next free segment number. """
+        with self._lock:
+            if not len(self.records):
+                return 0
+            return int(self.records['segment'].max()) + 1
+
+    def locate(self, channel, start_time, end_time):
+        """
+        Find the segments overlapping a time range.
+
+        Args:
+            channel (int): The channel number.
+            start_time (float): Start of the range (time.time() scale).
+            end_time (float): End of the range.
+
+        Returns:
+            numpy.ndarray: The INDEX_DTYPE records, oldest first.
+        """
+        with self._lock:
+            records = self.records[self.records['channel'] == channel]
+        ends = records['start_time'] + \
+            records['samples'] / records['scan_rate']
+        first = int(np.searchsorted(ends, start_time, side='right'))
+        last = int(np.searchsorted(records['start_time'], end_time,
+                                   side='left'))
+        return records[first:last]
+
+    def query(self, channel, start_time, end_time, scaled=False):
+        """
+        Return the samples of one channel in a time range.
+
+        Args:
+            channel (int): The channel number.
+            start_time (float): Start of the range (time.time() scale).
+            end_time (float): End of the range.
+            scaled (bool): Convert int32 codes with the stored calibration.
+
+        Returns:
+            tuple: (time of the first returned sample, scan rate, 1-D array
+            of samples).  Samples from consecutive segments are joined; the
+            array is empty if nothing was recorded in the range.
+        """
+        parts = []
+        first_time = None
+        rate = None
+        for record in self.locate(channel, start_time, end_time):
+            rate = float(record['scan_rate'])
+            seg_start = float(record['start_time'])
+            lo = max(0, int(np.ceil((start_time - seg_start) * rate)))
+            hi = min(int(record['samples']),
+                     int(np.ceil((end_time - seg_start) * rate)))
+            if hi <= lo:
+                continue
+            path = self.segment_path(channel, int(record['segment']))
+            with RecordingReader(path) as reader:
+                parts.append(np.array(reader.read(lo, hi - lo,
+                                                  scaled=scaled)[0]))
+            if first_time is None:
+                first_time = seg_start + lo / rate
+        if not parts:
+            return start_time, rate, np.empty(0)
+        return first_time, rate, np.concatenate(parts)
+
+
+class SegmentRecorder(object):
+    """
+    Record channels continuously into rotating, indexed segments.
+
+    Args:
+        directory (str): The recording directory.
+        scan_rate (float): The sample rate in Hz.
+        channels (list[int]): The channel numbers, in block row order.
+        segment_seconds (float): Duration of one segment file.
+        retention_bytes (int): Maximum size of all segments, or None.
+        retention_hours (float): Maximum age of segments, or None.
+        recorder (AsyncRecorder): The writer to use; a private one is
+            started if None.
+        on_segment (callable): Optional callback(path) run by the writer
+            thread when a segment file is complete and indexed.
+        **kwargs: Additional :py:class:`RecordingWriter` arguments (dtype,
+            chunk_samples, codec, calibration).
+    """
+
+    def __init__(self, directory, scan_rate, channels, segment_seconds=600.0,
+                 retention_bytes=None, retention_hours=None, recorder=None,
+                 on_segment=None, **kwargs):
+        # pylint: disable=too-many-arguments
+        self.directory = os.path.expanduser(directory)
+        for channel in channels:
+            os.makedirs(os.path.join(self.directory, 'ch{}'.format(channel)),
+                        exist_ok=True)
+        self.index = SegmentIndex(self.directory)
+        self.scan_rate = scan_rate
+        self.channels = list(channels)
+        self.segment_samples = int(round(segment_seconds * scan_rate))
+        self.retention_bytes = retention_bytes
+        self.retention_hours = retention_hours
+        self.writer_args = kwargs
+        self.on_segment = on_segment
+
+        self._own_recorder = recorder is None
+        self.recorder = AsyncRecorder() if recorder is None else recorder
+        if self._own_recorder:
+            self.recorder.start()
+
+        self._segment = max([self.index.next_segment()] +
+                            [self._last_file(channel) + 1
+                             for channel in self.channels])
+        self._streams = None
+        self._seg_start_sample = 0
+        self._seg_fill = 0
+        self._sample_index = 0
+        self._time_origin = None
+
+    def write(self, block, timestamp=None):
+        """
+        Record a block.
+
+        Args:
+            block (numpy.ndarray): Samples shaped (channels, samples).
+            timestamp (float): Time of the first sample of the block.  Only
+                used for the first block of a session, later times follow
+                from the sample count.
+        """
+        block = np.asarray(block)
+        if self._time_origin is None:
+            if timestamp is None:
+                timestamp = time.time() - block.shape[1] / self.scan_rate
+            self._time_origin = timestamp - self._sample_index / self.scan_rate
+        pos = 0
+        while pos < block.shape[1]:
+            if self._streams is None:
+                self._open_segment()
+            count = min(block.shape[1] - pos,
+                        self.segment_samples - self._seg_fill)
+            for row, stream in enumerate(self._streams):
+                self.recorder.write(stream, block[row:row + 1, pos:pos + count])
+            pos += count
+            self._seg_fill += count
+            self._sample_index += count
+            if self._seg_fill == self.segment_samples:
+                self._close_segment()
+
+    def restart(self):
+        """
+        Start a new timeline, for example after the scan was restarted.  The
+        next block's timestamp becomes the time origin.
+        """
+        self._close_segment()
+        self._time_origin = None
+
+    def close(self):
+        """ Finish the current segment (and the private writer). """
+        self._close_segment()
+        if self._own_recorder:
+            self.recorder.stop()
+
+    def time_of(self, sample_index):
+        """ Return the time of a sample index of the current session. """
+        return self._time_origin + sample_index / self.scan_rate
+
+    def _last_file(self, channel):
+        """ Return the highest segment number on disk (also unindexed). """
+        numbers = [-1]
+        for name in os.listdir(os.path.join(self.directory,
+                                            'ch{}'.format(channel))):
+            stem, suffix = os.path.splitext(name)
+            if suffix == FILE_SUFFIX and stem.isdigit():
+                numbers.append(int(stem))
+        return max(numbers)
+
+    def _open_segment(self):
+        start_time = self.time_of(self._sample_index)
+        self._seg_start_sample = self._sample_index
+        self._seg_fill = 0
+        self._streams = []
+        for channel in self.channels:
+            path = self.index.segment_path(channel, self._segment)
+            record = np.zeros((), dtype=INDEX_DTYPE)
+            record['start_time'] = start_time
+            record['scan_rate'] = self.scan_rate
+            record['start_sample'] = self._sample_index
+            record['segment'] = self._segment
+            record['channel'] = channel
+            self._streams.append(self.recorder.open(
+                path, scan_rate=self.scan_rate, channels=[channel],
+                start_time=start_time, start_sample=self._sample_index,
+                on_close=lambda path, record=record: self._finished(path,
+                                                                   record),
+                **self.writer_args))
+        self._segment += 1
+
+    def _close_segment(self):
+        if self._streams is None:
+            return
+        for stream in self._streams:
+            self.recorder.close(stream)
+        self._streams = None
+
+    def _finished(self, path, record):
+        """ Writer thread: index a complete segment and apply retention. """
+        with RecordingReader(path) as reader:
+            record['samples'] = reader.span
+        record['bytes'] = os.path.getsize(path)
+        self.index.append(record)
+        self._apply_retention()
+        if self.on_segment is not None:
+            self.on_segment(path)
+
+    def _apply_retention(self):
+        records = self.index.records
+        if not len(records):
+            return
+        remove = np.zeros(len(records), dtype=bool)
+        if self.retention_hours is not None:
+            remove |= records['start_time'] < \
+                time.time() - self.retention_hours * 3600.0
+        if self.retention_bytes is not None:
+            order = np.argsort(records['start_time'])
+            newest_first = order[::-1]
+            kept = np.cumsum(records['bytes'][newest_first])
+            remove[newest_first[kept > self.retention_bytes]] = True
+        if remove.any():
+            self.index.remove(remove)
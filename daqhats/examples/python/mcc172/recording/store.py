@@ -0,0 +1,466 @@
+"""
+    Binary chunked recording format for MCC 172 data.
+
+    A recording file holds one or more channels sampled at the same rate::
+
+        file header   magic 'MCCREC' 00 01 | metadata length u32 |
+                      JSON metadata (padded to 8 bytes)
+        chunk         magic 'CHNK' | codec u8 | reserved u8 | channels u16 |
+                      sample index u64 | samples u32 | stored bytes u32 |
+                      crc32 u32 | padding to 32 bytes | payload
+
+    The metadata stores the scan rate, channel map, sample type, calibration
+    and start timestamp.  Chunk payloads are channel-major (all samples of the
+    first channel, then the second, ...), either raw or compressed.  Raw
+    chunks are returned by the reader as zero-copy views of a memory map.
+
+    Samples are stored as float32 volts, or as int32 ADC codes when the scan
+    was run with OptionFlags.NOSCALEDATA | OptionFlags.NOCALIBRATEDATA; the
+    calibration in the metadata converts codes to engineering units.
+"""
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+import numpy as np
+
+FILE_MAGIC = b'MCCREC\x00\x01'
+FILE_SUFFIX = '.mcr'
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+
+_FILE_HEADER = struct.Struct('<8sI')
+_CHUNK_HEADER = struct.Struct('<4sBBHQIII4x')
+_CHUNK_MAGIC = b'CHNK'
+
+# Size of one MCC 172 ADC code in volts (+/-5 V, 24 bits).
+MCC172_LSB = 10.0 / (1 << 24)
+_MIN_CODE = -(1 << 23)
+_MAX_CODE = (1 << 23) - 1
+
+_CODECS = {}
+
+
+def register_codec(codec_id, encode, decode):
+    """
+    Register a chunk compression codec.
+
+    Args:
+        codec_id (int): The id stored in the chunk header.
+        encode (callable): encode(array) -> bytes, for a (channels, samples)
+            array.
+        decode (callable): decode(bytes, dtype, shape) -> array.
+    """
+    _CODECS[codec_id] = (encode, decode)
+
+
+register_codec(CODEC_ZLIB,
+               lambda array: zlib.compress(array.tobytes(), 1),
+               lambda data, dtype, shape: np.frombuffer(
+                   zlib.decompress(data), dtype=dtype).reshape(shape))
+
+
+def hat_calibration(hat, channels):
+    """
+    Read the calibration needed to convert int32 codes to volts (or
+    sensor units).
+
+    Args:
+        hat (mcc172): The mcc172 HAT device object.
+        channels (list[int]): The scanned channels.
+
+    Returns:
+        list[dict]: slope, offset and scale for each channel.
+    """
+    calibration = []
+    for channel in channels:
+        coefficients = hat.calibration_coefficient_read(channel)
+        # mV per unit, 1000 (volts) by default; the library scales by
+        # LSB / (sensitivity / 1000).
+        sensitivity = hat.a_in_sensitivity_read(channel)
+        calibration.append({
+            'slope': coefficients.slope,
+            'offset': coefficients.offset,
+            'scale': MCC172_LSB * 1000.0 / sensitivity if sensitivity
+                     else MCC172_LSB,
+        })
+    return calibration
+
+
+def to_codes(data, calibration):
+    """
+    Convert calibrated, scaled samples back to int32 ADC codes.
+
+    The MCC 172 library computes (code - offset) * slope * scale in double
+    precision, so rounding the inverse recovers the exact codes and the
+    recording can be stored losslessly as integers.  Values beyond the
+    input range saturate at the 24-bit code limits.
+
+    Args:
+        data (numpy.ndarray): Samples shaped (channels, samples).
+        calibration (list[dict]): The per-channel calibration, see
+            :py:func:`hat_calibration`.
+
+    Returns:
+        numpy.ndarray: The int32 codes.
+    """
+    offset = np.array([[item['offset']] for item in calibration])
+    gain = np.array([[item['slope'] * item['scale']] for item in calibration])
+    codes = np.rint(np.asarray(data) / gain + offset)
+    return np.clip(codes, _MIN_CODE, _MAX_CODE).astype(np.int32)
+
+
+class RecordingWriter(object):
+    """
+    Write blocks of samples to a chunked recording file.
+
+    Args:
+        path (str): The output file.
+        scan_rate (float): The sample rate in Hz.
+        channels (list[int]): The channel numbers, in block row order.
+        dtype (str): 'float32' for volts or 'int32' for ADC codes.
+        chunk_samples (int): Samples per channel in each chunk.
+        codec (int): CODEC_NONE or a registered compression codec.
+        calibration (list[dict]): Optional per-channel calibration, see
+            :py:func:`hat_calibration`.
+        start_time (float): Timestamp of the first sample (time.time()).
+        start_sample (int): Sample index of the first sample.
+        metadata (dict): Additional metadata to store in the header.
+    """
+
+    def __init__(self, path, scan_rate, channels, dtype='float32',
+                 chunk_samples=25600, codec=CODEC_NONE, calibration=None,
+                 start_time=None, start_sample=0, metadata=None):
+        # pylint: disable=too-many-arguments
+        if np.dtype(dtype) not in (np.dtype('float32'), np.dtype('int32')):
+            raise ValueError('dtype must be float32 or int32')
+        if codec != CODEC_NONE and codec not in _CODECS:
+            raise ValueError('Unknown codec {}'.format(codec))
+        self.path = path
+        self.channels = list(channels)
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.chunk_samples = chunk_samples
+        self.codec = codec
+        self.sample_index = start_sample
+        self.skipped = 0
+        self.bytes_written = 0
+
+        header = {
+            'version': 1,
+            'scan_rate': scan_rate,
+            'channels': self.channels,
+            'dtype': self.dtype.name,
+            'chunk_samples': chunk_samples,
+            'start_time': time.time() if start_time is None else start_time,
+            'start_sample': start_sample,
+            'calibration': calibration,
+        }
+        header.update(metadata or {})
+        meta = json.dumps(header).encode('utf-8')
+        meta += b' ' * (-(len(meta) + _FILE_HEADER.size) % 8)
+
+        self._buffer = np.empty((len(self.channels), chunk_samples),
+                                dtype=self.dtype)
+        self._fill = 0
+        self._file = open(path, 'wb')
+        self._write(_FILE_HEADER.pack(FILE_MAGIC, len(meta)) + meta)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+    def write(self, block):
+        """
+        Append samples.
+
+        Args:
+            block (numpy.ndarray): Samples shaped (channels, samples).
+        """
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block.reshape(1, -1)
+        pos = 0
+        while pos < block.shape[1]:
+            count = min(self.chunk_samples - self._fill, block.shape[1] - pos)
+            self._buffer[:, self._fill:self._fill + count] = \
+                block[:, pos:pos + count]
+            self._fill += count
+            pos += count
+            if self._fill == self.chunk_samples:
+                self._write_chunk()
+
+    def flush(self, partial=True):
+        """
+        Flush the file.
+
+        Args:
+            partial (bool): Also write buffered samples that do not fill a
+                chunk yet, as a short chunk.
+        """
+        if partial and self._fill:
+            self._write_chunk()
+        self._file.flush()
+
+    def fileno(self):
+        """ Return the file descriptor of the recording file. """
+        return self._file.fileno()
+
+    def close(self):
+        """ Flush and close the file. """
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def encode_chunk(self, samples):
+        """
+        Encode one chunk, including its header.
+
+        Args:
+            samples (numpy.ndarray): Samples shaped (channels, samples).
+
+        Returns:
+            bytes: The chunk as stored in the file.
+        """
+        samples = np.ascontiguousarray(samples, dtype=self.dtype)
+        codec = self.codec
+        if codec == CODEC_NONE:
+            payload = samples.tobytes()
+        else:
+            payload = _CODECS[codec][0](samples)
+        header = _CHUNK_HEADER.pack(
+            _CHUNK_MAGIC, codec, 0, samples.shape[0], self.sample_index,
+            samples.shape[1], len(payload), zlib.crc32(payload))
+        self.sample_index += samples.shape[1]
+        return header + payload
+
+    def _write_chunk(self):
+        self._write(self.encode_chunk(self._buffer[:, :self._fill]))
+        self._fill = 0
+
+    def _write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+
+class RecordingReader(object):
+    """
+    Read a chunked recording file through a memory map.
+
+    A truncated final chunk (for example after a power loss) is ignored.
+
+    Args:
+        path (str): The recording file.
+        verify (bool): Check the CRC of each chunk when it is read.
+    """
+
+    def __init__(self, path, verify=False):
+        self.path = path
+        self.verify = verify
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, meta_len = _FILE_HEADER.unpack_from(self._map)
+        if magic != FILE_MAGIC:
+            raise ValueError('{} is not a recording file'.format(path))
+        offset = _FILE_HEADER.size
+        self.metadata = json.loads(
+            self._map[offset:offset + meta_len].decode('utf-8'))
+        self.dtype = np.dtype(self.metadata['dtype']).newbyteorder('<')
+        offset += meta_len
+
+        offsets, indices, counts, codecs, stored = [], [], [], [], []
+        while offset + _CHUNK_HEADER.size <= size:
+            (magic, codec, _reserved, _channels, index, count, length,
+             _crc) = _CHUNK_HEADER.unpack_from(self._map, offset)
+            if magic != _CHUNK_MAGIC or \
+                    offset + _CHUNK_HEADER.size + length > size:
+                break
+            offsets.append(offset)
+            indices.append(index)
+            counts.append(count)
+            codecs.append(codec)
+            stored.append(length)
+            offset += _CHUNK_HEADER.size + length
+        self.chunk_offsets = np.array(offsets, dtype=np.int64)
+        self.chunk_indices = np.array(indices, dtype=np.int64)
+        self.chunk_samples = np.array(counts, dtype=np.int64)
+        self.chunk_codecs = codecs
+        self.chunk_bytes = np.array(stored, dtype=np.int64)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+    def close(self):
+        """ Release the memory map and the file. """
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Arrays returned by chunk() still reference the map; it is
+                # released when they are garbage collected.
+                pass
+            self._file.close()
+            self._map = None
+
+    @property
+    def scan_rate(self):
+        """ The sample rate in Hz. """
+        return self.metadata['scan_rate']
+
+    @property
+    def channels(self):
+        """ The channel numbers, in row order. """
+        return self.metadata['channels']
+
+    @property
+    def start_sample(self):
+        """ The sample index of the first sample in the file. """
+        return self.metadata['start_sample']
+
+    @property
+    def start_time(self):
+        """ The timestamp of the first sample in the file. """
+        return self.metadata['start_time']
+
+    @property
+    def num_samples(self):
+        """ The number of samples per channel in the file. """
+        return int(self.chunk_samples.sum())
+
+    @property
+    def span(self):
+        """ The number of sample periods covered, including gaps. """
+        if not self.num_chunks:
+            return 0
+        return int(self.chunk_indices[-1] + self.chunk_samples[-1] -
+                   self.start_sample)
+
+    @property
+    def num_chunks(self):
+        """ The number of complete chunks in the file. """
+        return len(self.chunk_offsets)
+
+    def gaps(self):
+        """
+        Return the holes in the timeline, where samples were skipped
+        instead of written.
+
+        Returns:
+            list: (sample index, number of missing samples) tuples.
+        """
+        expected = self.start_sample + np.concatenate(
+            ([0], np.cumsum(self.chunk_samples)[:-1]))
+        skipped = self.chunk_indices - expected
+        missing = np.diff(np.concatenate(([0], skipped)))
+        return [(int(self.chunk_indices[i] - missing[i]), int(missing[i]))
+                for i in np.nonzero(missing)[0]]
+
+    def chunk(self, index):
+        """
+        Return one chunk.
+
+        Args:
+            index (int): The chunk number.
+
+        Returns:
+            numpy.ndarray: Samples shaped (channels, samples).  Uncompressed
+            chunks are read-only views of the memory map.
+        """
+        offset = int(self.chunk_offsets[index]) + _CHUNK_HEADER.size
+        length = int(self.chunk_bytes[index])
+        shape = (len(self.channels), int(self.chunk_samples[index]))
+        data = memoryview(self._map)[offset:offset + length]
+        if self.verify:
+            crc = _CHUNK_HEADER.unpack_from(self._map, offset -
+                                            _CHUNK_HEADER.size)[7]
+            if zlib.crc32(data) != crc:
+                raise ValueError('CRC error in chunk {} of {}'.format(
+                    index, self.path))
+        codec = self.chunk_codecs[index]
+        if codec == CODEC_NONE:
+            return np.frombuffer(data, dtype=self.dtype).reshape(shape)
+        return _CODECS[codec][1](data, self.dtype, shape)
+
+    def read(self, start=0, count=None, channels=None, scaled=False):
+        """
+        Read a range of samples.
+
+        Positions follow the sample clock, so samples skipped by the writer
+        (see :py:meth:`gaps`) keep their place and are returned as zeros.
+
+        Args:
+            start (int): The first sample, relative to the start of the file.
+            count (int): The number of samples (to the end by default).
+            channels (list[int]): Channel numbers to return (all by default).
+            scaled (bool): Convert int32 codes with the stored calibration.
+
+        Returns:
+            numpy.ndarray: Samples shaped (channels, count).  A range inside
+            one uncompressed chunk is returned without copying.
+        """
+        total = self.span
+        if count is None:
+            count = total - start
+        start = max(0, start)
+        stop = max(start, min(total, start + count))
+        rows = [self.channels.index(chan) for chan in channels] \
+            if channels is not None else slice(None)
+        num_rows = len(channels) if channels is not None else \
+            len(self.channels)
+
+        starts = self.chunk_indices - self.start_sample
+        ends = starts + self.chunk_samples
+        first = int(np.searchsorted(ends, start, side='right'))
+        last = int(np.searchsorted(starts, stop, side='left'))
+        parts = []
+        for index in range(first, last):
+            chunk_start = int(starts[index])
+            lo = max(start, chunk_start)
+            hi = min(stop, int(ends[index]))
+            if hi > lo:
+                parts.append((lo - start, self.chunk(index)[
+                    rows, lo - chunk_start:hi - chunk_start]))
+
+        if len(parts) == 1 and parts[0][0] == 0 and \
+                parts[0][1].shape[1] == stop - start:
+            data = parts[0][1]
+        else:
+            data = np.zeros((num_rows, stop - start), dtype=self.dtype)
+            for offset, part in parts:
+                data[:, offset:offset + part.shape[1]] = part
+
+        if scaled:
+            data = self.scale(data, channels)
+        return data
+
+    def scale(self, data, channels=None):
+        """
+        Convert int32 codes to volts (or sensor units) with the stored
+        calibration.  Float recordings are returned as float64 unchanged.
+
+        Args:
+            data (numpy.ndarray): Samples shaped (channels, samples).
+            channels (list[int]): The channel numbers of the rows.
+
+        Returns:
+            numpy.ndarray: The scaled float64 samples.
+        """
+        calibration = self.metadata.get('calibration')
+        if self.dtype.kind == 'f' or not calibration:
+            return data.astype(np.float64)
+        if channels is None:
+            channels = self.channels
+        cal = [calibration[self.channels.index(chan)] for chan in channels]
+        offset = np.array([[item['offset']] for item in cal])
+        gain = np.array([[item['slope'] * item['scale']] for item in cal])
+        return (data - offset) * gain
@@ -0,0 +1,166 @@
+"""
+    Round-trip tests of the chunk codecs, the recording file format and the
+    calibration.
+
+    Run from the mcc172 directory with ``python -m pytest recording`` or
+    ``python -m unittest recording.test_roundtrip``.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+import numpy as np
+from recording import compression
+from recording.store import RecordingReader, RecordingWriter, CODEC_NONE, \
+    CODEC_ZLIB, FILE_SUFFIX, MCC172_LSB, hat_calibration, to_codes
+from recording.compression import CODEC_PRED
+
+# (channels, samples): empty, single sample, odd and longer than a block.
+SHAPES = ((1, 0), (2, 0), (1, 1), (2, 1), (1, 7), (2, 129), (3, 1001))
+# Sample counts written to files with 100 sample chunks.
+COUNTS = (0, 1, 99, 100, 257)
+
+
+def _samples(dtype, shape, seed=0):
+    """ Return 24-bit ADC codes or float32 volts with noise and a step. """
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(-(1 << 23), 1 << 23, size=shape)
+    if shape[1] > 2:
+        codes[:, shape[1] // 2] = (1 << 23) - 1
+        codes[:, shape[1] // 2 + 1] = -(1 << 23)
+    if np.dtype(dtype).kind == 'f':
+        return (codes * (10.0 / (1 << 24))).astype(dtype)
+    return codes.astype(dtype)
+
+
+class CodecRoundTrip(unittest.TestCase):
+    """ compression.encode -> compression.decode. """
+
+    def test_int32(self):
+        for shape in SHAPES:
+            samples = _samples(np.int32, shape)
+            decoded = compression.decode(compression.encode(samples),
+                                         np.int32, shape)
+            self.assertEqual(decoded.dtype, np.int32)
+            np.testing.assert_array_equal(decoded, samples, str(shape))
+
+    def test_float32(self):
+        for shape in SHAPES:
+            samples = _samples(np.float32, shape)
+            decoded = compression.decode(compression.encode(samples),
+                                         np.float32, shape)
+            self.assertEqual(decoded.dtype, np.float32)
+            np.testing.assert_array_equal(decoded, samples, str(shape))
+
+
+class FileRoundTrip(unittest.TestCase):
+    """ RecordingWriter -> RecordingReader with every codec. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _round_trip(self, dtype, codec, count, channels=(0, 1)):
+        path = os.path.join(self.directory, 'test' + FILE_SUFFIX)
+        samples = _samples(dtype, (len(channels), count), seed=count)
+        with RecordingWriter(path, 51200.0, list(channels), dtype=dtype,
+                             chunk_samples=100, codec=codec) as writer:
+            # Odd block sizes, so writes straddle the chunks.
+            for start in range(0, count, 37):
+                writer.write(samples[:, start:start + 37])
+        with RecordingReader(path, verify=True) as reader:
+            self.assertEqual(reader.num_samples, count)
+            self.assertEqual(reader.channels, list(channels))
+            data = reader.read()
+            self.assertEqual(data.dtype, np.dtype(dtype))
+            np.testing.assert_array_equal(data, samples)
+            if count > 2:
+                np.testing.assert_array_equal(
+                    reader.read(1, count - 2, channels=[channels[-1]]),
+                    samples[-1:, 1:count - 1])
+
+    def test_int32(self):
+        for codec in (CODEC_NONE, CODEC_ZLIB, CODEC_PRED):
+            for count in COUNTS:
+                with self.subTest(codec=codec, count=count):
+                    self._round_trip('int32', codec, count)
+
+    def test_float32(self):
+        for codec in (CODEC_NONE, CODEC_ZLIB, CODEC_PRED):
+            for count in COUNTS:
+                with self.subTest(codec=codec, count=count):
+                    self._round_trip('float32', codec, count)
+
+    def test_one_channel(self):
+        self._round_trip('int32', CODEC_PRED, 257, channels=(1,))
+
+
+_Coefficients = namedtuple('_Coefficients', ['slope', 'offset'])
+
+
+class _FakeHat(object):
+    """ The calibration calls of mcc172 with fixed values. """
+
+    def __init__(self, sensitivities):
+        self.sensitivities = sensitivities
+
+    def calibration_coefficient_read(self, channel):
+        return _Coefficients(1.0 + 1e-3 * (channel + 1), -120.0 * channel)
+
+    def a_in_sensitivity_read(self, channel):
+        return self.sensitivities[channel]
+
+
+class CalibrationRoundTrip(unittest.TestCase):
+    """ hat_calibration and to_codes against the library scaling. """
+
+    def test_nominal_volts(self):
+        calibration = hat_calibration(_FakeHat([1000.0]), [0])
+        calibration[0].update(slope=1.0, offset=0.0)
+        np.testing.assert_array_equal(
+            to_codes(np.array([[0.5, 1.0, 2.0, -3.0]]), calibration),
+            [[838861, 1677722, 3355443, -5033165]])
+
+    def test_library_formula(self):
+        # Volts (1000 mV/V) and a 100 mV/g accelerometer.
+        sensitivities = [1000.0, 100.0]
+        hat = _FakeHat(sensitivities)
+        calibration = hat_calibration(hat, [0, 1])
+        codes = _samples(np.int32, (2, 1001))
+        values = np.empty(codes.shape)
+        for channel, sensitivity in enumerate(sensitivities):
+            coefficients = hat.calibration_coefficient_read(channel)
+            # mcc172.c: (code - offset) * slope * LSB / (sensitivity / 1000)
+            values[channel] = (codes[channel] - coefficients.offset) * \
+                coefficients.slope * MCC172_LSB / (sensitivity / 1000.0)
+        np.testing.assert_array_equal(to_codes(values, calibration), codes)
+
+    def test_full_scale(self):
+        calibration = hat_calibration(_FakeHat([1000.0]), [0])
+        calibration[0].update(slope=1.0, offset=0.0)
+        volts = np.array([[-10.0, -5.0, 5.0 - MCC172_LSB, 5.0, 10.0, 1e9]])
+        codes = to_codes(volts, calibration)
+        np.testing.assert_array_equal(
+            codes, [[-(1 << 23), -(1 << 23), (1 << 23) - 1, (1 << 23) - 1,
+                     (1 << 23) - 1, (1 << 23) - 1]])
+        # Full-scale codes survive the file unchanged.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'full' + FILE_SUFFIX)
+        with RecordingWriter(path, 51200.0, [0], dtype='int32',
+                             codec=CODEC_PRED,
+                             calibration=calibration) as writer:
+            writer.write(codes)
+        with RecordingReader(path, verify=True) as reader:
+            np.testing.assert_array_equal(reader.read(), codes)
+            np.testing.assert_allclose(
+                reader.read(scaled=True),
+                [[-5.0, -5.0, 5.0 - MCC172_LSB, 5.0 - MCC172_LSB,
+                  5.0 - MCC172_LSB, 5.0 - MCC172_LSB]])
+
+
+if __name__ == '__main__':
+    unittest.main()
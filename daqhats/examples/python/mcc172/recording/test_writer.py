@@ -0,0 +1,68 @@
+"""
+    Tests of the background recording writer.
+
+    Run from the mcc172 directory with ``python -m pytest recording`` or
+    ``python -m unittest recording.test_writer``.
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+from recording.store import RecordingReader
+from recording.writer import AsyncRecorder, FSYNC_NEVER
+
+
+class AsyncRecorderTest(unittest.TestCase):
+    """ Errors do not stop the writer thread. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.recorder = AsyncRecorder(fsync=FSYNC_NEVER)
+        self.recorder.start()
+
+    def tearDown(self):
+        self.recorder.stop()
+        shutil.rmtree(self.directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + '.mcr')
+
+    def _drain(self):
+        # A close round trip through the queue.
+        closed = []
+        stream = self.recorder.open(self._path('drain'),
+                                    on_close=closed.append,
+                                    scan_rate=1000.0, channels=[0])
+        self.recorder.close(stream)
+        for _i in range(500):
+            if closed:
+                return
+            time.sleep(0.01)
+        self.fail('writer thread did not close the file')
+
+    def test_errors_are_counted(self):
+        def failing_callback(_path):
+            raise RuntimeError('index update failed')
+
+        stream = self.recorder.open(self._path('a'),
+                                    on_close=failing_callback,
+                                    scan_rate=1000.0, channels=[0, 1])
+        # Wrong number of channels: the writer raises ValueError.
+        self.recorder.write(stream, np.zeros((3, 10), dtype=np.float32))
+        self._drain()
+        self.recorder.write(stream, np.ones((2, 10), dtype=np.float32))
+        self.recorder.close(stream)
+        self._drain()
+
+        metrics = self.recorder.metrics()
+        self.assertTrue(metrics['alive'])
+        self.assertEqual(metrics['errors'], 2)
+        self.assertIn('index update failed', metrics['last_error'])
+        with RecordingReader(self._path('a')) as reader:
+            np.testing.assert_array_equal(reader.read(), np.ones((2, 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
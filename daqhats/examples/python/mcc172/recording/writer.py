@@ -0,0 +1,348 @@
+"""
+    Asynchronous recording writer.
+
+    One background thread owns every open recording file.  The acquisition
+    loop hands blocks over through a bounded queue and never touches the SD
+    card itself.  The worker drains everything that is queued at once,
+    concatenates the blocks of each stream into one large sequential write and
+    applies the configured fsync policy.  A failing command (a write, an
+    open or an on_close callback) is counted in the metrics and the thread
+    carries on with the next one.
+
+    When storage cannot keep up and the queue reaches its byte limit, the
+    backpressure policy decides what happens to the next block:
+
+        POLICY_BLOCK    the caller waits until there is room again
+        POLICY_DROP     the block is discarded and counted
+        POLICY_DEGRADE  the block is discarded, but the recording skips the
+                        same number of samples, so the timeline stays
+                        aligned and the hole is visible to readers
+"""
+import os
+import time
+from collections import deque
+from threading import Condition, Thread
+import numpy as np
+from recording.store import RecordingWriter
+
+POLICY_BLOCK = 'block'
+POLICY_DROP = 'drop'
+POLICY_DEGRADE = 'degrade'
+
+FSYNC_NEVER = 'never'
+FSYNC_CLOSE = 'close'
+FSYNC_INTERVAL = 'interval'
+FSYNC_BATCH = 'batch'
+
+_OPEN, _WRITE, _SKIP, _CLOSE = range(4)
+
+
+class AsyncRecorder(object):
+    """
+    Background writer for recording files.
+
+    Args:
+        max_queue_bytes (int): Queue limit that triggers the backpressure
+            policy.
+        policy (str): POLICY_BLOCK, POLICY_DROP or POLICY_DEGRADE.
+        fsync (str): FSYNC_NEVER, FSYNC_CLOSE, FSYNC_INTERVAL or FSYNC_BATCH.
+        fsync_interval (float): Seconds between syncs with FSYNC_INTERVAL.
+        block_timeout (float): Longest wait with POLICY_BLOCK before the
+            block is dropped after all.
+    """
+
+    def __init__(self, max_queue_bytes=32 << 20, policy=POLICY_BLOCK,
+                 fsync=FSYNC_INTERVAL, fsync_interval=10.0,
+                 block_timeout=5.0):
+        if policy not in (POLICY_BLOCK, POLICY_DROP, POLICY_DEGRADE):
+            raise ValueError('Unknown backpressure policy {}'.format(policy))
+        if fsync not in (FSYNC_NEVER, FSYNC_CLOSE, FSYNC_INTERVAL,
+                         FSYNC_BATCH):
+            raise ValueError('Unknown fsync policy {}'.format(fsync))
+        self.max_queue_bytes = max_queue_bytes
+        self.policy = policy
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.block_timeout = block_timeout
+
+        self._queue = deque()
+        self._queue_bytes = 0
+        self._cond = Condition()
+        self._running = False
+        self._thread = None
+        self._writers = {}
+        self._callbacks = {}
+        self._next_stream = 0
+        self._last_sync = time.monotonic()
+
+        self._closed_bytes = 0
+        self.blocks_written = 0
+        self.dropped_blocks = 0
+        self.dropped_samples = 0
+        self.syncs = 0
+        self.errors = 0
+        self.last_error = None
+        self.write_latency = 0.0
+        self.max_write_latency = 0.0
+        self._latency_total = 0.0
+        self._batches = 0
+
+    def start(self):
+        """ Start the writer thread. """
+        if self._running:
+            return
+        self._running = True
+        self._thread = Thread(target=self._run, name='recording-writer',
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """
+        Write everything that is queued, close all files and stop the thread.
+
+        Args:
+            timeout (float): Maximum time to wait for the queue to drain.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def open(self, path, on_close=None, **kwargs):
+        """
+        Queue the creation of a recording file.
+
+        Args:
+            path (str): The output file.
+            on_close (callable): Optional callback(path) run by the writer
+                thread once the file is complete.
+            **kwargs: Arguments for :py:class:`RecordingWriter`.
+
+        Returns:
+            int: The stream id used with :py:meth:`write` and
+            :py:meth:`close`.
+        """
+        with self._cond:
+            stream = self._next_stream
+            self._next_stream += 1
+        self._put((_OPEN, stream, (path, on_close, kwargs)), 0)
+        return stream
+
+    def write(self, stream, block):
+        """
+        Queue a block of samples.
+
+        Args:
+            stream (int): The stream id.
+            block (numpy.ndarray): Samples shaped (channels, samples).  The
+                block is copied, so the caller may reuse its buffer.
+
+        Returns:
+            bool: False if the block was dropped by the backpressure policy.
+        """
+        block = np.array(block, ndmin=2)
+        return self._put((_WRITE, stream, block), block.nbytes)
+
+    def close(self, stream):
+        """
+        Queue closing a recording file.
+
+        Args:
+            stream (int): The stream id.
+        """
+        self._put((_CLOSE, stream, None), 0)
+
+    @property
+    def alive(self):
+        """ True while the writer thread is running. """
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def bytes_written(self):
+        """ Bytes written to all recording files so far. """
+        return self._closed_bytes + sum(
+            writer.bytes_written for writer in list(self._writers.values()))
+
+    def metrics(self):
+        """
+        Return the writer metrics.
+
+        Returns:
+            dict: queue depth in items and bytes, bytes and blocks written,
+            dropped blocks and samples, fsync count, errors and the last one,
+            write latency (last, mean and max seconds per batch) and whether
+            the writer thread is alive.
+        """
+        with self._cond:
+            depth = len(self._queue)
+            depth_bytes = self._queue_bytes
+        return {
+            'queue_depth': depth,
+            'queue_bytes': depth_bytes,
+            'bytes_written': self.bytes_written,
+            'blocks_written': self.blocks_written,
+            'dropped_blocks': self.dropped_blocks,
+            'dropped_samples': self.dropped_samples,
+            'syncs': self.syncs,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'write_latency': self.write_latency,
+            'mean_write_latency': (self._latency_total / self._batches
+                                   if self._batches else 0.0),
+            'max_write_latency': self.max_write_latency,
+            'alive': self.alive,
+        }
+
+    def _put(self, item, size):
+        with self._cond:
+            if size and self._queue_bytes + size > self.max_queue_bytes:
+                if self.policy == POLICY_BLOCK:
+                    deadline = time.monotonic() + self.block_timeout
+                    # Nobody drains the queue once the thread has died.
+                    while (self._queue_bytes + size > self.max_queue_bytes
+                           and self._queue_bytes and self._running
+                           and self.alive):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                if self._queue_bytes + size > self.max_queue_bytes and \
+                        self._queue_bytes:
+                    self.dropped_blocks += 1
+                    self.dropped_samples += item[2].shape[1]
+                    if self.policy == POLICY_DEGRADE:
+                        self._queue.append((_SKIP, item[1],
+                                            item[2].shape[1], 0))
+                        self._cond.notify()
+                    return False
+            self._queue.append(item + (size,))
+            self._queue_bytes += size
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and not self._queue:
+                    self._cond.wait(1.0)
+                if not self._running and not self._queue:
+                    break
+                batch = list(self._queue)
+                self._queue.clear()
+            if not batch:
+                self._sync_due()
+                continue
+
+            started = time.monotonic()
+            try:
+                self._write_batch(batch)
+            except Exception as err:  # pylint: disable=broad-except
+                self._error(err)
+            elapsed = time.monotonic() - started
+            self.write_latency = elapsed
+            self.max_write_latency = max(self.max_write_latency, elapsed)
+            self._latency_total += elapsed
+            self._batches += 1
+
+            with self._cond:
+                self._queue_bytes -= sum(item[3] for item in batch)
+                self._cond.notify_all()
+
+        for stream in list(self._writers):
+            self._close_stream(stream)
+
+    def _write_batch(self, batch):
+        """ Apply a batch of commands, coalescing consecutive writes. """
+        pending = {}
+        for item in batch:
+            kind, stream = item[0], item[1]
+            if kind == _WRITE:
+                pending.setdefault(stream, []).append(item[2])
+                continue
+            self._flush_pending(pending, stream)
+            try:
+                self._apply(kind, stream, item[2])
+            except Exception as err:  # pylint: disable=broad-except
+                self._error(err)
+        for stream in list(pending):
+            self._flush_pending(pending, stream)
+
+        for writer in list(self._writers.values()):
+            try:
+                writer.flush(partial=False)
+            except OSError as err:
+                self._error(err)
+        if self.fsync == FSYNC_BATCH:
+            self._sync_all()
+        else:
+            self._sync_due()
+
+    def _apply(self, kind, stream, argument):
+        """ Run an open, skip or close command. """
+        if kind == _OPEN:
+            path, on_close, kwargs = argument
+            self._writers[stream] = RecordingWriter(path, **kwargs)
+            self._callbacks[stream] = on_close
+        elif kind == _SKIP:
+            writer = self._writers.get(stream)
+            if writer is not None:
+                writer.flush()
+                writer.sample_index += argument
+                writer.skipped += argument
+        elif kind == _CLOSE:
+            self._close_stream(stream)
+
+    def _flush_pending(self, pending, stream):
+        blocks = pending.pop(stream, None)
+        if not blocks:
+            return
+        writer = self._writers.get(stream)
+        if writer is None:
+            return
+        try:
+            writer.write(blocks[0] if len(blocks) == 1 else
+                         np.concatenate(blocks, axis=1))
+        except Exception as err:  # pylint: disable=broad-except
+            self._error(err)
+            return
+        self.blocks_written += len(blocks)
+
+    def _close_stream(self, stream):
+        writer = self._writers.pop(stream, None)
+        callback = self._callbacks.pop(stream, None)
+        if writer is None:
+            return
+        try:
+            writer.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(writer.fileno())
+                self.syncs += 1
+            self._closed_bytes += writer.bytes_written
+            writer.close()
+        except Exception as err:  # pylint: disable=broad-except
+            self._error(err)
+            return
+        if callback is not None:
+            try:
+                callback(writer.path)
+            except Exception as err:  # pylint: disable=broad-except
+                self._error(err)
+
+    def _sync_due(self):
+        if self.fsync == FSYNC_INTERVAL and \
+                time.monotonic() - self._last_sync >= self.fsync_interval:
+            self._sync_all()
+
+    def _sync_all(self):
+        for writer in self._writers.values():
+            try:
+                os.fsync(writer.fileno())
+                self.syncs += 1
+            except OSError as err:
+                self._error(err)
+        self._last_sync = time.monotonic()
+
+    def _error(self, err):
+        self.errors += 1
+        self.last_error = str(err)
@@ -1,42 +1,70 @@
-
+import argparse
 import time
-from paho.mqtt import client as mqtt
-from threading import Lock
-import RPi.GPIO as GPIO
+from telemetry import MqttPublisher, TelemetryBatcher
+from scheduler import Scheduler
+from tachometer import Tachometer, GpioPulseSource, SimulatedPulseSource
 
 sensor = 22
 
-GPIO.setmode(GPIO.BCM) 
-GPIO.setup(sensor,GPIO.IN) 
+broker_address =  "SERVER_ADDRESS"
 
-sample = 1000
-count = 0
 
-start = 0
-end = 0
+def main():
+    parser = argparse.ArgumentParser(description='Publish the motor speed.')
+    parser.add_argument('--interval', type=float, default=60.0,
+                        help='seconds between published values')
+    parser.add_argument('--pulses-per-rev', type=int, default=2)
+    parser.add_argument('--simulate', type=float, metavar='RPM',
+                        help='generate pulses of this speed instead of '
+                        'reading the sensor')
+    args = parser.parse_args()
 
-broker_address =  "SERVER_ADDRESS"
-client = mqtt.Client("motor_rpm")
-client.connect(broker_address, 1883)
-
-def get_rpm(c):
-	global count, rpm
-	count = count + 1
-
-print("Add event listener...")
-GPIO.add_event_detect(sensor, GPIO.RISING, callback=get_rpm) 
-print("Start!")
-
-try:
-	start = time.time()
-	while True: 
-		end = time.time()
-		if end - start >= 60:
-			delta = (end - start) / 60
-			count = int(count / delta / 2)
-			client.publish("motor_rpm", str(count)
-			count = 0
-			start = end
-except KeyboardInterrupt:
-	print( "  Quit")
-	GPIO.cleanup()
+    tachometer = Tachometer(pulses_per_rev=args.pulses_per_rev,
+                            window=args.interval)
+    if args.simulate is None:
+        source = GpioPulseSource(tachometer, sensor)
+    else:
+        source = SimulatedPulseSource(tachometer, args.simulate, jitter=0.01)
+
+    publisher = MqttPublisher(broker_address, "motor_rpm",
+                              spool_dir="~/mqtt_spool")
+    publisher.start()
+    telemetry = TelemetryBatcher(publisher, "motor_telemetry/rpm",
+                                 interval=args.interval)
+
+    print("Add event listener...")
+    source.start()
+    print("Start!")
+
+    def publish():
+        now = time.monotonic()
+        stats = tachometer.period_stats(args.interval, now)
+        telemetry.add(0, {'rpm': stats['rpm'],
+                          'rpm_instant': tachometer.rpm(now),
+                          'rpm_min': stats['rpm_min'],
+                          'rpm_max': stats['rpm_max']})
+        # Plain-text speed for the existing subscribers.
+        publisher.publish("motor_rpm", str(int(round(stats['rpm']))))
+        print('rpm {:.1f} (min {:.1f}, max {:.1f})'.format(
+            stats['rpm'], stats['rpm_min'], stats['rpm_max']))
+        if stats['truncated']:
+            print('  (shorter than {} s: above the tachometer '
+                  'capacity)'.format(args.interval))
+
+    # Sleep until the next publication; the pulses are timestamped by the
+    # interrupt callback in the meantime.
+    scheduler = Scheduler()
+    scheduler.add('rpm', args.interval, publish, delay=args.interval)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        print( "  Quit")
+        print(scheduler.stats())
+    finally:
+        source.stop()
+        telemetry.stop()
+        publisher.stop()
+
+
+if __name__ == '__main__':
+    main()
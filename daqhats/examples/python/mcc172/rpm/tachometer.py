@@ -0,0 +1,267 @@
+"""
+    Tachometer pulse timing.
+
+    Every rising edge of the speed sensor is stored as a time.monotonic()
+    timestamp in a preallocated ring, so the pulse callback does no more than
+    one array store.  Speeds are calculated from the pulse periods only when
+    they are asked for:
+
+    - :py:meth:`Tachometer.rpm` from the last revolution (instantaneous),
+    - :py:meth:`Tachometer.smoothed_rpm` from all revolutions in a window.
+
+    The timestamps themselves are available for angle-domain processing with
+    :py:meth:`Tachometer.timestamps`.
+
+    Pulses come from :py:class:`GpioPulseSource` on the Raspberry Pi or from
+    :py:class:`SimulatedPulseSource`, which generates the pulses of a given
+    (optionally varying) speed without any hardware.
+"""
+import random
+import time
+from threading import Event, Lock, Thread
+import numpy as np
+
+
+class Tachometer(object):
+    """
+    Record pulse timestamps and calculate the speed.
+
+    Args:
+        pulses_per_rev (int): Pulses per revolution of the shaft.
+        max_rpm (float): The highest speed measured.
+        window (float): The longest window in seconds, e.g. of
+            :py:meth:`period_stats`.
+        capacity (int): Number of timestamps kept; by default enough for
+            ``window`` seconds at ``max_rpm``.
+        timeout (float): Seconds without a pulse after which the shaft is
+            considered stopped.
+    """
+    # pylint: disable=too-many-arguments
+
+    def __init__(self, pulses_per_rev=2, max_rpm=6000.0, window=60.0,
+                 capacity=None, timeout=2.0):
+        self.pulses_per_rev = pulses_per_rev
+        self.timeout = timeout
+        if capacity is None:
+            capacity = int(np.ceil(max_rpm / 60.0 * pulses_per_rev *
+                                   window)) + 1
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._count = 0
+        self._lock = Lock()
+
+    @property
+    def count(self):
+        """ The total number of pulses. """
+        return self._count
+
+    def pulse(self, timestamp=None):
+        """
+        Record one pulse.  Safe to call from an interrupt callback thread.
+
+        Args:
+            timestamp (float): The time.monotonic() time of the edge, now by
+                default.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._lock:
+            self._times[self._count % len(self._times)] = timestamp
+            self._count += 1
+
+    def timestamps(self, start_time=None, end_time=None):
+        """
+        Return the recorded pulse times that are still in the ring.
+
+        Args:
+            start_time (float): Oldest time returned, or None.
+            end_time (float): Newest time returned, or None.
+
+        Returns:
+            numpy.ndarray: time.monotonic() timestamps, oldest first.
+        """
+        with self._lock:
+            count = self._count
+            size = len(self._times)
+            if count <= size:
+                times = self._times[:count].copy()
+            else:
+                pos = count % size
+                times = np.concatenate((self._times[pos:],
+                                        self._times[:pos]))
+        if start_time is not None:
+            times = times[times >= start_time]
+        if end_time is not None:
+            times = times[times <= end_time]
+        return times
+
+    def rpm(self, now=None):
+        """
+        Return the speed of the last revolution.
+
+        Args:
+            now (float): The current time.monotonic() time.
+
+        Returns:
+            float: Revolutions per minute, 0 when stopped.
+        """
+        times = self._recent(self.pulses_per_rev + 1, now)
+        if len(times) <= self.pulses_per_rev:
+            return 0.0
+        return 60.0 / float(times[-1] - times[0])
+
+    def smoothed_rpm(self, window=1.0, now=None):
+        """
+        Return the average speed over the whole revolutions in a window.
+
+        Args:
+            window (float): The window in seconds.
+            now (float): The current time.monotonic() time.
+
+        Returns:
+            float: Revolutions per minute, 0 when stopped.
+        """
+        if now is None:
+            now = time.monotonic()
+        times = self._recent(None, now)
+        times = times[times >= now - window]
+        # Whole revolutions only, so uneven pulse spacing cancels out.
+        revs = (len(times) - 1) // self.pulses_per_rev
+        if revs < 1:
+            return self.rpm(now)
+        span = times[-1] - times[-1 - revs * self.pulses_per_rev]
+        return 60.0 * revs / float(span)
+
+    def period_stats(self, window=60.0, now=None):
+        """
+        Return revolution period statistics over a window.
+
+        Args:
+            window (float): The window in seconds.
+            now (float): The current time.monotonic() time.
+
+        Returns:
+            dict: rpm (mean), rpm_min, rpm_max, the number of revolutions
+            and 'truncated', True if the ring no longer holds the start of
+            the window (the speed exceeds the capacity), so the statistics
+            cover a shorter time.
+        """
+        if now is None:
+            now = time.monotonic()
+        times = self._recent(None, now)
+        truncated = bool(self._count > len(self._times) and len(times) and
+                         times[0] > now - window)
+        times = times[times >= now - window]
+        if len(times) <= self.pulses_per_rev:
+            return {'rpm': 0.0, 'rpm_min': 0.0, 'rpm_max': 0.0, 'revs': 0,
+                    'truncated': truncated}
+        periods = times[self.pulses_per_rev:] - times[:-self.pulses_per_rev]
+        revs = (len(times) - 1) // self.pulses_per_rev
+        return {
+            'rpm': 60.0 * revs / float(times[revs * self.pulses_per_rev] -
+                                       times[0]),
+            'rpm_min': 60.0 / float(periods.max()),
+            'rpm_max': 60.0 / float(periods.min()),
+            'revs': revs,
+            'truncated': truncated,
+        }
+
+    def _recent(self, count, now):
+        """ The last timestamps, or none if the shaft stopped. """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            total = self._count
+            if not total or \
+                    now - self._times[(total - 1) % len(self._times)] > \
+                    self.timeout:
+                return np.empty(0)
+        times = self.timestamps()
+        return times if count is None else times[-count:]
+
+
+class GpioPulseSource(object):
+    """
+    Feed a tachometer from the rising edges of a GPIO pin.
+
+    Args:
+        tachometer (Tachometer): The receiving tachometer.
+        pin (int): The BCM pin number.
+        bouncetime (int): Optional debounce time in milliseconds.
+    """
+
+    def __init__(self, tachometer, pin=22, bouncetime=None):
+        self.tachometer = tachometer
+        self.pin = pin
+        self.bouncetime = bouncetime
+        self._gpio = None
+
+    def start(self):
+        """ Enable the edge interrupt. """
+        import RPi.GPIO as GPIO
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(self.pin, GPIO.IN)
+        kwargs = {} if self.bouncetime is None else \
+            {'bouncetime': self.bouncetime}
+        GPIO.add_event_detect(self.pin, GPIO.RISING, callback=self._edge,
+                              **kwargs)
+
+    def stop(self):
+        """ Disable the interrupt and release the pin. """
+        if self._gpio is not None:
+            self._gpio.remove_event_detect(self.pin)
+            self._gpio.cleanup(self.pin)
+            self._gpio = None
+
+    def _edge(self, _channel):
+        self.tachometer.pulse(time.monotonic())
+
+
+class SimulatedPulseSource(object):
+    """
+    Generate the pulses of a rotating shaft without hardware.
+
+    Args:
+        tachometer (Tachometer): The receiving tachometer.
+        rpm (float or callable): The speed, or a function of the elapsed
+            seconds that returns it.
+        jitter (float): Standard deviation of the pulse timing as a fraction
+            of the pulse period.
+    """
+
+    def __init__(self, tachometer, rpm=1800.0, jitter=0.0):
+        self.tachometer = tachometer
+        self.rpm = rpm
+        self.jitter = jitter
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        """ Start generating pulses. """
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='pulse-simulator',
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop generating pulses. """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        start = time.monotonic()
+        edge = start
+        while True:
+            speed = self.rpm(edge - start) if callable(self.rpm) else self.rpm
+            if speed <= 0:
+                if self._stop.wait(0.1):
+                    break
+                edge = time.monotonic()
+                continue
+            period = 60.0 / speed / self.tachometer.pulses_per_rev
+            edge += period
+            when = edge + random.gauss(0.0, self.jitter * period)
+            if self._stop.wait(max(0.0, when - time.monotonic())):
+                break
+            self.tachometer.pulse(when)
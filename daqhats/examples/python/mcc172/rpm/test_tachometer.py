@@ -0,0 +1,84 @@
+"""
+    Tests of the tachometer pulse ring and speed calculation.
+
+    Run from the mcc172 directory with ``python -m pytest rpm`` or from the
+    rpm directory with ``python -m unittest test_tachometer``.
+"""
+import unittest
+import numpy as np
+from tachometer import Tachometer
+
+
+def _pulses(tachometer, rpm, count, start=1000.0):
+    """ Pulses of a constant speed; returns the last pulse time. """
+    period = 60.0 / rpm / tachometer.pulses_per_rev
+    times = start + period * np.arange(count)
+    for timestamp in times:
+        tachometer.pulse(timestamp)
+    return times[-1]
+
+
+class TachometerTest(unittest.TestCase):
+    """ Speeds of synthetic pulse trains. """
+
+    def test_ring(self):
+        tachometer = Tachometer(pulses_per_rev=1, capacity=8)
+        for i in range(5):
+            tachometer.pulse(float(i))
+        np.testing.assert_array_equal(tachometer.timestamps(), range(5))
+        for i in range(5, 21):
+            tachometer.pulse(float(i))
+        # The last capacity pulses, oldest first, after the ring wrapped.
+        self.assertEqual(tachometer.count, 21)
+        np.testing.assert_array_equal(tachometer.timestamps(),
+                                      range(13, 21))
+        np.testing.assert_array_equal(
+            tachometer.timestamps(start_time=15.0, end_time=17.0),
+            [15.0, 16.0, 17.0])
+
+    def test_constant_speed(self):
+        tachometer = Tachometer(pulses_per_rev=2)
+        last = _pulses(tachometer, 1800.0, 200)
+        now = last + 0.001
+        self.assertAlmostEqual(tachometer.rpm(now), 1800.0, places=6)
+        self.assertAlmostEqual(tachometer.smoothed_rpm(1.0, now), 1800.0,
+                               places=6)
+        stats = tachometer.period_stats(window=2.0, now=now)
+        self.assertAlmostEqual(stats['rpm'], 1800.0, places=6)
+        self.assertAlmostEqual(stats['rpm_min'], 1800.0, places=6)
+        self.assertAlmostEqual(stats['rpm_max'], 1800.0, places=6)
+        self.assertEqual(stats['revs'], 59)
+        self.assertFalse(stats['truncated'])
+
+    def test_uneven_pulses(self):
+        # Two unevenly spaced marks per revolution: whole revolutions keep
+        # the speed right.
+        tachometer = Tachometer(pulses_per_rev=2)
+        for rev in range(50):
+            tachometer.pulse(100.0 + rev * 0.05)
+            tachometer.pulse(100.0 + rev * 0.05 + 0.01)
+        now = 100.0 + 49 * 0.05 + 0.02
+        self.assertAlmostEqual(tachometer.rpm(now), 1200.0, places=6)
+        self.assertAlmostEqual(tachometer.smoothed_rpm(1.0, now), 1200.0,
+                               places=6)
+
+    def test_truncated(self):
+        tachometer = Tachometer(pulses_per_rev=1, capacity=16)
+        last = _pulses(tachometer, 600.0, 100)
+        stats = tachometer.period_stats(window=60.0, now=last)
+        self.assertTrue(stats['truncated'])
+        self.assertEqual(stats['revs'], 15)
+        self.assertAlmostEqual(stats['rpm'], 600.0, places=6)
+
+    def test_stopped(self):
+        tachometer = Tachometer(pulses_per_rev=1, timeout=2.0)
+        self.assertEqual(tachometer.rpm(0.0), 0.0)
+        last = _pulses(tachometer, 120.0, 10)
+        self.assertAlmostEqual(tachometer.rpm(last + 1.0), 120.0, places=6)
+        self.assertEqual(tachometer.rpm(last + 2.5), 0.0)
+        self.assertEqual(tachometer.smoothed_rpm(1.0, last + 2.5), 0.0)
+        self.assertEqual(tachometer.period_stats(now=last + 2.5)['revs'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,21 +24,30 @@ from __future__ import print_function
 from sys import stdout, version_info
 from time import sleep
 from math import sqrt
-import csv
 from daqhats import mcc172, OptionFlags, SourceType, HatIDs, HatError
 from daqhats_utils import select_hat_device, enum_mask_to_string, \
     chan_list_to_mask
 import numpy as np
 
-import time, datetime
-from threading import Lock, Thread
-from paho.mqtt import client as mqtt
+import time
+from telemetry import MqttPublisher
+from recording import AsyncRecorder, SegmentRecorder, hat_calibration, \
+    to_codes, CODEC_PRED
+from recording.feature_index import FeatureIndexer
 
 READ_ALL_AVAILABLE = -1
 
 CURSOR_BACK_2 = '\x1b[2D'
 ERASE_TO_END_OF_LINE = '\x1b[0K'
 
+broker_address =  "SERVER_ADDRESS"
+publisher = MqttPublisher(broker_address, "motor_collect",
+                          spool_dir="~/mqtt_spool")
+# All files are written by one background thread.
+recorder = AsyncRecorder()
+# Per-minute features of every completed segment, for trending.
+indexer = FeatureIndexer("~/diagnosis_data/features.db")
+
 def get_iepe():
     """
     Get IEPE enable from the user.
@@ -130,6 +139,11 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
         # buffer size (10000 * num_channels in this case). If a larger internal
         # buffer size is desired, set the value of this parameter accordingly.
         hat.a_in_scan_start(channel_mask, samples_per_channel, options)
+        publisher.start()
+        recorder.start()
+        indexer.start()
+        # Index segments recorded while the service was not running.
+        indexer.scan("~/diagnosis_data/segments")
 
         print('Starting scan ... Press Ctrl-C to stop\n')
 
@@ -137,7 +151,7 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
         
 
         try:
-            read_and_display_data(hat, num_channels)
+            read_and_display_data(hat, channels, actual_scan_rate)
 
         except KeyboardInterrupt:
             # Clear the '^C' from the display.
@@ -151,6 +165,10 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
             for channel in channels:
                 hat.iepe_config_write(channel, 0)
 
+        recorder.stop()
+        indexer.stop()
+        publisher.stop()
+
     except (HatError, ValueError) as err:
         print('\n', err)
 
@@ -164,7 +182,12 @@ def calc_rms(data, channel, num_channels, num_samples_per_channel):
 
     return sqrt(value)
 
-def read_and_display_data(hat, num_channels):
+def segment_done(path):
+    """ Index a completed segment and announce it. """
+    indexer.add(path)
+    publisher.publish("motor_data_saved", path)
+
+def read_and_display_data(hat, channels, scan_rate):
     """
     Reads data from the specified channels on the specified DAQ HAT devices
     and updates the data on the terminal display.  The reads are executed in a
@@ -173,12 +196,14 @@ def read_and_display_data(hat, num_channels):
 
     Args:
         hat (mcc172): The mcc172 HAT device object.
-        num_channels (int): The number of channels to display.
+        channels (list[int]): The scanned channels.
+        scan_rate (float): The actual scan rate.
 
     Returns:
         None
 
     """
+    num_channels = len(channels)
     total_samples_read = 0
     read_request_size = READ_ALL_AVAILABLE
 
@@ -187,17 +212,18 @@ def read_and_display_data(hat, num_channels):
     # samples (up to the default buffer size) be returned.
     timeout = 5.0
 
-    # diagnosis timer
-    period_timer = time.time()
-    record_timer = time.time()
-    now = time.time()
-
-    data = []
-    data_lock = Lock()
-    save_counter = 3
+    # Record every block into rotating 10 minute segments, keeping at most
+    # 16 GB on the SD card.  Samples are stored losslessly as compressed ADC
+    # codes with the calibration needed to convert them back.
+    calibration = hat_calibration(hat, channels)
+    segments = SegmentRecorder(
+        "~/diagnosis_data/segments", scan_rate, channels,
+        segment_seconds=600.0, retention_bytes=16 << 30, recorder=recorder,
+        dtype='int32', codec=CODEC_PRED, calibration=calibration,
+        on_segment=segment_done)
 
     print('\nSamples Read    Scan Count', end='')
-    for chan, item in enumerate([0,1]):
+    for chan, item in enumerate(channels):
         print('       Channel ', item, sep='', end='')
     print('')
     # Read all of the available samples (up to the size of the read_buffer which
@@ -205,54 +231,43 @@ def read_and_display_data(hat, num_channels):
     # to -1 (READ_ALL_AVAILABLE), this function returns immediately with
     # whatever samples are available (up to user_buffer_size) and the timeout
     # parameter is ignored.
-    while True:
-        read_result = hat.a_in_scan_read(read_request_size, timeout)
-
-        # Check for an overrun error
-        if read_result.hardware_overrun:
-            print('\n\nHardware overrun\n')
-            break
-        elif read_result.buffer_overrun:
-            print('\n\nBuffer overrun\n')
-            break
-
-        samples_read_per_channel = int(len(read_result.data) / num_channels)
-        total_samples_read += samples_read_per_channel
-
-        print('\r{:12}'.format(samples_read_per_channel),
-              ' {:12} '.format(total_samples_read), end='')
-
-        # Display the RMS voltage for each channel.
-        if samples_read_per_channel > 0:
-            for i in range(num_channels):
-                value = calc_rms(read_result.data, i, num_channels,
-                                 samples_read_per_channel)
-                if time.time() - period_timer < 60 and len(data) < 102400:
-                    data_lock.acquire()
-                    data.extend(read_result.data[:samples_read_per_channel])
-                    data_lock.release()
-                elif time.time() - period_timer > 60 and len(data) >= 102400 and save_counter > 0:
-                    data_lock.acquire()
-                    print(type(data), len(data))
-                    th = Thread(target=save_data, args=([data]))
-                    th.start()
-                    data = []
-                    data_lock.release()
-                    period_timer = time.time()
-                    save_counter -= 1
-                print('{:10.5f}'.format(value), 'Vrms ',
-                      end='')
-            stdout.flush()
-
-            sleep(0.1)
+    try:
+        while True:
+            read_result = hat.a_in_scan_read(read_request_size, timeout)
+
+            # Check for an overrun error
+            if read_result.hardware_overrun:
+                print('\n\nHardware overrun\n')
+                break
+            elif read_result.buffer_overrun:
+                print('\n\nBuffer overrun\n')
+                break
+
+            samples_read_per_channel = int(len(read_result.data) / num_channels)
+            total_samples_read += samples_read_per_channel
+
+            print('\r{:12}'.format(samples_read_per_channel),
+                  ' {:12} '.format(total_samples_read), end='')
+
+            # Display the RMS voltage for each channel.
+            if samples_read_per_channel > 0:
+                # Record the block per channel, shaped (channels, samples).
+                segments.write(
+                    to_codes(np.reshape(read_result.data,
+                                        (-1, num_channels)).T, calibration),
+                    timestamp=time.time() - samples_read_per_channel / scan_rate)
+                for i in range(num_channels):
+                    value = calc_rms(read_result.data, i, num_channels,
+                                     samples_read_per_channel)
+                    print('{:10.5f}'.format(value), 'Vrms ',
+                          end='')
+                stdout.flush()
+
+                sleep(0.1)
+    finally:
+        segments.close()
 
     print('\n')
 
-def save_data(data:list):
-    with open(f"~/diagnosis_data/motor_{datetime.datetime.now().strftime('%m%d-%H.%M.%S')}.csv", "w") as csvfile:
-        writer = csv.writer(csvfile, delimiter=',')
-        writer.writerow(data[len(data) - 102400:])
-    
-
 if __name__ == '__main__':
     main()
@@ -24,18 +24,26 @@ from __future__ import print_function
 from sys import stdout, version_info
 from time import sleep
 from math import sqrt
+import argparse
 import csv
 from daqhats import mcc172, OptionFlags, SourceType, HatIDs, HatError
 from daqhats_utils import select_hat_device, enum_mask_to_string, \
     chan_list_to_mask
 
-from diagnosis import preprocessing, load_model, diagnosis
+from diagnosis import preprocessing, load_model, diagnosis, \
+    block_features, feature_names, AnomalyGate
 from sklearn.preprocessing import MinMaxScaler
 import numpy as np
 
 import time
 from threading import Lock, Thread
-from paho.mqtt import client as mqtt
+from telemetry import MqttPublisher, TelemetryBatcher, block_values, \
+    WaveformStreamer, ControlSubscriber, SCAN_SETTINGS, MCC172_CHANNELS
+from recording import AsyncRecorder, TriggerCapture, CODEC_PRED
+from analysis import OrderTracker, SynchronousAverager, WelchAverager, \
+    EnvelopeAnalyzer, bearing_orders
+from rpm.tachometer import Tachometer, GpioPulseSource
+from sensor_state import SensorState
 
 READ_ALL_AVAILABLE = -1
 
@@ -43,8 +51,42 @@ CURSOR_BACK_2 = '\x1b[2D'
 ERASE_TO_END_OF_LINE = '\x1b[0K'
 
 broker_address =  "SERVER_ADDRESS"
-client = mqtt.Client("motor_diag")
-client.connect(broker_address, 1883)
+publisher = MqttPublisher(broker_address, "motor_diag",
+                          spool_dir="~/mqtt_spool")
+# Per-block vibration features are batched into one binary message.
+telemetry = TelemetryBatcher(publisher, "motor_telemetry/vibration",
+                             interval=10.0)
+# Acquisition settings that can be changed at runtime over MQTT.
+control = ControlSubscriber(publisher, "motor_diag/control", {
+    'scan_rate': 10240.0,
+    'channels': [0],
+    'iepe': 1,
+    'stream_channels': [0],
+    'diagnosis_interval': 60.0,
+    'capture_rms': 0.0,
+    'tsa_depth': 64,
+    'tsa_publish': 0.0,
+    'psd_publish': 0.0,
+})
+# Writes event captures without blocking the acquisition loop.
+recorder = AsyncRecorder()
+# Speed sensor (2 pulses per revolution) for order tracking.  rpm.py
+# (rpm.service) reads the same GPIO pin, so only one of them can use it;
+# see --tach-pin and --no-tach.
+TACH_PIN = 22
+tachometer = Tachometer(pulses_per_rev=2)
+# Shaft orders tracked per batch of revolutions.  The bearing orders are
+# those of a 6205 bearing; replace them with the motor's bearing geometry.
+BEARING_ORDERS = bearing_orders(9, 7.94, 39.04)
+ORDERS = {'order_1x': 1.0, 'order_2x': 2.0}
+ORDERS.update({'order_' + name: order for name, order
+               in BEARING_ORDERS.items()})
+# Resonance band demodulated by the envelope analysis of the diagnosis
+# window; the upper edge is limited to 0.45 of the scan rate.
+ENVELOPE_BAND = (1000.0, 4000.0)
+# Latest values shared with the other sensor tasks when this runs inside
+# the node runtime (node.py).
+state = SensorState()
 
 def get_iepe():
     """
@@ -65,23 +107,28 @@ def get_iepe():
             # Ask again.
             print("Invalid response.")
 
-def main(): # pylint: disable=too-many-locals, too-many-statements
+def main(shared=False, tach_pin=TACH_PIN): # pylint: disable=too-many-locals, too-many-statements
     """
     This function is executed automatically when the module is run directly.
+
+    Args:
+        shared (bool): The MQTT publisher is shared with other tasks of a
+            node runtime, which starts and stops it.
+        tach_pin (int): The BCM pin of the speed sensor; None disables order
+            tracking.
     """
 
     # Store the channels in a list and convert the list to a channel mask that
     # can be passed as a parameter to the MCC 172 functions.
 
-    channels = [0]#, 1]
+    channels = control.settings['channels']
     channel_mask = chan_list_to_mask(channels)
-    num_channels = len(channels)
 
     samples_per_channel = 0
 
     options = OptionFlags.CONTINUOUS
 
-    scan_rate = 10240.0
+    scan_rate = control.settings['scan_rate']
 
 
     try:
@@ -93,6 +140,7 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
 
         # Turn on IEPE supply?
         iepe_enable = get_iepe()
+        control.settings['iepe'] = iepe_enable
 
         for channel in channels:
             hat.iepe_config_write(channel, iepe_enable)
@@ -146,6 +194,20 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
         # buffer size (10000 * num_channels in this case). If a larger internal
         # buffer size is desired, set the value of this parameter accordingly.
         hat.a_in_scan_start(channel_mask, samples_per_channel, options)
+        if not shared:
+            publisher.start()
+        recorder.start()
+        control.publish_state()
+
+        tach_source = None
+        if tach_pin is not None:
+            tach_source = GpioPulseSource(tachometer, tach_pin)
+            try:
+                tach_source.start()
+            except (ImportError, OSError, RuntimeError) as err:
+                # No RPi.GPIO on this host, or the pin is used by rpm.py.
+                print('\nOrder tracking disabled:', err)
+                tach_source = None
 
         print('Starting scan ... Press Ctrl-C to stop\n')
 
@@ -153,7 +215,8 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
         
 
         try:
-            read_and_display_data(hat, num_channels, scaler)
+            read_and_display_data(hat, scaler, actual_scan_rate,
+                                  tach_source is not None)
 
         except KeyboardInterrupt:
             # Clear the '^C' from the display.
@@ -164,9 +227,18 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
             hat.a_in_scan_cleanup()
 
             # Turn off IEPE supply
-            for channel in channels:
+            for channel in MCC172_CHANNELS:
                 hat.iepe_config_write(channel, 0)
 
+        if tach_source is not None:
+            tach_source.stop()
+
+        # Flush queued results to the broker (or the spool).
+        telemetry.flush()
+        recorder.stop()
+        if not shared:
+            publisher.stop()
+
     except (HatError, ValueError) as err:
         print('\n', err)
 
@@ -180,7 +252,79 @@ def calc_rms(data, channel, num_channels, num_samples_per_channel):
 
     return sqrt(value)
 
-def read_and_display_data(hat, num_channels, scaler):
+def restart_scan(hat, settings):
+    """
+    Stop the running scan and start it again with new acquisition settings.
+
+    Args:
+        hat (mcc172): The mcc172 HAT device object.
+        settings (dict): The control settings (scan_rate, channels, iepe).
+
+    Returns:
+        float: The actual scan rate.
+    """
+    hat.a_in_scan_stop()
+    hat.a_in_scan_cleanup()
+
+    for channel in MCC172_CHANNELS:
+        enable = settings['iepe'] if channel in settings['channels'] else 0
+        hat.iepe_config_write(channel, enable)
+
+    hat.a_in_clock_config_write(SourceType.LOCAL, settings['scan_rate'])
+    synced = False
+    while not synced:
+        (_source_type, actual_scan_rate, synced) = hat.a_in_clock_config_read()
+        if not synced:
+            sleep(0.005)
+
+    hat.a_in_scan_start(chan_list_to_mask(settings['channels']), 0,
+                        OptionFlags.CONTINUOUS)
+    return actual_scan_rate
+
+def create_streamer(settings, scan_rate):
+    """ Create the waveform streamer for the scanned channels. """
+    channels = settings['channels']
+    # Decimated waveform and envelopes, kept under 20 kB/s for the device.
+    streamer = WaveformStreamer(publisher, "motor_waveform", scan_rate,
+                                len(channels), channel_numbers=channels,
+                                budget=20000.0, interval=1.0)
+    streamer.channels = {channels.index(chan)
+                         for chan in settings['stream_channels']
+                         if chan in channels}
+    return streamer
+
+def create_welch(settings, scan_rate):
+    """
+    Create the PSD averager for the current settings.
+
+    Returns:
+        WelchAverager: The averager, or None if psd_publish is 0.
+    """
+    if not settings['psd_publish']:
+        return None
+    # 4096 sample segments with 50 % overlap (2.5 Hz bins at 10240 S/s).
+    return WelchAverager(len(settings['channels']), scan_rate,
+                         segment_length=4096, overlap=0.5,
+                         interval=settings['psd_publish'])
+
+def create_envelope(scan_rate):
+    """
+    Create the envelope analysis of the diagnosis window.
+
+    Returns:
+        EnvelopeAnalyzer: The analyzer, or None if the scan rate is too low
+        for the resonance band.
+    """
+    band = (ENVELOPE_BAND[0], min(ENVELOPE_BAND[1], 0.45 * scan_rate))
+    try:
+        # Only the fundamental defect lines are published (env_<defect>).
+        return EnvelopeAnalyzer(102400, 1, scan_rate, band, BEARING_ORDERS,
+                                harmonics=1)
+    except ValueError as err:
+        print('\nEnvelope analysis disabled:', err)
+        return None
+
+def read_and_display_data(hat, scaler, scan_rate, order_tracking=False):
     """
     Reads data from the specified channels on the specified DAQ HAT devices
     and updates the data on the terminal display.  The reads are executed in a
@@ -189,7 +333,10 @@ def read_and_display_data(hat, num_channels, scaler):
 
     Args:
         hat (mcc172): The mcc172 HAT device object.
-        num_channels (int): The number of channels to display.
+        scaler (MinMaxScaler): The scaler fitted on the normal data.
+        scan_rate (float): The actual scan rate, used for band energies.
+        order_tracking (bool): Calculate order amplitudes from the
+            tachometer pulses.
 
     Returns:
         None
@@ -197,6 +344,9 @@ def read_and_display_data(hat, num_channels, scaler):
     """
     total_samples_read = 0
     read_request_size = READ_ALL_AVAILABLE
+    settings = dict(control.settings)
+    num_channels = len(settings['channels'])
+    diagnosis_interval = settings['diagnosis_interval']
 
     # When doing a continuous scan, the timeout value will be ignored in the
     # call to a_in_scan_read because we will be requesting that all available
@@ -207,6 +357,54 @@ def read_and_display_data(hat, num_channels, scaler):
     interpreter, input_details, output_details = load_model("/home/raspberry/daqhats/examples/python/mcc172/diagnosis/norm_q.tflite")
     period_timer = time.time()
     now = time.time()
+
+    # Only windows that deviate from the learned baseline (or the first one
+    # after max_interval seconds) are passed to the CNN.
+    gate = AnomalyGate(len(feature_names()), threshold=4.0, warmup=10,
+                       max_interval=600.0)
+    # Bearing defect amplitudes in the envelope spectrum of every window.
+    envelope = create_envelope(scan_rate)
+# ---------------------------------------------------
+
+    
+# ----------------Waveform Streaming-----------------
+    streamer = create_streamer(settings, scan_rate)
+# ---------------------------------------------------
+
+
+# ------------------Order Tracking-------------------
+    # Vibration resampled to the shaft angle, so the order amplitudes stay
+    # sharp while the speed drifts.
+    orders = OrderTracker(tachometer, scan_rate, num_channels,
+                          samples_per_rev=512, revs_per_batch=16,
+                          orders=ORDERS) if order_tracking else None
+    # Time-synchronous average of the last tsa_depth revolutions; published
+    # on "motor_diag/tsa/<channel>" every tsa_publish seconds (0 disables).
+    tsa = SynchronousAverager(num_channels, 512, settings['tsa_depth'])
+    tsa_timer = time.time()
+# ---------------------------------------------------
+
+
+# ----------------------Welch PSD--------------------
+    # Averaged PSD published on "motor_diag/psd/<channel>" every
+    # psd_publish seconds of data (0 disables).
+    welch = create_welch(settings, scan_rate)
+# ---------------------------------------------------
+
+
+# -------------------Event Capture-------------------
+    # 30 s of history and 10 s after each event; events are RMS threshold
+    # crossings, baseline deviations, faults and "motor_diag/capture"
+    # commands.
+    capture = TriggerCapture(
+        "~/diagnosis_data/events", scan_rate, settings['channels'],
+        pre_seconds=30.0, post_seconds=10.0, recorder=recorder,
+        codec=CODEC_PRED,
+        on_capture=lambda path: publisher.publish("motor_diag/capture/saved",
+                                                  path))
+    publisher.subscribe("motor_diag/capture",
+                        lambda _client, _userdata, message: capture.trigger(
+                            'command ' + message.payload.decode('utf-8')))
 # ---------------------------------------------------
 
     
@@ -228,58 +426,157 @@ def read_and_display_data(hat, num_channels, scaler):
     # is specified by the user_buffer_size).  Since the read_request_size is set
     # to -1 (READ_ALL_AVAILABLE), this function returns immediately with
     # whatever samples are available (up to user_buffer_size) and the timeout
-    # parameter is ignored.
-    while True:
-        read_result = hat.a_in_scan_read(read_request_size, timeout)
-
-        # Check for an overrun error
-        if read_result.hardware_overrun:
-            print('\n\nHardware overrun\n')
-            break
-        elif read_result.buffer_overrun:
-            print('\n\nBuffer overrun\n')
-            break
-
-        samples_read_per_channel = int(len(read_result.data) / num_channels)
-        total_samples_read += samples_read_per_channel
-
-        print('\r{:12}'.format(samples_read_per_channel),
-              ' {:12} '.format(total_samples_read), end='')
-
-        # Display the RMS voltage for each channel.
-        if samples_read_per_channel > 0:
-            for i in range(num_channels):
-                value = calc_rms(read_result.data, i, num_channels,
-                                 samples_read_per_channel)
+    # parameter is ignored.  Ctrl-C (or SIGTERM under node.py) ends the loop;
+    # captures in progress are still written.
+    try:
+        while True:
+            # Apply control commands between blocks.
+            changes = control.take_changes()
+            if changes:
+                settings = dict(control.settings)
+                if any(name in changes for name in SCAN_SETTINGS):
+                    scan_rate = restart_scan(hat, settings)
+                    num_channels = len(settings['channels'])
+                    capture.reset(scan_rate, settings['channels'])
+                    envelope = create_envelope(scan_rate)
+                    # The band features change meaning with the rate and the
+                    # first channel; learn a new baseline.
+                    gate.reset()
+                    if orders is not None:
+                        orders.reset(scan_rate, num_channels)
+                    # Restart the diagnosis window at the new settings.
+                    data = []
+                    period_timer = time.time()
+                if 'tsa_depth' in changes or num_channels != tsa.num_channels:
+                    tsa = SynchronousAverager(num_channels, 512,
+                                              settings['tsa_depth'])
+                # The streamer keeps its sequence numbers and decimator state
+                # unless its own settings change.
+                if any(name in changes
+                       for name in SCAN_SETTINGS + ('stream_channels',)):
+                    streamer = create_streamer(settings, scan_rate)
+                # Likewise the partial PSD average.
+                if any(name in changes
+                       for name in SCAN_SETTINGS + ('psd_publish',)):
+                    welch = create_welch(settings, scan_rate)
+                diagnosis_interval = settings['diagnosis_interval']
+                print('\n* settings changed: ', changes)
+
+            read_result = hat.a_in_scan_read(read_request_size, timeout)
+            read_time = time.monotonic()
+
+            # Check for an overrun error
+            if read_result.hardware_overrun:
+                print('\n\nHardware overrun\n')
+                break
+            elif read_result.buffer_overrun:
+                print('\n\nBuffer overrun\n')
+                break
+
+            samples_read_per_channel = int(len(read_result.data) / num_channels)
+            total_samples_read += samples_read_per_channel
+
+            print('\r{:12}'.format(samples_read_per_channel),
+                  ' {:12} '.format(total_samples_read), end='')
+
+            # Display the RMS voltage for each channel.
+            if samples_read_per_channel > 0:
+                block = np.reshape(read_result.data, (-1, num_channels)).T
+                streamer.push(block)
+                capture.push(block)
+                if orders is not None:
+                    for batch in orders.push(block, read_time):
+                        tsa.add(batch['resampled'], batch['rpm'])
+                        batch['amplitudes'].update(tsa.features())
+                        for i in range(num_channels):
+                            values = {name: float(amplitudes[i]) for name,
+                                      amplitudes in batch['amplitudes'].items()}
+                            values['rpm'] = batch['rpm']
+                            telemetry.add(i, values, batch['time'])
+                    if 0 < settings['tsa_publish'] <= time.time() - tsa_timer \
+                            and tsa.revolutions:
+                        for i, chan in enumerate(settings['channels']):
+                            publisher.publish('motor_diag/tsa/{}'.format(chan),
+                                              tsa.encode(i, chan))
+                        tsa_timer = time.time()
+                if welch is not None:
+                    for psd in welch.push(block):
+                        for i, chan in enumerate(settings['channels']):
+                            publisher.publish('motor_diag/psd/{}'.format(chan),
+                                              welch.encode(psd, i, chan))
+
+                # The diagnosis window is taken from the first scanned channel.
                 now_loop = time.time()
-                if now_loop - period_timer < 60 and len(data) < 102400:
+                if now_loop - period_timer < diagnosis_interval and len(data) < 102400:
                     data_lock.acquire()
-                    data.extend(read_result.data[:samples_read_per_channel])
+                    data.extend(read_result.data[0::num_channels])
                     data_lock.release()
-                elif now_loop - period_timer >= 60 and len(data) >= 102400:
+                elif now_loop - period_timer >= diagnosis_interval and len(data) >= 102400:
                     data_lock.acquire()
-                    th3 = Thread(target=diagnosis_motor, args=(3, interpreter, input_details, output_details, data, scaler))
-                    th3.start()
+                    features = block_features(data[:102400], scan_rate)
+                    if envelope is not None:
+                        rpm = tachometer.smoothed_rpm(10.0) if order_tracking \
+                            else None
+                        result = envelope.analyze(np.asarray(data[:102400]),
+                                                  rpm)
+                        values = {'env_rms': float(result['rms'][0])}
+                        values.update({'env_' + name: float(amplitudes[0, 0])
+                                       for name, amplitudes
+                                       in result['amplitudes'].items()})
+                        telemetry.add(0, values)
+                    deviations = gate.deviations
+                    if gate.check(features):
+                        if gate.deviations > deviations:
+                            capture.trigger('anomaly')
+                        th3 = Thread(target=diagnosis_motor, args=(3, interpreter, input_details, output_details, data, scaler, capture))
+                        th3.start()
+                    else:
+                        print("\n* diagnosis skipped: ", gate.stats())
                     data = []
                     period_timer = now_loop
                     data_lock.release()
-                print('{:10.5f}'.format(value), 'Vrms ',
-                      end='')
-            stdout.flush()
-
-            sleep(0.1)
 
+                # Raised with the temperature by the node runtime.
+                capture_rms = settings['capture_rms'] * \
+                    state.get('capture_scale', 1.0, max_age=600.0)
+                rms = []
+                for i in range(num_channels):
+                    value = calc_rms(read_result.data, i, num_channels,
+                                     samples_read_per_channel)
+                    rms.append(value)
+                    telemetry.add(i, block_values(block_features(
+                        read_result.data[i::num_channels], scan_rate)))
+                    print('{:10.5f}'.format(value), 'Vrms ',
+                          end='')
+                    if 0 < capture_rms < value:
+                        capture.trigger('rms ch{}'.format(settings['channels'][i]))
+                state.update(rms=dict(zip(settings['channels'], rms)))
+                stdout.flush()
+
+                sleep(0.1)
+    finally:
+        capture.close()
     print('\n')
 
-def diagnosis_motor(motor, interpreter, input_details, output_details, data, scaler):
+def diagnosis_motor(motor, interpreter, input_details, output_details, data, scaler, capture):
     now = time.time()
     data = preprocessing(data, 3200, scaler)
     result = diagnosis(data, interpreter, input_details, output_details, 3200)
 
     category = ["normal", "misalignment", "unbalance", "damaged bearing"]
-    client.publish("motor_diag_status", str(result+1))
+    publisher.publish("motor_diag_status", str(result+1))
+    if result != 0:
+        capture.trigger(category[result])
     print("\n* diagnosis_result: ", category[result])
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(
+        description='Vibration acquisition and diagnosis.')
+    parser.add_argument('--tach-pin', type=int, default=TACH_PIN,
+                        help='BCM pin of the speed sensor (default %(default)s)')
+    parser.add_argument('--no-tach', action='store_true',
+                        help='disable order tracking, e.g. while rpm.py '
+                        'reads the speed sensor')
+    args = parser.parse_args()
+    main(tach_pin=None if args.no_tach else args.tach_pin)
@@ -0,0 +1,175 @@
+"""
+    Periodic task scheduler for the sensor services.
+
+    Tasks run at fixed deadlines on the time.monotonic() clock: the next
+    deadline is the previous deadline plus the interval, not the finish time
+    plus the interval, so the period does not drift with the run time of the
+    task.  Between deadlines the scheduler thread blocks in Event.wait(),
+    so an idle service uses no CPU.  Tasks run one after another on that
+    thread; if a task overruns one or more whole periods, the missed
+    deadlines are skipped and counted.
+
+    For every task the lateness of each start (jitter) and the CPU and wall
+    time spent in the task are recorded; see :py:meth:`Scheduler.stats`.
+"""
+import heapq
+import itertools
+import time
+from threading import Event, Lock, Thread
+
+
+class PeriodicTask(object):
+    """
+    A task run by the :py:class:`Scheduler`.
+
+    Args:
+        name (str): The name used in the statistics.
+        interval (float): The period in seconds.
+        func (callable): The function called without arguments.
+    """
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.deadline = None
+        self.cancelled = False
+        self.runs = 0
+        self.missed = 0
+        self.errors = 0
+        self.last_error = None
+        self.jitter_max = 0.0
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+        self._jitter_sum = 0.0
+
+    def stats(self):
+        """
+        Return the task statistics.
+
+        Returns:
+            dict: runs, missed deadlines, errors, mean and maximum start
+            lateness (jitter) in seconds, CPU and wall seconds spent in the
+            task and the CPU load as a fraction of one core.
+        """
+        elapsed = (self.runs + self.missed) * self.interval
+        return {
+            'runs': self.runs,
+            'missed': self.missed,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'jitter_mean': self._jitter_sum / self.runs if self.runs else 0.0,
+            'jitter_max': self.jitter_max,
+            'cpu_time': self.cpu_time,
+            'wall_time': self.wall_time,
+            'cpu_load': self.cpu_time / elapsed if elapsed else 0.0,
+        }
+
+    def run(self, now):
+        """ Run once (late by now - deadline) and set the next deadline. """
+        lateness = now - self.deadline
+        self._jitter_sum += lateness
+        self.jitter_max = max(self.jitter_max, lateness)
+        cpu = time.thread_time()
+        try:
+            self.func()
+        except Exception as err:  # pylint: disable=broad-except
+            # One failed reading must not stop the other tasks.
+            self.errors += 1
+            self.last_error = repr(err)
+        self.cpu_time += time.thread_time() - cpu
+        finished = time.monotonic()
+        self.wall_time += finished - now
+        self.runs += 1
+
+        self.deadline += self.interval
+        if finished > self.deadline:
+            skipped = int((finished - self.deadline) // self.interval) + 1
+            self.missed += skipped
+            self.deadline += skipped * self.interval
+
+
+class Scheduler(object):
+    """
+    Run periodic tasks on one thread without busy-waiting.
+    """
+
+    def __init__(self):
+        self.tasks = []
+        self._heap = []
+        self._order = itertools.count()
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._stop = Event()
+        self._thread = None
+
+    def add(self, name, interval, func, delay=0.0):
+        """
+        Add a periodic task.  Safe to call while the scheduler runs.
+
+        Args:
+            name (str): The name used in the statistics.
+            interval (float): The period in seconds.
+            func (callable): The function called without arguments.
+            delay (float): Seconds until the first run.
+
+        Returns:
+            PeriodicTask: The task, e.g. for :py:meth:`cancel`.
+        """
+        task = PeriodicTask(name, interval, func)
+        task.deadline = time.monotonic() + delay
+        with self._lock:
+            self.tasks.append(task)
+            heapq.heappush(self._heap, (task.deadline, next(self._order),
+                                        task))
+        self._wakeup.set()
+        return task
+
+    def cancel(self, task):
+        """ Stop running a task. """
+        with self._lock:
+            task.cancelled = True
+            if task in self.tasks:
+                self.tasks.remove(task)
+
+    def run(self):
+        """ Run the tasks until :py:meth:`stop` is called. """
+        self._stop.clear()
+        while not self._stop.is_set():
+            with self._lock:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                deadline = self._heap[0][0] if self._heap else None
+            timeout = None if deadline is None else \
+                deadline - time.monotonic()
+            if timeout is None or timeout > 0:
+                # Sleep until the deadline, a new task or stop().
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+                continue
+            with self._lock:
+                _deadline, _order, task = heapq.heappop(self._heap)
+            task.run(time.monotonic())
+            with self._lock:
+                if not task.cancelled:
+                    heapq.heappush(self._heap, (task.deadline,
+                                                next(self._order), task))
+
+    def start(self):
+        """ Run the tasks on a background thread. """
+        self._thread = Thread(target=self.run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop after the running task and join the background thread. """
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """ Return the statistics of every task by name. """
+        with self._lock:
+            tasks = list(self.tasks)
+        return {task.name: task.stats() for task in tasks}
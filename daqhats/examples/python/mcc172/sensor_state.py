@@ -0,0 +1,50 @@
+"""
+    Latest sensor values shared between the tasks of one process.
+
+    The acquisition loop, the temperature reader and the RPM counter of a
+    node (see node.py) publish their latest values here, so features that
+    combine sensors are calculated in-process instead of on the server.
+"""
+import time
+from threading import Lock
+
+
+class SensorState(object):
+    """
+    Thread-safe map of value names to their latest value and time.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = Lock()
+
+    def update(self, **values):
+        """ Set one or more values, stamped with the current time. """
+        now = time.time()
+        with self._lock:
+            for name, value in values.items():
+                self._values[name] = (value, now)
+
+    def get(self, name, default=None, max_age=None):
+        """
+        Return a value.
+
+        Args:
+            name (str): The value name.
+            default: Returned if the value is missing or too old.
+            max_age (float): Maximum age in seconds, or None.
+
+        Returns:
+            The latest value, or default.
+        """
+        with self._lock:
+            entry = self._values.get(name)
+        if entry is None or (max_age is not None and
+                             time.time() - entry[1] > max_age):
+            return default
+        return entry[0]
+
+    def snapshot(self):
+        """ Return all values as a dict of name to (value, time). """
+        with self._lock:
+            return dict(self._values)
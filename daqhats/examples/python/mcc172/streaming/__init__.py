@@ -0,0 +1,5 @@
+from streaming.packet import parse_packet, samples_per_packet, \
+    FORMAT_FLOAT32, FORMAT_INT16, FORMAT_INT24
+from streaming.sender import UdpStreamer
+from streaming.receiver import StreamReceiver, ChannelStream, RecordingSink, \
+    FeatureSink
@@ -0,0 +1,145 @@
+"""
+    UDP waveform packet format.
+
+    Every datagram holds consecutive samples of one channel (little endian,
+    version 1)::
+
+        magic 'MS' | version u8 | format u8 | stream id u16 | channel u8 |
+        flags u8 | sequence u32 | sample index u64 | samples u16 |
+        reserved u16 | scan rate f32 | scale f32 | samples
+
+    The stream id identifies the sending device, the sequence number counts
+    the packets of one channel and the sample index is the position of the
+    first sample on the sender's sample clock, so receivers can detect loss
+    and reordering and place every packet exactly.
+
+    Sample formats: FORMAT_FLOAT32 (volts), FORMAT_INT16 and FORMAT_INT24
+    (signed integers, value = integer * scale).  Headers for a whole batch
+    of packets are built at once with a NumPy structured array.
+"""
+import numpy as np
+
+PACKET_MAGIC = b'MS'
+PACKET_VERSION = 1
+
+FORMAT_FLOAT32 = 0
+FORMAT_INT16 = 1
+FORMAT_INT24 = 2
+
+FORMAT_BYTES = {FORMAT_FLOAT32: 4, FORMAT_INT16: 2, FORMAT_INT24: 3}
+
+# Set on the last packet before the sender stops.
+FLAG_END = 0x01
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S2'), ('version', 'u1'), ('format', 'u1'),
+    ('stream', '<u2'), ('channel', 'u1'), ('flags', 'u1'),
+    ('sequence', '<u4'), ('sample_index', '<u8'), ('samples', '<u2'),
+    ('reserved', '<u2'), ('scan_rate', '<f4'), ('scale', '<f4')])
+
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+# IPv4 and UDP headers.
+_IP_UDP_OVERHEAD = 28
+
+
+def samples_per_packet(sample_format, mtu=1500):
+    """
+    Return how many samples fit in one datagram without fragmentation.
+
+    Args:
+        sample_format (int): FORMAT_FLOAT32, FORMAT_INT16 or FORMAT_INT24.
+        mtu (int): The path MTU in bytes.
+
+    Returns:
+        int: Samples per packet.
+    """
+    payload = mtu - _IP_UDP_OVERHEAD - HEADER_SIZE
+    return payload // FORMAT_BYTES[sample_format]
+
+
+def default_scale(sample_format, full_scale=5.0):
+    """ Volts per count that cover +/- full_scale with an integer format. """
+    if sample_format == FORMAT_INT16:
+        return full_scale / 32767.0
+    if sample_format == FORMAT_INT24:
+        return full_scale / 8388607.0
+    return 1.0
+
+
+def encode_samples(values, sample_format, scale=1.0):
+    """
+    Convert samples to the payload bytes of a format.
+
+    Args:
+        values (numpy.ndarray): Samples shaped (packets, samples) in volts.
+        sample_format (int): FORMAT_FLOAT32, FORMAT_INT16 or FORMAT_INT24.
+        scale (float): Volts per count for the integer formats.
+
+    Returns:
+        numpy.ndarray: uint8 payloads shaped (packets, bytes).
+    """
+    packets = values.shape[0]
+    if sample_format == FORMAT_FLOAT32:
+        return values.astype('<f4').view(np.uint8).reshape(packets, -1)
+    if sample_format == FORMAT_INT16:
+        codes = np.clip(np.rint(values / scale), -32768, 32767)
+        return codes.astype('<i2').view(np.uint8).reshape(packets, -1)
+    codes = np.clip(np.rint(values / scale), -8388608, 8388607)
+    data = codes.astype('<i4').view(np.uint8).reshape(packets, -1, 4)
+    return data[:, :, :3].reshape(packets, -1)
+
+
+def decode_samples(payload, sample_format, scale=1.0):
+    """
+    Convert payload bytes back to float samples.
+
+    Args:
+        payload (bytes or numpy.ndarray): The sample bytes of one packet.
+        sample_format (int): FORMAT_FLOAT32, FORMAT_INT16 or FORMAT_INT24.
+        scale (float): Volts per count for the integer formats.
+
+    Returns:
+        numpy.ndarray: float32 samples.
+    """
+    data = np.frombuffer(payload, dtype=np.uint8)
+    if sample_format == FORMAT_FLOAT32:
+        return data.view('<f4')
+    if sample_format == FORMAT_INT16:
+        return data.view('<i2') * np.float32(scale)
+    data = data.reshape(-1, 3)
+    codes = np.empty((len(data), 4), dtype=np.uint8)
+    codes[:, :3] = data
+    # Sign extension of the top byte.
+    codes[:, 3] = np.where(data[:, 2] & 0x80, 0xff, 0)
+    return codes.view('<i4').reshape(-1) * np.float32(scale)
+
+
+def parse_packet(datagram):
+    """
+    Split a datagram into header and samples.
+
+    Args:
+        datagram (bytes): One received datagram.
+
+    Returns:
+        tuple: (header as a HEADER_DTYPE record, float32 samples).
+
+    Raises:
+        ValueError: The datagram is not a valid version 1 packet.
+    """
+    if len(datagram) < HEADER_SIZE:
+        raise ValueError('short packet')
+    header = np.frombuffer(datagram, dtype=HEADER_DTYPE, count=1)[0]
+    if header['magic'] != PACKET_MAGIC or \
+            header['version'] != PACKET_VERSION:
+        raise ValueError('not a waveform packet')
+    sample_format = int(header['format'])
+    if sample_format not in FORMAT_BYTES:
+        raise ValueError('unknown sample format {}'.format(sample_format))
+    size = int(header['samples']) * FORMAT_BYTES[sample_format]
+    if len(datagram) < HEADER_SIZE + size:
+        raise ValueError('truncated packet')
+    samples = decode_samples(datagram[HEADER_SIZE:HEADER_SIZE + size],
+                             sample_format, float(header['scale']))
+    return header, samples
@@ -0,0 +1,536 @@
+"""
+    UDP waveform receiver.
+
+    Usage (from the mcc172 directory)::
+
+        python -m streaming.receiver --port 2001 \\
+            --record ~/stream_data --diagnose diagnosis/norm_q.tflite
+
+    One asyncio datagram endpoint receives the packets of any number of
+    devices (see :py:mod:`streaming.packet`).  Every (stream id, channel)
+    gets a :py:class:`ChannelStream` with a ring buffer that is addressed by
+    the packet's sample index, so reordered packets land in their place and
+    lost packets leave zeros.  Sequence numbers are used to count lost,
+    late (reordered) and duplicate packets.
+
+    Samples are handed on in contiguous blocks once they are older than a
+    short reordering delay, to the same consumers the acquisition scripts
+    use: continuous segment recording (:py:class:`SegmentRecorder`) and the
+    feature extraction and anomaly gate in front of the CNN diagnosis.
+    Streams whose sender goes silent without an end packet are flushed after
+    an idle timeout.
+"""
+import argparse
+import asyncio
+import csv
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import diagnosis
+from diagnosis import block_features, feature_names, AnomalyGate
+from recording import AsyncRecorder, SegmentRecorder
+from streaming.packet import FLAG_END, parse_packet
+
+_SEQUENCE_MOD = 1 << 32
+
+
+def _sequence_delta(sequence, expected):
+    """ Signed distance between two wrapping u32 sequence numbers. """
+    delta = (sequence - expected) % _SEQUENCE_MOD
+    return delta - _SEQUENCE_MOD if delta >= _SEQUENCE_MOD // 2 else delta
+
+
+class ChannelStream(object):
+    """
+    Reassembly state of one channel of one device.
+
+    Args:
+        stream (int): The stream id.
+        channel (int): The channel number.
+        scan_rate (float): The sample rate from the packet headers.
+        ring_seconds (float): Length of the ring buffer.
+        delay (float): Reordering delay in seconds before samples are
+            handed on.
+        block_seconds (float): Length of the blocks handed on.
+    """
+
+    def __init__(self, stream, channel, scan_rate, ring_seconds=10.0,
+                 delay=0.2, block_seconds=1.0):
+        # pylint: disable=too-many-arguments
+        self.stream = stream
+        self.channel = channel
+        self.scan_rate = scan_rate
+        self.ring = np.zeros(max(1, int(ring_seconds * scan_rate)),
+                             dtype=np.float32)
+        self.delay_samples = int(delay * scan_rate)
+        self.block_samples = max(1, int(block_seconds * scan_rate))
+        self.expected_sequence = None
+        self.head = None
+        self.committed = None
+        self.time_origin = None
+
+        self.packets = 0
+        self.bytes = 0
+        self.lost = 0
+        self.late = 0
+        self.duplicates = 0
+        self.overwritten = 0
+        self.last_packet = None
+        self._rate_time = time.monotonic()
+        self._rate_samples = 0
+        self.sample_rate = 0.0
+
+    def add(self, header, samples, size):
+        """
+        Place the samples of one packet.
+
+        Args:
+            header (numpy.void): The packet header.
+            samples (numpy.ndarray): The packet samples.
+            size (int): The datagram size in bytes.
+        """
+        sequence = int(header['sequence'])
+        start = int(header['sample_index'])
+        count = len(samples)
+        self.packets += 1
+        self.bytes += size
+        self.last_packet = time.time()
+        self._rate_samples += count
+
+        if self.expected_sequence is None:
+            self.expected_sequence = sequence
+            self.head = self.committed = start
+            self.time_origin = time.time() - (start + count) / self.scan_rate
+        delta = _sequence_delta(sequence, self.expected_sequence)
+        if delta >= 0:
+            self.lost += delta
+            self.expected_sequence = (sequence + 1) % _SEQUENCE_MOD
+        elif start < self.committed:
+            # Too late, the range was already handed on.
+            self.overwritten += 1
+            return
+        elif self._filled(start, count):
+            self.duplicates += 1
+            return
+        else:
+            self.late += 1
+            self.lost -= 1
+
+        size = len(self.ring)
+        if start + count - self.committed > size:
+            # Far ahead of the consumers: skip the samples that no longer
+            # fit instead of overwriting unread data.
+            self.committed = start + count - size
+        pos = start % size
+        first = min(count, size - pos)
+        self.ring[pos:pos + first] = samples[:first]
+        self.ring[:count - first] = samples[first:]
+        self.head = max(self.head, start + count)
+
+    def take(self, final=False):
+        """
+        Return the complete blocks that are older than the reordering delay.
+
+        Args:
+            final (bool): Also return the rest, e.g. when shutting down.
+
+        Returns:
+            list[tuple]: (sample index, samples) per block; lost samples are
+            zeros.
+        """
+        blocks = []
+        if self.head is None:
+            return blocks
+        limit = self.head if final else self.head - self.delay_samples
+        while limit - self.committed >= (1 if final else self.block_samples):
+            count = min(self.block_samples, limit - self.committed)
+            blocks.append((self.committed, self._read(self.committed, count)))
+            self.committed += count
+        return blocks
+
+    def time_of(self, sample_index):
+        """ Arrival-based time of a sample index. """
+        return self.time_origin + sample_index / self.scan_rate
+
+    def stats(self):
+        """
+        Return the stream statistics.
+
+        Returns:
+            dict: packets, bytes, lost, late, duplicate and too-late packets,
+            the loss ratio and the received sample rate.
+        """
+        now = time.monotonic()
+        if now - self._rate_time >= 1.0:
+            self.sample_rate = self._rate_samples / (now - self._rate_time)
+            self._rate_time = now
+            self._rate_samples = 0
+        expected = self.packets + self.lost
+        return {
+            'stream': self.stream,
+            'channel': self.channel,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'lost': self.lost,
+            'late': self.late,
+            'duplicates': self.duplicates,
+            'too_late': self.overwritten,
+            'loss': self.lost / expected if expected else 0.0,
+            'sample_rate': self.sample_rate,
+        }
+
+    def _filled(self, start, count):
+        """ True if a range holds data (a repeated packet). """
+        return bool(np.any(self._read(start, count, clear=False)))
+
+    def _read(self, start, count, clear=True):
+        size = len(self.ring)
+        pos = start % size
+        first = min(count, size - pos)
+        data = np.concatenate((self.ring[pos:pos + first],
+                               self.ring[:count - first]))
+        if clear:
+            # Lost packets must read as zeros when the ring wraps around.
+            self.ring[pos:pos + first] = 0
+            self.ring[:count - first] = 0
+        return data
+
+
+class StreamReceiver(asyncio.DatagramProtocol):
+    """
+    Receive the packets of many devices and reassemble them per channel.
+
+    Args:
+        on_block (callable): Called as on_block(channel_stream, sample_index,
+            samples) for every contiguous block.
+        ring_seconds (float): Ring buffer length per channel.
+        delay (float): Reordering delay in seconds.
+        block_seconds (float): Length of the blocks passed to on_block.
+        idle_timeout (float): Seconds without packets after which a stream
+            is flushed and ended, see :py:meth:`expire`.
+    """
+    # pylint: disable=too-many-arguments
+
+    def __init__(self, on_block=None, ring_seconds=10.0, delay=0.2,
+                 block_seconds=1.0, idle_timeout=30.0):
+        self.on_block = on_block
+        self.ring_seconds = ring_seconds
+        self.delay = delay
+        self.block_seconds = block_seconds
+        self.idle_timeout = idle_timeout
+        self.streams = {}
+        # Statistics of the streams whose senders stopped.
+        self.finished = []
+        self.invalid = 0
+
+    def datagram_received(self, data, addr):
+        try:
+            header, samples = parse_packet(data)
+        except ValueError:
+            self.invalid += 1
+            return
+        key = (int(header['stream']), int(header['channel']))
+        stream = self.streams.get(key)
+        if stream is not None and (
+                stream.scan_rate != float(header['scan_rate']) or
+                int(header['sample_index']) + len(stream.ring) <
+                stream.committed):
+            # The sender restarted (with a new rate or its clock at 0).
+            self._deliver(stream, final=True)
+            stream = None
+        if stream is None:
+            stream = ChannelStream(key[0], key[1], float(header['scan_rate']),
+                                   self.ring_seconds, self.delay,
+                                   self.block_seconds)
+            self.streams[key] = stream
+        stream.add(header, samples, len(data))
+        if header['flags'] & FLAG_END:
+            self._deliver(stream, final=True)
+            self.finished.append(self.streams.pop(key).stats())
+        else:
+            self._deliver(stream)
+
+    def expire(self, now=None):
+        """
+        End the streams whose sender stopped without an end packet: hand on
+        their buffered tail and move their statistics to ``finished``.
+
+        Args:
+            now (float): The current time.time() time.
+
+        Returns:
+            int: The number of streams ended.
+        """
+        if now is None:
+            now = time.time()
+        idle = [key for key, stream in self.streams.items()
+                if now - stream.last_packet > self.idle_timeout]
+        for key in idle:
+            stream = self.streams.pop(key)
+            self._deliver(stream, final=True)
+            self.finished.append(stream.stats())
+        return len(idle)
+
+    def flush(self):
+        """ Hand on everything that is buffered. """
+        for stream in self.streams.values():
+            self._deliver(stream, final=True)
+
+    def stats(self):
+        """ Return the statistics of every channel stream. """
+        return [stream.stats() for _key, stream
+                in sorted(self.streams.items())]
+
+    def _deliver(self, stream, final=False):
+        if self.on_block is None:
+            stream.take(final)
+            return
+        for sample_index, samples in stream.take(final):
+            self.on_block(stream, sample_index, samples)
+
+
+class RecordingSink(object):
+    """
+    Record every channel stream continuously into segments.
+
+    Args:
+        directory (str): The recording directory; every stream channel is
+            recorded in ``<directory>/stream<id>-ch<channel>``.
+        **kwargs: Additional :py:class:`SegmentRecorder` arguments.
+    """
+
+    def __init__(self, directory, **kwargs):
+        self.directory = os.path.expanduser(directory)
+        self.kwargs = kwargs
+        self.recorder = AsyncRecorder()
+        self.recorder.start()
+        self.segments = {}
+
+    def __call__(self, stream, sample_index, samples):
+        key = (stream.stream, stream.channel)
+        segments, expected = self.segments.get(key, (None, None))
+        if segments is None or segments.scan_rate != stream.scan_rate:
+            if segments is not None:
+                segments.close()
+            segments = SegmentRecorder(
+                os.path.join(self.directory, 'stream{}-ch{}'.format(*key)),
+                stream.scan_rate, [stream.channel], recorder=self.recorder,
+                **self.kwargs)
+        elif sample_index != expected:
+            # Samples were skipped or the sender restarted.
+            segments.restart()
+        segments.write(samples.reshape(1, -1),
+                       timestamp=stream.time_of(sample_index))
+        self.segments[key] = (segments, sample_index + len(samples))
+
+    def close(self):
+        """ Finish all segments. """
+        for segments, _expected in self.segments.values():
+            segments.close()
+        self.recorder.stop()
+
+
+class FeatureSink(object):
+    """
+    Compute features per window and apply the anomaly gate per channel.
+
+    Args:
+        window (float): Window length in seconds.
+        on_window (callable): Called as on_window(stream, time, features,
+            forward) for every window; forward is the gate decision.
+        diagnose (callable): Called as diagnose(stream, time, samples) for
+            the windows the gate forwards, e.g. a :py:class:`CnnDiagnosis`.
+    """
+
+    def __init__(self, window=10.0, on_window=None, diagnose=None):
+        self.window = window
+        self.on_window = on_window
+        self.diagnose = diagnose
+        self.num_features = len(feature_names())
+        self._pending = {}
+        self._gates = {}
+
+    def __call__(self, stream, sample_index, samples):
+        key = (stream.stream, stream.channel)
+        start, parts = self._pending.get(key, (sample_index, []))
+        parts.append(samples)
+        size = int(self.window * stream.scan_rate)
+        if sum(len(part) for part in parts) < size:
+            self._pending[key] = (start, parts)
+            return
+        data = np.concatenate(parts)
+        self._pending[key] = (start + size, [data[size:]])
+        gate = self._gates.get(key)
+        if gate is None:
+            gate = self._gates[key] = AnomalyGate(self.num_features)
+        features = block_features(data[:size], stream.scan_rate)
+        forward = gate.check(features)
+        if self.on_window is not None:
+            self.on_window(stream, stream.time_of(start), features, forward)
+        if forward and self.diagnose is not None:
+            self.diagnose(stream, stream.time_of(start), data[:size])
+
+    def close(self):
+        """ Finish the diagnosis of the forwarded windows. """
+        if hasattr(self.diagnose, 'close'):
+            self.diagnose.close()
+
+
+class CnnDiagnosis(object):
+    """
+    Run the CNN of scan_with_diagnosis_mqtt.py on stream windows.
+
+    The model takes 102400 samples at 10240 S/s, scaled with the
+    MinMaxScaler of the normal reference data; windows of other rates are
+    resampled (band-limited, by FFT) to that rate first.  Inference runs on
+    one worker thread, so the receiver keeps reading packets meanwhile.
+
+    Args:
+        model_path (str): The TF Lite model.
+        normal_path (str): CSV file of the normal reference data.
+        on_result (callable): Called as on_result(stream, time, category)
+            on the worker thread; prints the result by default.
+    """
+
+    CATEGORIES = ('normal', 'misalignment', 'unbalance', 'damaged bearing')
+    MODEL_RATE = 10240.0
+    MODEL_SAMPLES = 102400
+    MODEL_SHAPE = 3200
+
+    def __init__(self, model_path, normal_path, on_result=None):
+        # Only needed for the diagnosis, so not a dependency of the module.
+        from sklearn.preprocessing import MinMaxScaler
+        with open(os.path.expanduser(normal_path), 'r') as normal:
+            reference = np.array([value for row in csv.reader(normal)
+                                  for value in row], dtype=np.float32)
+        self.scaler = MinMaxScaler()
+        self.scaler.fit(reference.reshape(-1, 1))
+        self.interpreter, self.input_details, self.output_details = \
+            diagnosis.load_model(os.path.expanduser(model_path))
+        self.on_result = on_result or _print_diagnosis
+        self.skipped = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __call__(self, stream, when, samples):
+        needed = int(round(self.MODEL_SAMPLES * stream.scan_rate /
+                           self.MODEL_RATE))
+        if len(samples) < needed:
+            # The window is shorter than the 10 s the model takes.
+            self.skipped += 1
+            return
+        self._executor.submit(self._run, stream, when, samples[:needed])
+
+    def _run(self, stream, when, samples):
+        if len(samples) != self.MODEL_SAMPLES:
+            spectrum = np.fft.rfft(samples)[:self.MODEL_SAMPLES // 2 + 1]
+            samples = np.fft.irfft(spectrum, self.MODEL_SAMPLES) * \
+                (self.MODEL_SAMPLES / float(len(samples)))
+        data = diagnosis.preprocessing(samples, self.MODEL_SHAPE,
+                                       self.scaler)
+        result = diagnosis.diagnosis(data, self.interpreter,
+                                     self.input_details,
+                                     self.output_details, self.MODEL_SHAPE)
+        self.on_result(stream, when, self.CATEGORIES[result])
+
+    def close(self):
+        """ Wait for the queued windows. """
+        self._executor.shutdown(wait=True)
+
+
+def _print_stats(receiver):
+    print('\n{:>6} {:>3} {:>10} {:>8} {:>6} {:>6} {:>7} {:>10}'.format(
+        'stream', 'ch', 'packets', 'lost', 'late', 'dup', 'loss', 'S/s'))
+    for stats in receiver.stats():
+        print('{stream:6d} {channel:3d} {packets:10d} {lost:8d} {late:6d} '
+              '{duplicates:6d} {loss:7.2%} {sample_rate:10.0f}'.format(
+                  **stats))
+
+
+def _print_diagnosis(stream, when, category):
+    print('stream {} ch {} {}: diagnosis {}'.format(
+        stream.stream, stream.channel,
+        time.strftime('%H:%M:%S', time.localtime(when)), category))
+
+
+def _print_window(stream, when, features, forward):
+    print('stream {} ch {} {}: rms {:.4f} kurtosis {:.2f}{}'.format(
+        stream.stream, stream.channel,
+        time.strftime('%H:%M:%S', time.localtime(when)), features[0],
+        features[3], ' -> diagnosis' if forward else ''))
+
+
+async def _serve(args):
+    sinks = []
+    if args.record:
+        sinks.append(RecordingSink(args.record,
+                                   segment_seconds=args.segment_seconds))
+    if args.features or args.diagnose:
+        model = CnnDiagnosis(args.diagnose, args.normal) \
+            if args.diagnose else None
+        sinks.append(FeatureSink(args.window, _print_window, model))
+
+    def on_block(stream, sample_index, samples):
+        for sink in sinks:
+            sink(stream, sample_index, samples)
+
+    loop = asyncio.get_running_loop()
+    transport, receiver = await loop.create_datagram_endpoint(
+        lambda: StreamReceiver(on_block, delay=args.delay,
+                               idle_timeout=args.idle_timeout),
+        local_addr=(args.host, args.port))
+    try:
+        # Bursts of dozens of senders must not overflow the socket.
+        transport.get_extra_info('socket').setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, args.rcvbuf)
+    except OSError:
+        pass
+    try:
+        while True:
+            await asyncio.sleep(args.interval)
+            receiver.expire()
+            _print_stats(receiver)
+    finally:
+        transport.close()
+        receiver.flush()
+        for sink in sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
+
+
+def main():
+    """ Run the receiver until interrupted. """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=2001)
+    parser.add_argument('--record', help='record the streams in this '
+                        'directory')
+    parser.add_argument('--segment-seconds', type=float, default=600.0)
+    parser.add_argument('--features', action='store_true',
+                        help='print window features and gate decisions')
+    parser.add_argument('--window', type=float, default=10.0,
+                        help='feature window in seconds')
+    parser.add_argument('--diagnose', metavar='MODEL',
+                        help='run this TF Lite model on the windows the '
+                        'anomaly gate forwards (implies --features)')
+    parser.add_argument('--normal', default='/home/raspberry/diagnosis_data/'
+                        'test/1/normal1.csv',
+                        help='normal reference data of the model scaler')
+    parser.add_argument('--delay', type=float, default=0.2,
+                        help='reordering delay in seconds')
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help='statistics interval in seconds')
+    parser.add_argument('--idle-timeout', type=float, default=30.0,
+                        help='end streams without packets for this long')
+    parser.add_argument('--rcvbuf', type=int, default=8 << 20,
+                        help='socket receive buffer in bytes')
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
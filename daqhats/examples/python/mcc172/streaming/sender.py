@@ -0,0 +1,287 @@
+"""
+    Continuous UDP waveform streaming.
+
+    The acquisition loop pushes every block; samples are collected per
+    channel until a full MTU-sized packet is available, so all datagrams
+    except the final one have the same size.  Packets of a block are built
+    together (headers as one structured array, payloads as one array) and
+    queued for a sender thread, so the acquisition loop never waits on the
+    network.
+
+    The sender thread applies a token bucket rate limit and transmits each
+    batch with UDP generic segmentation offload where the kernel supports
+    it (Linux 4.18+): one send() hands up to 64 equally sized datagrams to
+    the kernel, which is the sendmmsg-style batching Python's socket module
+    does not otherwise offer.  Elsewhere it falls back to one send() per
+    datagram from the prebuilt buffer.  When the queue overflows, the oldest
+    packets are dropped and the gap shows up in the sequence numbers.
+"""
+import errno
+import socket
+import time
+from collections import deque
+from threading import Condition, Thread
+import numpy as np
+from streaming.packet import HEADER_DTYPE, PACKET_MAGIC, PACKET_VERSION, \
+    FORMAT_BYTES, FORMAT_FLOAT32, FLAG_END, default_scale, encode_samples, \
+    samples_per_packet
+
+# Linux UDP generic segmentation offload.
+_UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+_SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+_GSO_MAX_SEGMENTS = 64
+_GSO_MAX_BYTES = 65000
+
+
+class UdpStreamer(object):
+    """
+    Stream per-channel sample blocks to a UDP receiver.
+
+    Args:
+        address (tuple): The receiver (host, port).
+        stream_id (int): Identifies this device to the receiver.
+        scan_rate (float): The sample rate in Hz.
+        num_channels (int): The number of rows of the pushed blocks.
+        channel_numbers (list[int]): Channel numbers sent in the header, in
+            row order (0, 1, ... by default).
+        sample_format (int): FORMAT_FLOAT32, FORMAT_INT16 or FORMAT_INT24.
+        full_scale (float): Largest magnitude in volts for the integer
+            formats.
+        mtu (int): The path MTU; packets are sized to avoid fragmentation.
+        rate_limit (float): Maximum bytes per second on the wire, or None.
+        queue_packets (int): Packets held before the oldest are dropped.
+        gso (bool): Try UDP segmentation offload.
+    """
+
+    def __init__(self, address, stream_id, scan_rate, num_channels,
+                 channel_numbers=None, sample_format=FORMAT_FLOAT32,
+                 full_scale=5.0, mtu=1500, rate_limit=None,
+                 queue_packets=8192, gso=True):
+        # pylint: disable=too-many-arguments
+        self.address = address
+        self.stream_id = stream_id
+        self.scan_rate = scan_rate
+        self.num_channels = num_channels
+        self.channel_numbers = list(range(num_channels)) \
+            if channel_numbers is None else list(channel_numbers)
+        self.sample_format = sample_format
+        self.scale = default_scale(sample_format, full_scale)
+        self.packet_samples = samples_per_packet(sample_format, mtu)
+        self.packet_bytes = HEADER_DTYPE.itemsize + \
+            self.packet_samples * FORMAT_BYTES[sample_format]
+        self.rate_limit = rate_limit
+        self.queue_packets = queue_packets
+        # Row positions of the channels that are sent.
+        self.channels = set(range(num_channels))
+
+        self._pending = [np.empty(0, dtype=np.float32)
+                         for _i in range(num_channels)]
+        self._sample_index = [0] * num_channels
+        self._sequence = [0] * num_channels
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.connect(address)
+        self._gso = False
+        if gso:
+            try:
+                self._sock.setsockopt(_SOL_UDP, _UDP_SEGMENT,
+                                      self.packet_bytes)
+                self._gso = True
+            except OSError:
+                pass
+
+        self._queue = deque()
+        self._queued = 0
+        self._cond = Condition()
+        self._running = False
+        self._thread = None
+        self._tokens = 0.0
+        self._token_time = time.monotonic()
+
+        self.packets_sent = 0
+        self.bytes_sent = 0
+        self.packets_dropped = 0
+        self.send_errors = 0
+        self.throttled = 0.0
+
+    @property
+    def gso(self):
+        """ True if datagrams are segmented by the kernel. """
+        return self._gso
+
+    def start(self):
+        """ Start the sender thread. """
+        if self._running:
+            return
+        self._running = True
+        self._thread = Thread(target=self._run, name='udp-streamer',
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Send the remaining samples (as short final packets) and stop.
+
+        Args:
+            timeout (float): Maximum time to wait for the queue to drain.
+        """
+        for row in range(self.num_channels):
+            self._packetize(row, final=True)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._sock.close()
+
+    def push(self, block):
+        """
+        Queue a block of samples.
+
+        Args:
+            block (numpy.ndarray): Samples shaped (channels, samples).
+        """
+        block = np.asarray(block, dtype=np.float32)
+        for row in range(self.num_channels):
+            if row not in self.channels:
+                # Keep the sample clock of disabled channels running.
+                self._sample_index[row] += len(self._pending[row]) + \
+                    block.shape[1]
+                self._pending[row] = self._pending[row][:0]
+                continue
+            if self._pending[row].size:
+                self._pending[row] = np.concatenate((self._pending[row],
+                                                     block[row]))
+            else:
+                self._pending[row] = block[row]
+            self._packetize(row)
+
+    def metrics(self):
+        """
+        Return the streaming metrics.
+
+        Returns:
+            dict: queue depth in packets, packets and bytes sent, dropped
+            packets, send errors, seconds spent throttled and whether
+            segmentation offload is used.
+        """
+        return {
+            'queue_packets': self._queued,
+            'packets_sent': self.packets_sent,
+            'bytes_sent': self.bytes_sent,
+            'packets_dropped': self.packets_dropped,
+            'send_errors': self.send_errors,
+            'throttled': self.throttled,
+            'gso': self._gso,
+        }
+
+    def _packetize(self, row, final=False):
+        """ Queue the full packets of a channel (and the rest if final). """
+        pending = self._pending[row]
+        count = len(pending) // self.packet_samples
+        used = count * self.packet_samples
+        if count:
+            self._queue_batch(row, pending[:used].reshape(count, -1), 0)
+        self._pending[row] = pending[used:]
+        if final and len(self._pending[row]):
+            self._queue_batch(row, self._pending[row].reshape(1, -1),
+                              FLAG_END)
+            self._pending[row] = self._pending[row][:0]
+
+    def _queue_batch(self, row, values, flags):
+        count, samples = values.shape
+        headers = np.zeros(count, dtype=HEADER_DTYPE)
+        headers['magic'] = PACKET_MAGIC
+        headers['version'] = PACKET_VERSION
+        headers['format'] = self.sample_format
+        headers['stream'] = self.stream_id
+        headers['channel'] = self.channel_numbers[row]
+        headers['flags'] = flags
+        headers['sequence'] = (self._sequence[row] +
+                               np.arange(count)) & 0xffffffff
+        headers['sample_index'] = self._sample_index[row] + \
+            np.arange(count) * samples
+        headers['samples'] = samples
+        headers['scan_rate'] = self.scan_rate
+        headers['scale'] = self.scale
+        self._sequence[row] += count
+        self._sample_index[row] += count * samples
+
+        payload = encode_samples(values, self.sample_format, self.scale)
+        packets = np.concatenate((headers.view(np.uint8).reshape(count, -1),
+                                  payload), axis=1)
+        with self._cond:
+            self._queue.append(packets)
+            self._queued += count
+            while self._queued > self.queue_packets and len(self._queue) > 1:
+                dropped = self._queue.popleft()
+                self._queued -= len(dropped)
+                self.packets_dropped += len(dropped)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait(1.0)
+                if not self._queue:
+                    break
+                packets = self._queue.popleft()
+                self._queued -= len(packets)
+            self._send(packets)
+
+    def _throttle(self, size):
+        """ Wait until the token bucket allows size bytes. """
+        if not self.rate_limit:
+            return
+        now = time.monotonic()
+        # Allow bursts of up to 50 ms of traffic.
+        self._tokens = min(self.rate_limit * 0.05, self._tokens +
+                           (now - self._token_time) * self.rate_limit)
+        self._token_time = now
+        self._tokens -= size
+        if self._tokens < 0:
+            wait = -self._tokens / self.rate_limit
+            self.throttled += wait
+            time.sleep(wait)
+
+    def _send(self, packets):
+        """ Transmit a batch of equally sized packets. """
+        size = packets.shape[1]
+        wire = size + 28
+        gso = self._gso and size == self.packet_bytes
+        step = max(1, min(_GSO_MAX_SEGMENTS, _GSO_MAX_BYTES // size)) \
+            if gso else 1
+        for pos in range(0, len(packets), step):
+            batch = packets[pos:pos + step]
+            self._throttle(wire * len(batch))
+            if not gso:
+                for packet in batch:
+                    self._send_packet(packet)
+                continue
+            try:
+                self._sock.send(batch.data)
+            except OSError as err:
+                if err.errno in (errno.EIO, errno.EINVAL):
+                    # The interface cannot segment; send the rest one by
+                    # one (this batch is throttled again there).
+                    self._gso = False
+                    if self.rate_limit:
+                        self._tokens += wire * len(batch)
+                    self._send(packets[pos:])
+                    return
+                # No receiver yet (ECONNREFUSED) or a full socket buffer.
+                self.send_errors += 1
+                continue
+            self.packets_sent += len(batch)
+            self.bytes_sent += batch.nbytes
+
+    def _send_packet(self, packet):
+        """ Transmit one datagram. """
+        try:
+            self._sock.send(packet.data)
+        except OSError:
+            self.send_errors += 1
+            return
+        self.packets_sent += 1
+        self.bytes_sent += packet.nbytes
@@ -0,0 +1,148 @@
+"""
+    Tests of the UDP waveform streaming.
+
+    Run from the mcc172 directory with ``python -m pytest streaming`` or
+    ``python -m unittest streaming.test_streaming``.
+"""
+import errno
+import unittest
+import numpy as np
+from streaming.packet import FORMAT_FLOAT32, FORMAT_INT16, FORMAT_INT24, \
+    FORMAT_BYTES, HEADER_DTYPE, PACKET_MAGIC, PACKET_VERSION, \
+    decode_samples, default_scale, encode_samples, parse_packet
+from streaming.sender import UdpStreamer
+
+
+class _FakeSocket(object):
+    """ A connected UDP socket that keeps the datagrams it is given. """
+
+    def __init__(self, segment_size=None):
+        # Sends longer than segment_size fail as on an interface without
+        # segmentation offload.
+        self.segment_size = segment_size
+        self.datagrams = []
+
+    def send(self, data):
+        data = bytes(data)
+        if self.segment_size is not None and len(data) > self.segment_size:
+            raise OSError(errno.EINVAL, 'segmentation offload unsupported')
+        self.datagrams.append(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def _streamer(sock, gso):
+    streamer = UdpStreamer(('127.0.0.1', 9), 7, 51200.0, 2,
+                           channel_numbers=[0, 1],
+                           sample_format=FORMAT_INT24, gso=False)
+    streamer._sock.close()
+    streamer._sock = sock
+    streamer._gso = gso
+    return streamer
+
+
+class PacketTest(unittest.TestCase):
+    """ encode_samples -> decode_samples and parse_packet. """
+
+    def test_int24_codes(self):
+        scale = default_scale(FORMAT_INT24)
+        codes = np.array([[0, 1, -1, 127, 128, -128, -129, 255, 256,
+                           32767, -32768, 8388607, -8388608]])
+        payload = encode_samples(codes * scale, FORMAT_INT24, scale)
+        self.assertEqual(payload.shape, (1, 3 * codes.shape[1]))
+        decoded = decode_samples(payload[0], FORMAT_INT24, scale)
+        np.testing.assert_array_equal(np.rint(decoded / np.float32(scale)),
+                                      codes[0])
+
+    def test_formats(self):
+        values = np.random.default_rng(2).uniform(-5.0, 5.0, size=(3, 17))
+        for sample_format in (FORMAT_FLOAT32, FORMAT_INT16, FORMAT_INT24):
+            with self.subTest(sample_format=sample_format):
+                scale = default_scale(sample_format)
+                payload = encode_samples(values, sample_format, scale)
+                self.assertEqual(payload.shape[1],
+                                 17 * FORMAT_BYTES[sample_format])
+                for row in range(3):
+                    np.testing.assert_allclose(
+                        decode_samples(payload[row], sample_format, scale),
+                        values[row], atol=max(scale, 1e-6))
+
+    def test_saturation(self):
+        scale = default_scale(FORMAT_INT24, full_scale=5.0)
+        payload = encode_samples(np.array([[-7.0, 7.0]]), FORMAT_INT24, scale)
+        np.testing.assert_allclose(
+            decode_samples(payload[0], FORMAT_INT24, scale), [-5.0, 5.0],
+            atol=2 * scale)
+
+    def test_parse_packet(self):
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = PACKET_MAGIC
+        header['version'] = PACKET_VERSION
+        header['format'] = FORMAT_INT24
+        header['channel'] = 1
+        header['samples'] = 3
+        header['scale'] = default_scale(FORMAT_INT24)
+        payload = encode_samples(np.array([[0.5, -0.25, 0.0]]),
+                                 FORMAT_INT24, float(header['scale'][0]))
+        datagram = header.tobytes() + payload.tobytes()
+        parsed, samples = parse_packet(datagram)
+        self.assertEqual(int(parsed['channel']), 1)
+        np.testing.assert_allclose(samples, [0.5, -0.25, 0.0], atol=1e-6)
+        for broken in (datagram[:10], datagram[:-1],
+                       b'XX' + datagram[2:]):
+            with self.assertRaises(ValueError):
+                parse_packet(broken)
+
+
+class SenderTest(unittest.TestCase):
+    """ UdpStreamer packetizing and sending. """
+
+    def _stream(self, sock, gso):
+        streamer = _streamer(sock, gso)
+        rng = np.random.default_rng(0)
+        block = rng.uniform(-4.0, 4.0, size=(2, 200 * streamer.packet_samples
+                                                 + 17))
+        streamer.start()
+        # One large block (batches of many packets) and small ones.
+        streamer.push(block[:, :150 * streamer.packet_samples])
+        for start in range(150 * streamer.packet_samples, block.shape[1],
+                           5000):
+            streamer.push(block[:, start:start + 5000])
+        streamer.stop()
+        return streamer, block
+
+    def _check(self, streamer, sock, block):
+        received = {0: [], 1: []}
+        for datagram in sock.datagrams:
+            header, samples = parse_packet(datagram)
+            received[int(header['channel'])].append(
+                (int(header['sequence']), samples))
+        for channel in (0, 1):
+            sequences = [item[0] for item in received[channel]]
+            self.assertEqual(sequences, list(range(len(sequences))))
+            samples = np.concatenate([item[1] for item in received[channel]])
+            np.testing.assert_allclose(samples, block[channel],
+                                       atol=streamer.scale)
+        self.assertEqual(streamer.packets_sent, len(sock.datagrams))
+        self.assertEqual(streamer.bytes_sent,
+                         sum(len(item) for item in sock.datagrams))
+        self.assertEqual(streamer.send_errors, 0)
+
+    def test_one_by_one(self):
+        sock = _FakeSocket()
+        streamer, block = self._stream(sock, gso=False)
+        self._check(streamer, sock, block)
+
+    def test_gso_fallback(self):
+        # The kernel accepts the socket option but the interface cannot
+        # segment: every packet must still be sent once.
+        sock = _FakeSocket(segment_size=1500)
+        streamer, block = self._stream(sock, gso=True)
+        self.assertFalse(streamer.gso)
+        self._check(streamer, sock, block)
+
+
+if __name__ == '__main__':
+    unittest.main()
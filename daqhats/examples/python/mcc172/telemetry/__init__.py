@@ -0,0 +1,5 @@
+from telemetry.publisher import MqttPublisher
+from telemetry.codec import TelemetryBatcher, encode, decode, block_values
+from telemetry.waveform import WaveformStreamer, Decimator, decode_chunk
+from telemetry.control import ControlSubscriber, SCAN_SETTINGS, \
+    MCC172_CHANNELS
@@ -0,0 +1,265 @@
+"""
+    Compact, versioned binary encoding for batched feature telemetry.
+
+    Instead of one MQTT message per value (``str(temperature)``), features
+    from many channels and timestamps are collected by a TelemetryBatcher and
+    published as one struct-packed message at a configurable cadence.
+
+    Message layout (little endian, schema version 1)::
+
+        header   magic 'MT' | version u8 | flags u8 | base time f64 | count u16
+        record   time offset ms u32 | channel u8 | value count u8
+        value    feature id u8 | value f32          (repeated value count)
+
+    When FLAG_ZLIB is set everything after the header is zlib compressed.
+"""
+import struct
+import time
+import zlib
+from threading import Condition, Thread
+from diagnosis.features import BASE_FEATURES, feature_names
+
+SCHEMA_VERSION = 1
+MAGIC = b'MT'
+FLAG_ZLIB = 0x01
+
+_HEADER = struct.Struct('<2sBBdH')
+_RECORD = struct.Struct('<IBB')
+_VALUE = struct.Struct('<Bf')
+
+FEATURE_IDS = {
+    'rms': 1,
+    'peak': 2,
+    'crest': 3,
+    'kurtosis': 4,
+    'temperature': 16,
+    'rpm': 17,
+    'rpm_instant': 18,
+    'diagnosis': 19,
+    'rpm_min': 20,
+    'rpm_max': 21,
+    'order_1x': 22,
+    'order_2x': 23,
+    'order_bpfo': 24,
+    'order_bpfi': 25,
+    'order_bsf': 26,
+    'order_ftf': 27,
+    # 32 - 63 are the band energies of diagnosis.block_features.
+    'tsa_rms': 64,
+    'tsa_p2p': 65,
+    'tsa_1x': 66,
+    'tsa_2x': 67,
+    'tsa_phase_1x': 68,
+    'tsa_ratio': 69,
+    'rms_per_krpm': 70,
+    'env_rms': 71,
+    'env_bpfo': 72,
+    'env_bpfi': 73,
+    'env_bsf': 74,
+    'env_ftf': 75,
+}
+BAND_ID_BASE = 32
+MAX_BANDS = 32
+
+# The band energies have the names of diagnosis.feature_names() (e.g.
+# band_10_100), numbered in band order.
+BAND_NAMES = feature_names()[len(BASE_FEATURES):][:MAX_BANDS]
+FEATURE_IDS.update({name: BAND_ID_BASE + i
+                    for i, name in enumerate(BAND_NAMES)})
+
+FEATURE_NAMES = {value: key for key, value in FEATURE_IDS.items()}
+
+
+def encode(records, compress_threshold=256):
+    """
+    Encode telemetry records into one binary message.
+
+    Args:
+        records (list): (timestamp, channel, values) tuples, where values is
+            a dict of feature name to number.
+        compress_threshold (int): Bodies at least this long are zlib
+            compressed if that makes them smaller.
+
+    Returns:
+        bytes: The encoded message.
+
+    Raises:
+        ValueError: A feature name is not part of the schema.
+    """
+    base_time = min(record[0] for record in records) if records else 0.0
+    body = bytearray()
+    for timestamp, channel, values in records:
+        offset = int(round((timestamp - base_time) * 1000.0))
+        body += _RECORD.pack(offset, channel, len(values))
+        for name, value in values.items():
+            try:
+                fid = FEATURE_IDS[name]
+            except KeyError:
+                raise ValueError('Unknown telemetry feature: {}'.format(name))
+            body += _VALUE.pack(fid, value)
+
+    flags = 0
+    if len(body) >= compress_threshold:
+        packed = zlib.compress(bytes(body))
+        if len(packed) < len(body):
+            body = packed
+            flags |= FLAG_ZLIB
+
+    return _HEADER.pack(MAGIC, SCHEMA_VERSION, flags, base_time,
+                        len(records)) + bytes(body)
+
+
+def decode(payload):
+    """
+    Decode a message produced by :py:func:`encode`.
+
+    Args:
+        payload (bytes): The MQTT message payload.
+
+    Returns:
+        list: (timestamp, channel, values) tuples with values as a dict of
+        feature name to float.
+
+    Raises:
+        ValueError: The payload is not a telemetry message of a supported
+            schema version.
+    """
+    if len(payload) < _HEADER.size:
+        raise ValueError('Telemetry message too short')
+    magic, version, flags, base_time, count = _HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError('Not a telemetry message')
+    if version != SCHEMA_VERSION:
+        raise ValueError('Unsupported telemetry schema version {}'.format(
+            version))
+
+    body = payload[_HEADER.size:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+
+    records = []
+    offset = 0
+    for _i in range(count):
+        time_offset, channel, num_values = _RECORD.unpack_from(body, offset)
+        offset += _RECORD.size
+        values = {}
+        for _j in range(num_values):
+            fid, value = _VALUE.unpack_from(body, offset)
+            offset += _VALUE.size
+            values[FEATURE_NAMES.get(fid, 'id{}'.format(fid))] = value
+        records.append((base_time + time_offset / 1000.0, channel, values))
+    return records
+
+
+def block_values(features):
+    """
+    Name a feature vector from diagnosis.block_features (default bands) for
+    encoding.
+
+    Args:
+        features (sequence): The features in diagnosis.feature_names()
+            order.
+
+    Returns:
+        dict: Feature name to value.
+    """
+    return {name: float(value)
+            for name, value in zip(feature_names(), features)}
+
+
+class TelemetryBatcher(object):
+    """
+    Collect telemetry records and publish them as batched binary messages.
+
+    A batch is published when it holds max_records records, or interval
+    seconds after its first record.  The age is watched by a background
+    thread started with the first record, so sparse producers (one record
+    per interval) are not delayed until their next record.
+
+    Args:
+        publisher (MqttPublisher): The publisher used to send the batches.
+        topic (str): The MQTT topic of the batches.
+        interval (float): Maximum age in seconds of the oldest record before
+            the batch is published.
+        max_records (int): Publish as soon as this many records are queued.
+    """
+
+    def __init__(self, publisher, topic, interval=10.0, max_records=500):
+        self.publisher = publisher
+        self.topic = topic
+        self.interval = interval
+        self.max_records = max_records
+        self.batches = 0
+        self.bytes_sent = 0
+        self._records = []
+        self._first = None
+        self._cond = Condition()
+        self._running = True
+        self._thread = None
+
+    def add(self, channel, values, timestamp=None):
+        """
+        Add one record and publish the batch when it is due.
+
+        Args:
+            channel (int): The channel (or sensor index) of the values.
+            values (dict): Feature name to value.
+            timestamp (float): The time of the values (time.time() default).
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._cond:
+            if not self._records:
+                self._first = time.monotonic()
+                self._cond.notify()
+            self._records.append((timestamp, channel, values))
+            due = (len(self._records) >= self.max_records or
+                   time.monotonic() - self._first >= self.interval)
+            if self._thread is None and self._running:
+                self._thread = Thread(target=self._run,
+                                      name='telemetry-batcher', daemon=True)
+                self._thread.start()
+        if due:
+            self.flush()
+
+    def stop(self, timeout=5.0):
+        """
+        Stop the age timer and publish the queued records.
+
+        Args:
+            timeout (float): Maximum time to wait for the timer thread.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def flush(self):
+        """ Publish any queued records now. """
+        with self._cond:
+            records = self._records
+            self._records = []
+        if not records:
+            return
+        payload = encode(records)
+        self.publisher.publish(self.topic, payload)
+        self.batches += 1
+        self.bytes_sent += len(payload)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if not self._records:
+                        self._cond.wait()
+                        continue
+                    remaining = self._first + self.interval - \
+                        time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if not self._running:
+                    return
+            self.flush()
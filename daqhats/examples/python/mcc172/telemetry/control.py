@@ -0,0 +1,168 @@
+"""
+    MQTT control plane for acquisition parameters.
+
+    Commands are JSON objects published to the control topic, for example::
+
+        {"scan_rate": 25600, "channels": [0, 1], "iepe": 1,
+         "stream_channels": [1], "diagnosis_interval": 30,
+         "capture_rms": 0.5}
+
+    Any subset of the keys that the subscriber has defaults for may be
+    sent.  Commands are validated in the MQTT
+    network thread and queued; the acquisition loop picks them up between
+    blocks with :py:meth:`ControlSubscriber.take_changes`, so nothing is
+    changed in the middle of a read.  The accepted settings are published
+    (retained) on ``<topic>/state`` and rejected commands are reported on
+    ``<topic>/error``.
+"""
+import json
+import math
+from threading import Lock
+
+MCC172_CHANNELS = (0, 1)
+
+
+def _channel_list(value):
+    channels = sorted(set(int(chan) for chan in value))
+    if not set(channels).issubset(MCC172_CHANNELS):
+        raise ValueError('channels must be within {}'.format(
+            list(MCC172_CHANNELS)))
+    return channels
+
+
+def _scan_channels(value):
+    channels = _channel_list(value)
+    if not channels:
+        raise ValueError('at least one channel must be scanned')
+    return channels
+
+
+def _scan_rate(value):
+    rate = float(value)
+    if not 200.0 <= rate <= 51200.0:
+        raise ValueError('scan_rate must be 200 - 51200 S/s')
+    return rate
+
+
+def _iepe(value):
+    if int(value) not in (0, 1):
+        raise ValueError('iepe must be 0 or 1')
+    return int(value)
+
+
+def _interval(value):
+    interval = float(value)
+    if not math.isfinite(interval) or interval < 1.0:
+        raise ValueError('diagnosis_interval must be at least 1 s')
+    return interval
+
+
+def _depth(value):
+    depth = int(value)
+    if not 1 <= depth <= 4096:
+        raise ValueError('tsa_depth must be 1 - 4096 revolutions')
+    return depth
+
+
+def _threshold(value):
+    threshold = float(value)
+    if not math.isfinite(threshold) or threshold < 0.0:
+        raise ValueError('thresholds must be finite and not negative '
+                         '(0 disables)')
+    return threshold
+
+
+# Setting name -> validator returning the normalized value.
+VALIDATORS = {
+    'scan_rate': _scan_rate,
+    'channels': _scan_channels,
+    'iepe': _iepe,
+    'stream_channels': _channel_list,
+    'diagnosis_interval': _interval,
+    'capture_rms': _threshold,
+    'tsa_depth': _depth,
+    'tsa_publish': _threshold,
+    'psd_publish': _threshold,
+}
+
+# Settings that require the scan to be stopped and restarted.
+SCAN_SETTINGS = ('scan_rate', 'channels', 'iepe')
+
+
+class ControlSubscriber(object):
+    """
+    Receive acquisition commands over MQTT.
+
+    Args:
+        publisher (MqttPublisher): The shared MQTT connection.
+        topic (str): The control topic.
+        defaults (dict): The initial settings.  Only these settings can be
+            changed.
+    """
+
+    def __init__(self, publisher, topic, defaults):
+        self.publisher = publisher
+        self.topic = topic
+        self.settings = dict(defaults)
+        self.commands = 0
+        self.rejected = 0
+        self._changes = {}
+        self._lock = Lock()
+        publisher.subscribe(topic, self._on_message)
+
+    def publish_state(self):
+        """ Publish the current settings as a retained message. """
+        with self._lock:
+            state = json.dumps(self.settings)
+        self.publisher.publish(self.topic + '/state', state, qos=1,
+                               retain=True)
+
+    def submit(self, command):
+        """
+        Validate a command and queue its changes.
+
+        Args:
+            command (dict): Setting name to new value.
+
+        Raises:
+            ValueError: The command contains an unknown or invalid setting.
+        """
+        if not isinstance(command, dict):
+            raise ValueError('command must be a JSON object')
+        changes = {}
+        for name, value in command.items():
+            validator = VALIDATORS.get(name)
+            if validator is None or name not in self.settings:
+                raise ValueError('unknown setting: {}'.format(name))
+            try:
+                changes[name] = validator(value)
+            except (TypeError, OverflowError):
+                raise ValueError('invalid value for {}'.format(name))
+        with self._lock:
+            for name, value in changes.items():
+                if self.settings.get(name) != value:
+                    self._changes[name] = value
+                    self.settings[name] = value
+            self.commands += 1
+
+    def take_changes(self):
+        """
+        Return the settings changed since the last call.  Called by the
+        acquisition loop between blocks.
+
+        Returns:
+            dict: Setting name to new value; empty if nothing changed.
+        """
+        with self._lock:
+            changes = self._changes
+            self._changes = {}
+        return changes
+
+    def _on_message(self, _client, _userdata, message):
+        try:
+            self.submit(json.loads(message.payload.decode('utf-8')))
+        except ValueError as err:
+            self.rejected += 1
+            self.publisher.publish(self.topic + '/error', str(err))
+            return
+        self.publish_state()
@@ -0,0 +1,299 @@
+"""
+    Persistent MQTT publisher shared by the sensor services.
+
+    The paho network loop runs in a background thread (loop_start), so
+    keepalives, QoS retries and reconnects keep working while the acquisition
+    loop is busy.  Messages are handed to a bounded in-memory queue and sent
+    by a worker thread.  While the broker is unreachable, or when the queue
+    overflows, messages are appended to an on-disk spool that is replayed in
+    order once the connection is back.  A replay interrupted by a crash is
+    resumed on the next start, so spooled messages are delivered at least
+    once.
+"""
+import os
+import shutil
+import struct
+import time
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+from paho.mqtt import client as mqtt
+
+# Spool record header: topic length, payload length, qos, retain.
+_SPOOL_HEADER = struct.Struct('<HIBB')
+
+
+class MqttPublisher(object):
+    """
+    Queueing MQTT publisher with a background network thread.
+
+    Args:
+        broker (str): The broker host name or address.
+        client_id (str): The MQTT client id.
+        port (int): The broker port.
+        keepalive (int): The MQTT keepalive in seconds.
+        queue_size (int): Maximum number of messages held in memory.
+        spool_dir (str): Directory for the offline spool, or None to drop
+            messages that cannot be delivered.
+        spool_max_bytes (int): Maximum size of the spool file.
+        min_backoff (float): First reconnect delay in seconds.
+        max_backoff (float): Largest reconnect delay in seconds.
+    """
+
+    def __init__(self, broker, client_id, port=1883, keepalive=60,
+                 queue_size=1000, spool_dir=None, spool_max_bytes=64 << 20,
+                 min_backoff=1, max_backoff=60):
+        # pylint: disable=too-many-arguments
+        self.broker = broker
+        self.port = port
+        self.keepalive = keepalive
+        self.queue_size = queue_size
+        self.spool_max_bytes = spool_max_bytes
+
+        self._spool_path = None
+        if spool_dir is not None:
+            spool_dir = os.path.expanduser(spool_dir)
+            os.makedirs(spool_dir, exist_ok=True)
+            self._spool_path = os.path.join(spool_dir,
+                                            '{}.spool'.format(client_id))
+
+        self._queue = deque()
+        self._cond = Condition()
+        self._spool_lock = Lock()
+        self._connected = Event()
+        self._subscriptions = {}
+        self._running = False
+        self._worker = None
+
+        self.published = 0
+        self.spooled = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self._rate_start = time.monotonic()
+        self._rate_count = 0
+        self.publish_rate = 0.0
+
+        self.client = mqtt.Client(client_id=client_id)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.reconnect_delay_set(min_backoff, max_backoff)
+
+    def start(self):
+        """ Start the network loop and the publishing worker. """
+        if self._running:
+            return
+        self._recover_replay()
+        self._running = True
+        self.client.connect_async(self.broker, self.port, self.keepalive)
+        self.client.loop_start()
+        self._worker = Thread(target=self._run, name='mqtt-publisher',
+                              daemon=True)
+        self._worker.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Flush the queue (to the broker or the spool) and stop the threads.
+
+        Args:
+            timeout (float): Maximum time to wait for the worker.
+        """
+        if not self._running:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._worker.join(timeout)
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    @property
+    def connected(self):
+        """ True while the client is connected to the broker. """
+        return self._connected.is_set()
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """
+        Queue a message for publishing.  Never blocks the caller; when the
+        in-memory queue is full the oldest message is moved to the spool.
+
+        Args:
+            topic (str): The MQTT topic.
+            payload (str or bytes): The message payload.
+            qos (int): The MQTT quality of service.
+            retain (bool): The MQTT retain flag.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        overflow = None
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                overflow = self._queue.popleft()
+            self._queue.append((topic, bytes(payload), qos, retain))
+            self._cond.notify()
+        if overflow is not None:
+            self._spool([overflow])
+
+    def subscribe(self, topic, callback, qos=1):
+        """
+        Subscribe to a topic on the shared connection.  Subscriptions are
+        renewed after every reconnect.
+
+        Args:
+            topic (str): The MQTT topic filter.
+            callback (callable): Called from the network thread as
+                callback(client, userdata, message).
+            qos (int): The MQTT quality of service.
+        """
+        self._subscriptions[topic] = qos
+        self.client.message_callback_add(topic, callback)
+        if self.connected:
+            self.client.subscribe(topic, qos)
+
+    def metrics(self):
+        """
+        Return the publisher metrics.
+
+        Returns:
+            dict: connection state, queue depth, spool size, message counters
+            and the publish rate in messages per second.
+        """
+        return {
+            'connected': self.connected,
+            'queue_depth': len(self._queue),
+            'spool_bytes': self._spool_size(),
+            'published': self.published,
+            'spooled': self.spooled,
+            'dropped': self.dropped,
+            'reconnects': self.reconnects,
+            'publish_rate': self.publish_rate,
+        }
+
+    def _on_connect(self, _client, _userdata, _flags, result):
+        if result == 0:
+            for topic, qos in self._subscriptions.items():
+                self.client.subscribe(topic, qos)
+            self._connected.set()
+            with self._cond:
+                self._cond.notify()
+
+    def _on_disconnect(self, _client, _userdata, _result):
+        if self._connected.is_set():
+            self.reconnects += 1
+        self._connected.clear()
+
+    def _run(self):
+        """ Worker thread: send queued messages, spool them while offline. """
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait(1.0)
+                    if self.connected and self._spool_size():
+                        break
+                if not self._running and not self._queue:
+                    return
+                batch = list(self._queue)
+                self._queue.clear()
+
+            if not self.connected:
+                self._spool(batch)
+                if self._running:
+                    self._connected.wait(1.0)
+                continue
+
+            self._replay_spool()
+            self._send(batch)
+
+    def _send(self, batch):
+        """ Publish a batch, spooling whatever could not be handed over. """
+        for index, (topic, payload, qos, retain) in enumerate(batch):
+            info = self.client.publish(topic, payload, qos, retain)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self._spool(batch[index:])
+                return
+            self._count_published()
+
+    def _count_published(self):
+        self.published += 1
+        self._rate_count += 1
+        now = time.monotonic()
+        elapsed = now - self._rate_start
+        if elapsed >= 5.0:
+            self.publish_rate = self._rate_count / elapsed
+            self._rate_start = now
+            self._rate_count = 0
+
+    def _spool_size(self):
+        if self._spool_path is None:
+            return 0
+        try:
+            return os.path.getsize(self._spool_path)
+        except OSError:
+            return 0
+
+    def _spool(self, messages):
+        """ Append messages to the on-disk spool (or drop them). """
+        if self._spool_path is None:
+            self.dropped += len(messages)
+            return
+        with self._spool_lock:
+            size = self._spool_size()
+            with open(self._spool_path, 'ab') as spool:
+                for topic, payload, qos, retain in messages:
+                    topic = topic.encode('utf-8')
+                    record = _SPOOL_HEADER.pack(len(topic), len(payload),
+                                                qos, int(retain))
+                    length = len(record) + len(topic) + len(payload)
+                    if size + length > self.spool_max_bytes:
+                        self.dropped += 1
+                        continue
+                    spool.write(record + topic + payload)
+                    size += length
+                    self.spooled += 1
+
+    def _recover_replay(self):
+        """ Put a replay file left by a crash back in front of the spool. """
+        if self._spool_path is None:
+            return
+        replay_path = self._spool_path + '.replay'
+        with self._spool_lock:
+            if not os.path.exists(replay_path):
+                return
+            if os.path.exists(self._spool_path):
+                with open(replay_path, 'ab') as replay, \
+                        open(self._spool_path, 'rb') as spool:
+                    shutil.copyfileobj(spool, replay)
+            os.replace(replay_path, self._spool_path)
+
+    def _replay_spool(self):
+        """ Publish spooled messages in order, keeping any that fail. """
+        if not self._spool_size():
+            return
+        with self._spool_lock:
+            replay_path = self._spool_path + '.replay'
+            os.replace(self._spool_path, replay_path)
+        pending = []
+        with open(replay_path, 'rb') as spool:
+            while True:
+                header = spool.read(_SPOOL_HEADER.size)
+                if len(header) < _SPOOL_HEADER.size:
+                    break
+                topic_len, payload_len, qos, retain = \
+                    _SPOOL_HEADER.unpack(header)
+                topic = spool.read(topic_len)
+                payload = spool.read(payload_len)
+                if len(topic) < topic_len or len(payload) < payload_len:
+                    # A record cut short by a crash while spooling.
+                    break
+                topic = topic.decode('utf-8')
+                message = (topic, payload, qos, bool(retain))
+                if pending or not self.connected:
+                    pending.append(message)
+                    continue
+                info = self.client.publish(topic, payload, qos, retain)
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    pending.append(message)
+                else:
+                    self._count_published()
+        os.remove(replay_path)
+        if pending:
+            self.spooled -= len(pending)
+            self._spool(pending)
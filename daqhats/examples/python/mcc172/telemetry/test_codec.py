@@ -0,0 +1,105 @@
+"""
+    Tests of the binary telemetry encoding and the batcher.
+
+    Run from the mcc172 directory with ``python -m pytest telemetry`` or
+    ``python -m unittest telemetry.test_codec``.
+"""
+import time
+import unittest
+import numpy as np
+from diagnosis.features import feature_names
+from telemetry.codec import TelemetryBatcher, FEATURE_IDS, FLAG_ZLIB, \
+    block_values, decode, encode
+
+
+class _FakePublisher(object):
+    """ Keeps the published messages. """
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.messages.append((topic, payload))
+
+
+class CodecTest(unittest.TestCase):
+    """ encode -> decode of telemetry messages. """
+
+    def _round_trip(self, records):
+        decoded = decode(encode(records))
+        self.assertEqual(len(decoded), len(records))
+        for record, (time_out, channel_out, values_out) in zip(records,
+                                                               decoded):
+            timestamp, channel, values = record
+            self.assertAlmostEqual(time_out, timestamp, delta=0.0005)
+            self.assertEqual(channel_out, channel)
+            self.assertEqual(set(values_out), set(values))
+            for name, value in values.items():
+                self.assertEqual(values_out[name], np.float32(value))
+        return decoded
+
+    def test_empty(self):
+        self.assertEqual(decode(encode([])), [])
+
+    def test_round_trip(self):
+        self._round_trip([(1700000000.25, 0, {'rms': 0.125, 'peak': 1.5}),
+                          (1700000001.0, 1, {}),
+                          (1700000000.0, 255, {'temperature': -12.5})])
+
+    def test_compressed(self):
+        names = sorted(FEATURE_IDS)
+        records = [(1700000000.0 + i * 0.1, i % 2,
+                    {name: float(i) for name in names})
+                   for i in range(50)]
+        payload = encode(records)
+        self.assertTrue(payload[3] & FLAG_ZLIB)
+        self._round_trip(records)
+
+    def test_block_values(self):
+        features = np.arange(len(feature_names()), dtype=np.float64)
+        values = block_values(features)
+        self.assertEqual(list(values), feature_names())
+        self._round_trip([(1700000000.0, 0, values)])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            encode([(0.0, 0, {'no_such_feature': 1.0})])
+        payload = encode([(0.0, 0, {'rms': 1.0})])
+        for broken in (payload[:5], b'XX' + payload[2:],
+                       payload[:2] + b'\x09' + payload[3:]):
+            with self.assertRaises(ValueError):
+                decode(broken)
+
+
+class TelemetryBatcherTest(unittest.TestCase):
+    """ Batches are published on size and on age. """
+
+    def test_max_records(self):
+        publisher = _FakePublisher()
+        batcher = TelemetryBatcher(publisher, 'tm', interval=60.0,
+                                   max_records=3)
+        for i in range(7):
+            batcher.add(0, {'rms': float(i)}, timestamp=1000.0 + i)
+        self.assertEqual(len(publisher.messages), 2)
+        batcher.stop()
+        self.assertEqual([len(decode(payload))
+                          for _, payload in publisher.messages], [3, 3, 1])
+
+    def test_age_without_add(self):
+        # One record per interval must not wait for the next record.
+        publisher = _FakePublisher()
+        batcher = TelemetryBatcher(publisher, 'tm', interval=0.2)
+        batcher.add(1, {'rpm': 1500.0})
+        deadline = time.monotonic() + 5.0
+        while not publisher.messages and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(publisher.messages), 1)
+        records = decode(publisher.messages[0][1])
+        self.assertEqual(records[0][1:], (1, {'rpm': 1500.0}))
+        batcher.add(1, {'rpm': 1510.0})
+        batcher.stop()
+        self.assertEqual(len(publisher.messages), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+    Tests of the MQTT control command validation.
+
+    Run from the mcc172 directory with ``python -m pytest telemetry`` or
+    ``python -m unittest telemetry.test_control``.
+"""
+import unittest
+from telemetry.control import ControlSubscriber
+
+
+class _FakePublisher(object):
+    """ Keeps the subscriptions and published messages. """
+
+    def __init__(self):
+        self.subscriptions = {}
+        self.messages = []
+
+    def subscribe(self, topic, callback, qos=1):
+        self.subscriptions[topic] = (callback, qos)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.messages.append((topic, payload, qos, retain))
+
+
+DEFAULTS = {'scan_rate': 10240.0, 'channels': [0], 'iepe': 1,
+            'stream_channels': [0], 'diagnosis_interval': 60.0,
+            'capture_rms': 0.0, 'tsa_depth': 64, 'tsa_publish': 0.0,
+            'psd_publish': 0.0}
+
+
+class ControlTest(unittest.TestCase):
+    """ ControlSubscriber.submit and take_changes. """
+
+    def setUp(self):
+        self.control = ControlSubscriber(_FakePublisher(), 'motor/control',
+                                         DEFAULTS)
+
+    def test_changes(self):
+        self.control.submit({'scan_rate': '25600', 'channels': [1, 0, 1],
+                             'diagnosis_interval': 30})
+        self.assertEqual(self.control.take_changes(),
+                         {'scan_rate': 25600.0, 'channels': [0, 1],
+                          'diagnosis_interval': 30.0})
+        self.assertEqual(self.control.take_changes(), {})
+        # Unchanged values are not reported again.
+        self.control.submit({'scan_rate': 25600})
+        self.assertEqual(self.control.take_changes(), {})
+
+    def test_rejected(self):
+        for command in ({'diagnosis_interval': float('nan')},
+                        {'diagnosis_interval': float('inf')},
+                        {'psd_publish': 'nan'}, {'capture_rms': '-inf'},
+                        {'tsa_publish': float('inf')},
+                        {'tsa_depth': float('inf')},
+                        {'scan_rate': float('nan')}, {'scan_rate': 100},
+                        {'channels': []}, {'channels': [2]}, {'iepe': 2},
+                        {'unknown': 1}, [1]):
+            with self.subTest(command=command):
+                with self.assertRaises(ValueError):
+                    self.control.submit(command)
+        self.assertEqual(self.control.take_changes(), {})
+        self.assertEqual(self.control.settings, DEFAULTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+    Tests of the MQTT publisher spool.
+
+    Run from the mcc172 directory with ``python -m pytest telemetry`` or
+    ``python -m unittest telemetry.test_publisher``.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from paho.mqtt import client as mqtt
+from telemetry.publisher import MqttPublisher
+
+
+class _Info(object):
+    rc = mqtt.MQTT_ERR_SUCCESS
+
+
+class _FakeClient(object):
+    """ Accepts every publish and keeps the messages. """
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.messages.append((topic, payload, qos, retain))
+        return _Info()
+
+
+class SpoolTest(unittest.TestCase):
+    """ Spooled messages survive an interrupted replay. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.publisher = MqttPublisher('localhost', 'node',
+                                       spool_dir=self.directory)
+        self.client = _FakeClient()
+        self.publisher.client = self.client
+        self.publisher._connected.set()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _messages(self, first, count):
+        return [('t/{}'.format(i), 'm{}'.format(i).encode(), 1, False)
+                for i in range(first, first + count)]
+
+    def test_replay(self):
+        self.publisher._spool(self._messages(0, 5))
+        self.publisher._replay_spool()
+        self.assertEqual(self.client.messages, self._messages(0, 5))
+        self.assertEqual(self.publisher.metrics()['spool_bytes'], 0)
+
+    def test_leftover_replay_first(self):
+        # A crash during a replay left the older messages in the .replay
+        # file; newer ones were spooled after the restart.
+        spool_path = os.path.join(self.directory, 'node.spool')
+        self.publisher._spool(self._messages(0, 3))
+        os.replace(spool_path, spool_path + '.replay')
+        self.publisher._spool(self._messages(3, 2))
+        # The last record of the spool was cut short by a crash.
+        with open(spool_path, 'ab') as spool:
+            spool.write(b'\x03\x00\x10\x00\x00\x00\x01\x00t/x')
+
+        self.publisher._recover_replay()
+        self.assertFalse(os.path.exists(spool_path + '.replay'))
+        self.publisher._replay_spool()
+        self.assertEqual(self.client.messages, self._messages(0, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
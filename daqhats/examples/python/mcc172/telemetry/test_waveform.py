@@ -0,0 +1,90 @@
+"""
+    Tests of the decimated waveform streaming.
+
+    Run from the mcc172 directory with ``python -m pytest telemetry`` or
+    ``python -m unittest telemetry.test_waveform``.
+"""
+import unittest
+import numpy as np
+from telemetry.waveform import Decimator, WaveformStreamer, FORMAT_FLOAT32, \
+    decode_chunk
+
+
+class _FakePublisher(object):
+    """ Keeps the published messages. """
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.messages.append((topic, payload))
+
+
+def _tones(frequencies, num_samples, scan_rate):
+    t = np.arange(num_samples) / scan_rate
+    return np.array([np.sin(2 * np.pi * f * t) for f in frequencies])
+
+
+class DecimatorTest(unittest.TestCase):
+    """ Decimator filtering and block continuity. """
+
+    def test_blocks_match_one_pass(self):
+        signal = np.random.default_rng(0).normal(size=(2, 10007))
+        whole = Decimator(2, 8).process(signal)
+        decimator = Decimator(2, 8)
+        parts = [decimator.process(signal[:, start:start + size])
+                 for start, size in ((0, 1), (1, 999), (1000, 4093),
+                                     (5093, 4914))]
+        np.testing.assert_allclose(np.concatenate(parts, axis=1), whole)
+        self.assertEqual(whole.shape[1], -(-10007 // 8))
+
+    def test_anti_aliasing(self):
+        scan_rate, factor = 10240.0, 8
+        # 100 Hz passes; 1100 Hz (above the 640 Hz output Nyquist) would
+        # alias to 180 Hz and is suppressed.
+        out = Decimator(2, factor).process(
+            _tones((100.0, 1100.0), 20480, scan_rate))[:, 200:]
+        self.assertAlmostEqual(np.sqrt(2 * np.mean(out[0] ** 2)), 1.0,
+                               delta=0.02)
+        self.assertLess(np.max(np.abs(out[1])), 0.01)
+
+
+class WaveformStreamerTest(unittest.TestCase):
+    """ Chunks of the enabled channels. """
+
+    def test_channel_numbers(self):
+        publisher = _FakePublisher()
+        scan_rate = 10240.0
+        streamer = WaveformStreamer(publisher, 'wave', scan_rate, 2,
+                                    channel_numbers=[0, 1], budget=20000.0,
+                                    interval=1e6,
+                                    sample_format=FORMAT_FLOAT32)
+        # Only the second row (channel 1) is streamed.
+        streamer.channels = {1}
+        block = _tones((50.0, 100.0), 20480, scan_rate)
+        for start in range(0, 20480, 5120):
+            streamer.push(block[:, start:start + 5120])
+            streamer.flush()
+        self.assertEqual(streamer._decimator._history.shape[0], 1)
+
+        self.assertEqual({topic for topic, _ in publisher.messages},
+                         {'wave/1'})
+        chunks = [decode_chunk(payload) for _, payload in publisher.messages]
+        self.assertEqual([chunk['channel'] for chunk in chunks], [1] * 4)
+        self.assertEqual([chunk['sequence'] for chunk in chunks],
+                         [0, 1, 2, 3])
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertEqual(chunk['sample_index'],
+                             previous['sample_index'] +
+                             len(previous['samples']) * streamer.factor)
+        samples = np.concatenate([chunk['samples'] for chunk in chunks])
+        expected = block[1, ::streamer.factor]
+        # The FIR delay is half its length.
+        delay = (len(streamer._decimator.taps) - 1) // 2 // streamer.factor
+        np.testing.assert_allclose(samples[delay + 10:],
+                                   expected[10:len(samples) - delay],
+                                   atol=0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
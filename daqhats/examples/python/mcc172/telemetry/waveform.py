@@ -0,0 +1,280 @@
+"""
+    Decimated live waveform streaming over MQTT.
+
+    Each channel is low-pass filtered and decimated with a windowed-sinc FIR
+    so the stream stays under a per-device bandwidth budget.  Every chunk also
+    carries min/max envelopes of the full-rate signal, so impacts removed by
+    the anti-aliasing filter are still visible to the operator.  Chunks have a
+    per-channel sequence number and the raw sample index of their first
+    sample, which lets subscribers detect and place gaps.
+
+    Chunk layout (little endian, version 1)::
+
+        magic 'WF' | version u8 | channel u8 | format u8 | reserved u8 |
+        sequence u32 | sample index u64 | output rate f32 | scale f32 |
+        samples u16 | envelope bins u16 | samples | envelope min | envelope max
+
+    With FORMAT_INT16 the values are int16 multiplied by scale, with
+    FORMAT_FLOAT32 they are float32 and scale is 1.
+"""
+import math
+import struct
+import time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+WAVEFORM_VERSION = 1
+FORMAT_INT16 = 0
+FORMAT_FLOAT32 = 1
+
+_CHUNK_HEADER = struct.Struct('<2sBBBBIQffHH')
+_FORMAT_BYTES = {FORMAT_INT16: 2, FORMAT_FLOAT32: 4}
+
+_FILTERS = {}
+
+
+def lowpass_taps(factor, taps_per_phase=16):
+    """
+    Return (and cache) a Hamming windowed-sinc anti-aliasing filter for a
+    decimation factor.
+
+    Args:
+        factor (int): The decimation factor.
+        taps_per_phase (int): Filter length per output sample.
+
+    Returns:
+        numpy.ndarray: The filter taps with unity DC gain.
+    """
+    key = (factor, taps_per_phase)
+    taps = _FILTERS.get(key)
+    if taps is None:
+        num_taps = factor * taps_per_phase + 1
+        cutoff = 0.8 * 0.5 / factor
+        n = np.arange(num_taps) - (num_taps - 1) / 2.0
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+        taps /= taps.sum()
+        _FILTERS[key] = taps
+    return taps
+
+
+class Decimator(object):
+    """
+    Stateful multi-channel FIR decimator.  Filter history and output phase
+    are carried across blocks, so consecutive blocks decimate as one
+    continuous signal.
+
+    Args:
+        num_channels (int): The number of channels.
+        factor (int): The decimation factor (1 passes data through).
+    """
+
+    def __init__(self, num_channels, factor):
+        self.factor = factor
+        self.taps = lowpass_taps(factor) if factor > 1 else np.ones(1)
+        self._history = np.zeros((num_channels, len(self.taps) - 1))
+        self._phase = 0
+
+    @property
+    def phase(self):
+        """ The position in the next block of its first output sample. """
+        return self._phase
+
+    def process(self, block):
+        """
+        Filter and decimate a block.
+
+        Args:
+            block (numpy.ndarray): Samples shaped (channels, samples).
+
+        Returns:
+            numpy.ndarray: Decimated samples shaped (channels, outputs).
+        """
+        if self.factor == 1:
+            return np.array(block, dtype=np.float64)
+        buf = np.concatenate((self._history, block), axis=1)
+        windows = sliding_window_view(buf, len(self.taps), axis=1)
+        out = windows[:, self._phase::self.factor, :] @ self.taps[::-1]
+        self._phase = (self._phase - block.shape[1]) % self.factor
+        self._history = buf[:, buf.shape[1] - self._history.shape[1]:]
+        return out
+
+
+def decode_chunk(payload):
+    """
+    Decode a waveform chunk.
+
+    Args:
+        payload (bytes): The MQTT message payload.
+
+    Returns:
+        dict: channel, sequence, sample_index, rate, samples, env_min and
+        env_max (NumPy float arrays).
+
+    Raises:
+        ValueError: The payload is not a supported waveform chunk.
+    """
+    (magic, version, channel, fmt, _reserved, sequence, sample_index, rate,
+     scale, num_samples, num_bins) = _CHUNK_HEADER.unpack_from(payload)
+    if magic != b'WF' or version != WAVEFORM_VERSION:
+        raise ValueError('Not a supported waveform chunk')
+    dtype = np.int16 if fmt == FORMAT_INT16 else np.float32
+    values = np.frombuffer(payload, dtype=dtype, offset=_CHUNK_HEADER.size,
+                           count=num_samples + 2 * num_bins)
+    values = values.astype(np.float64) * scale
+    return {
+        'channel': channel,
+        'sequence': sequence,
+        'sample_index': sample_index,
+        'rate': rate,
+        'samples': values[:num_samples],
+        'env_min': values[num_samples:num_samples + num_bins],
+        'env_max': values[num_samples + num_bins:],
+    }
+
+
+class WaveformStreamer(object):
+    """
+    Publish decimated waveform chunks and envelopes for each channel.
+
+    Topics are ``<topic>/<channel>``.  Only the enabled rows (see
+    :py:attr:`channels`) are filtered and decimated.
+
+    Args:
+        publisher (MqttPublisher): The publisher used to send the chunks.
+        topic (str): The topic prefix.
+        scan_rate (float): The acquisition rate in Hz.
+        num_channels (int): The number of channels in the pushed blocks.
+        channel_numbers (list[int]): Channel numbers used in the topics and
+            chunk headers, in row order (0, 1, ... by default).
+        budget (float): Bandwidth budget for all channels in bytes/second.
+        interval (float): Seconds of signal per chunk.
+        envelope_bins (int): Min/max envelope bins per chunk.
+        sample_format (int): FORMAT_INT16 or FORMAT_FLOAT32.
+        max_rate (float): Optional upper limit of the output rate in Hz.
+    """
+
+    def __init__(self, publisher, topic, scan_rate, num_channels,
+                 channel_numbers=None, budget=20000.0, interval=1.0,
+                 envelope_bins=100, sample_format=FORMAT_INT16,
+                 max_rate=None):
+        # pylint: disable=too-many-arguments
+        self.publisher = publisher
+        self.topic = topic
+        self.scan_rate = scan_rate
+        self.num_channels = num_channels
+        self.channel_numbers = list(range(num_channels)) \
+            if channel_numbers is None else list(channel_numbers)
+        self.interval = interval
+        self.envelope_bins = envelope_bins
+        self.sample_format = sample_format
+        # Row positions of the channels that are published.
+        self.channels = set(range(num_channels))
+        self.chunks_sent = 0
+        self.bytes_sent = 0
+        self._sequence = [0] * num_channels
+        self._raw_index = 0
+        self._first_index = None
+        self._rows = list(range(num_channels))
+        self._pending = []
+        self._pending_raw = []
+        self._started = time.monotonic()
+
+        self.factor = self.choose_factor(budget, max_rate)
+        self.rate = scan_rate / self.factor
+        self._decimator = Decimator(num_channels, self.factor)
+
+    def choose_factor(self, budget, max_rate=None):
+        """
+        Return the smallest decimation factor that keeps all channels within
+        the bandwidth budget.
+
+        Args:
+            budget (float): Bandwidth budget in bytes/second.
+            max_rate (float): Optional upper limit of the output rate in Hz.
+
+        Returns:
+            int: The decimation factor.
+
+        Raises:
+            ValueError: The budget cannot even cover headers and envelopes.
+        """
+        sample_bytes = _FORMAT_BYTES[self.sample_format]
+        overhead = (_CHUNK_HEADER.size + 2 * self.envelope_bins *
+                    sample_bytes) / self.interval
+        per_channel = budget / self.num_channels - overhead
+        if per_channel <= 0:
+            raise ValueError('Waveform budget too small for {} channels'
+                             .format(self.num_channels))
+        factor = max(1, int(math.ceil(self.scan_rate * sample_bytes /
+                                      per_channel)))
+        if max_rate:
+            factor = max(factor, int(math.ceil(self.scan_rate / max_rate)))
+        # The chunk header counts samples with 16 bits.
+        factor = max(factor, int(math.ceil(self.scan_rate * self.interval /
+                                           65535)))
+        return factor
+
+    def push(self, block):
+        """
+        Add a block of samples and publish a chunk when one is complete.
+
+        Args:
+            block (numpy.ndarray): Samples shaped (channels, samples).
+        """
+        block = np.asarray(block, dtype=np.float64)
+        rows = sorted(self.channels)
+        if rows != self._rows:
+            # Filter state of the newly enabled rows starts from zero.
+            self.flush()
+            self._rows = rows
+            self._decimator = Decimator(len(rows), self.factor)
+        if self._first_index is None:
+            self._first_index = self._raw_index + self._decimator.phase
+        selected = block[rows]
+        self._pending.append(self._decimator.process(selected))
+        self._pending_raw.append(selected)
+        self._raw_index += block.shape[1]
+        if time.monotonic() - self._started >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """ Publish the pending chunk for every enabled channel. """
+        self._started = time.monotonic()
+        if not self._pending:
+            return
+        decimated = np.concatenate(self._pending, axis=1)
+        raw = np.concatenate(self._pending_raw, axis=1)
+        self._pending = []
+        self._pending_raw = []
+        first_index = self._first_index
+        self._first_index = None
+
+        bins = min(self.envelope_bins, raw.shape[1])
+        edges = np.linspace(0, raw.shape[1], bins + 1).astype(int)[:-1]
+        env_min = np.minimum.reduceat(raw, edges, axis=1)
+        env_max = np.maximum.reduceat(raw, edges, axis=1)
+
+        for i, row in enumerate(self._rows):
+            channel = self.channel_numbers[row]
+            payload = self._pack(row, channel, first_index, decimated[i],
+                                 env_min[i], env_max[i])
+            self.publisher.publish('{}/{}'.format(self.topic, channel),
+                                   payload)
+            self.chunks_sent += 1
+            self.bytes_sent += len(payload)
+
+    def _pack(self, row, channel, sample_index, samples, env_min, env_max):
+        values = np.concatenate((samples, env_min, env_max))
+        if self.sample_format == FORMAT_INT16:
+            peak = np.max(np.abs(values)) if values.size else 0.0
+            scale = peak / 32767.0 if peak > 0 else 1.0
+            data = np.round(values / scale).astype('<i2')
+        else:
+            scale = 1.0
+            data = values.astype('<f4')
+        header = _CHUNK_HEADER.pack(
+            b'WF', WAVEFORM_VERSION, channel, self.sample_format, 0,
+            self._sequence[row], sample_index, self.rate, scale,
+            len(samples), len(env_min))
+        self._sequence[row] = (self._sequence[row] + 1) & 0xFFFFFFFF
+        return header + data.tobytes()
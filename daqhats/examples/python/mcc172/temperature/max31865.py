@@ -0,0 +1,212 @@
+"""
+    MAX31865 RTD converter on the kernel SPI driver.
+
+    Every register access is one ``spidev`` ``xfer2`` transaction; reading a
+    sensor transfers the RTD and fault status registers (0x01 - 0x07) in a
+    single 8 byte transfer.  The converters run in continuous auto-conversion
+    mode (a new result every 21 ms at 50 Hz filtering, 17 ms at 60 Hz), so a
+    read returns the latest conversion without the 100 ms one-shot wait.
+    Codes are converted with the cached lookup table of
+    :py:mod:`temperature.pt100_table`.
+
+    Sensors on the SPI chip selects are opened as /dev/spidev<bus>.<device>.
+    More sensors than the bus has chip selects can share one spidev device
+    with a GPIO pin as chip select each.
+"""
+import math
+from temperature.pt100_table import lookup_table, CODES
+
+_REG_CONFIG = 0x00
+_REG_RTD = 0x01
+_WRITE = 0x80
+
+CONFIG_BIAS = 0x80
+CONFIG_AUTO = 0x40
+CONFIG_ONE_SHOT = 0x20
+CONFIG_3WIRE = 0x10
+CONFIG_FAULT_CLEAR = 0x02
+CONFIG_50HZ = 0x01
+
+FAULT_HIGH = 0x80
+FAULT_LOW = 0x40
+FAULT_REFIN_HIGH = 0x20
+FAULT_REFIN_LOW = 0x10
+FAULT_RTDIN_LOW = 0x08
+FAULT_VOLTAGE = 0x04
+
+_FAULT_TEXT = (
+    (FAULT_HIGH, 'High threshold limit (Cable fault/open)'),
+    (FAULT_LOW, 'Low threshold limit (Cable fault/short)'),
+    (FAULT_REFIN_HIGH, 'REFIN- > 0.85 x VBias'),
+    (FAULT_REFIN_LOW, 'REFIN- < 0.85 x VBias (FORCE- open)'),
+    (FAULT_RTDIN_LOW, 'RTDIN- < 0.85 x VBias (FORCE- open)'),
+    (FAULT_VOLTAGE, 'Overvoltage or Undervoltage Error'),
+)
+
+
+class FaultError(Exception):
+    """ The converter reported an RTD or wiring fault. """
+
+    def __init__(self, status):
+        self.status = status
+        message = '; '.join(text for bit, text in _FAULT_TEXT
+                            if status & bit)
+        super(FaultError, self).__init__(
+            message or 'Fault status 0x{:02x}'.format(status))
+
+
+class MAX31865(object):
+    """
+    One MAX31865 converter.
+
+    Args:
+        bus (int): The SPI bus number.
+        device (int): The chip select (spidev device) number.
+        wires (int): 2, 3 or 4 wire RTD connection.
+        filter_50hz (bool): Reject 50 Hz instead of 60 Hz mains noise.
+        r_ref (float): The reference resistor in ohms.
+        r0 (float): The RTD resistance at 0 degC (100 for a PT100).
+        cs_pin (int): A BCM GPIO pin used as chip select instead of the
+            device's own, for more sensors than chip selects.
+        spi (spidev.SpiDev): An open device to share (with cs_pin).
+        max_speed_hz (int): The SPI clock (the MAX31865 allows 5 MHz).
+    """
+
+    def __init__(self, bus=0, device=0, wires=3, filter_50hz=False,
+                 r_ref=430.0, r0=100.0, cs_pin=None, spi=None,
+                 max_speed_hz=1000000):
+        # pylint: disable=too-many-arguments
+        self.table = lookup_table(r_ref, r0)
+        self.cs_pin = cs_pin
+        self.config = CONFIG_BIAS | CONFIG_AUTO | \
+            (CONFIG_3WIRE if wires == 3 else 0) | \
+            (CONFIG_50HZ if filter_50hz else 0)
+        self._own_spi = spi is None
+        if spi is None:
+            import spidev
+            spi = spidev.SpiDev()
+            spi.open(bus, device)
+            if cs_pin is not None:
+                spi.no_cs = True
+        self._spi = spi
+        self._spi.max_speed_hz = max_speed_hz
+        # The MAX31865 samples on the falling edge (CPHA = 1).
+        self._spi.mode = 1
+        self._gpio = None
+        if cs_pin is not None:
+            import RPi.GPIO as GPIO
+            self._gpio = GPIO
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setup(cs_pin, GPIO.OUT, initial=GPIO.HIGH)
+
+    def start(self):
+        """
+        Clear faults and start continuous conversion (config 0xD2 for a 3
+        wire PT100 with 60 Hz filtering).  The first result is ready about
+        65 ms later.
+        """
+        self.write_register(_REG_CONFIG, self.config | CONFIG_FAULT_CLEAR)
+
+    def stop(self):
+        """ Stop converting and turn off the RTD bias current. """
+        self.write_register(_REG_CONFIG, self.config &
+                            ~(CONFIG_BIAS | CONFIG_AUTO))
+
+    def close(self):
+        """ Stop and release the SPI device and chip select pin. """
+        self.stop()
+        if self._own_spi:
+            self._spi.close()
+        if self._gpio is not None:
+            self._gpio.cleanup(self.cs_pin)
+
+    def write_register(self, register, value):
+        """ Write one register in one transaction. """
+        self._transfer([_WRITE | register, value & 0xff])
+
+    def read_registers(self, register, count):
+        """ Read consecutive registers in one transaction. """
+        return self._transfer([register] + [0] * count)[1:]
+
+    def read_code(self):
+        """
+        Read the latest conversion.
+
+        Returns:
+            int: The 15-bit RTD code.
+
+        Raises:
+            FaultError: The fault bit is set; the fault status is cleared
+                so the next conversion can succeed.
+        """
+        rtd_msb, rtd_lsb, _hft_msb, _hft_lsb, _lft_msb, _lft_lsb, status = \
+            self.read_registers(_REG_RTD, 7)
+        if rtd_lsb & 0x01:
+            self.write_register(_REG_CONFIG, self.config | CONFIG_FAULT_CLEAR)
+            raise FaultError(status)
+        return ((rtd_msb << 8) | rtd_lsb) >> 1
+
+    def read(self):
+        """
+        Read the temperature in degC; see :py:meth:`read_code`.
+
+        Raises:
+            FaultError: The fault bit is set, or the code is outside -200 to
+                850 degC (open or shorted RTD) without the fault bit.
+        """
+        code = self.read_code()
+        temperature = self.table.temperature(code)
+        if math.isnan(temperature):
+            resistance = code * self.table.r_ref / CODES
+            raise FaultError(FAULT_HIGH if resistance > self.table.r0
+                             else FAULT_LOW)
+        return temperature
+
+    def _transfer(self, data):
+        if self._gpio is None:
+            return self._spi.xfer2(data)
+        self._gpio.output(self.cs_pin, self._gpio.LOW)
+        try:
+            return self._spi.xfer2(data)
+        finally:
+            self._gpio.output(self.cs_pin, self._gpio.HIGH)
+
+
+class SensorGroup(object):
+    """
+    Poll several MAX31865 converters in one pass.
+
+    Args:
+        sensors (list[MAX31865]): The converters, in channel order.
+    """
+
+    def __init__(self, sensors):
+        self.sensors = list(sensors)
+        self.faults = [0] * len(self.sensors)
+
+    def start(self):
+        """ Start continuous conversion on every converter. """
+        for sensor in self.sensors:
+            sensor.start()
+
+    def close(self):
+        """ Stop and release every converter. """
+        for sensor in self.sensors:
+            sensor.close()
+
+    def read(self):
+        """
+        Read every converter once.
+
+        Returns:
+            list: The temperature in degC per sensor, or None for a sensor
+            that reported a fault (counted in :py:attr:`faults`).
+        """
+        values = []
+        for index, sensor in enumerate(self.sensors):
+            try:
+                values.append(sensor.read())
+            except FaultError:
+                self.faults[index] += 1
+                values.append(None)
+        return values
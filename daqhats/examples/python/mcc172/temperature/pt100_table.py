@@ -0,0 +1,171 @@
+"""
+    PT100 temperature lookup table.
+
+    The MAX31865 returns a 15-bit code, so there are only 32768 possible
+    readings.  The temperature of every code is calculated once with the
+    full Callendar-Van Dusen equation (IEC 60751)::
+
+        R(T) = R0 (1 + A T + B T^2)                   0 <= T <= 850 degC
+        R(T) = R0 (1 + A T + B T^2 + C (T - 100) T^3)  -200 <= T < 0 degC
+
+    The positive branch is solved exactly with the quadratic formula, the
+    negative branch with vectorized Newton iterations started from the
+    quadratic solution.  The table is cached as a .npy file, so a reading
+    is an O(1) array lookup and many readings convert in one indexing
+    operation.  Codes outside -200 to 850 degC (a broken or shorted RTD)
+    convert to NaN.
+"""
+import os
+import numpy as np
+
+CVD_A = 3.9083e-3
+CVD_B = -5.775e-7
+CVD_C = -4.183e-12
+
+T_MIN = -200.0
+T_MAX = 850.0
+
+CODES = 1 << 15
+
+# Increase when the calculation changes, to rebuild cached tables.
+TABLE_VERSION = 1
+
+DEFAULT_CACHE_DIR = '~/.cache/pt100'
+
+_TABLES = {}
+
+
+def cvd_resistance(temperature, r0=100.0):
+    """
+    Return the RTD resistance at a temperature.
+
+    Args:
+        temperature (numpy.ndarray): Temperatures in degC.
+        r0 (float): The resistance at 0 degC.
+
+    Returns:
+        numpy.ndarray: Resistances in ohms.
+    """
+    t = np.asarray(temperature, dtype=np.float64)
+    cubic = np.where(t < 0.0, CVD_C * (t - 100.0) * t ** 3, 0.0)
+    return r0 * (1.0 + CVD_A * t + CVD_B * t * t + cubic)
+
+
+def cvd_temperature(resistance, r0=100.0, iterations=6):
+    """
+    Invert the Callendar-Van Dusen equation.
+
+    Args:
+        resistance (numpy.ndarray): Resistances in ohms, or one resistance.
+        r0 (float): The resistance at 0 degC.
+        iterations (int): Newton iterations below 0 degC.
+
+    Returns:
+        numpy.ndarray: Temperatures in degC, NaN outside -200 to 850 degC;
+        a float for a scalar resistance.
+    """
+    scalar = np.ndim(resistance) == 0
+    ratio = np.atleast_1d(np.asarray(resistance, dtype=np.float64)) / r0
+    with np.errstate(invalid='ignore'):
+        t = (-CVD_A + np.sqrt(CVD_A * CVD_A - 4.0 * CVD_B * (1.0 - ratio))) \
+            / (2.0 * CVD_B)
+    negative = ratio < 1.0
+    tn = t[negative]
+    rn = ratio[negative]
+    for _i in range(iterations):
+        value = 1.0 + CVD_A * tn + CVD_B * tn * tn + \
+            CVD_C * (tn - 100.0) * tn ** 3 - rn
+        slope = CVD_A + 2.0 * CVD_B * tn + \
+            CVD_C * (4.0 * tn ** 3 - 300.0 * tn * tn)
+        tn = tn - value / slope
+    t[negative] = tn
+    # Half a degree of margin keeps the codes next to the limits.
+    t[(t < T_MIN - 0.5) | (t > T_MAX + 0.5) | ~np.isfinite(t)] = np.nan
+    return float(t[0]) if scalar else t
+
+
+def build_table(r_ref=430.0, r0=100.0):
+    """
+    Calculate the temperature of every MAX31865 code.
+
+    Args:
+        r_ref (float): The reference resistor in ohms.
+        r0 (float): The RTD resistance at 0 degC.
+
+    Returns:
+        numpy.ndarray: float32 temperatures indexed by code.
+    """
+    resistance = np.arange(CODES) * (r_ref / CODES)
+    return cvd_temperature(resistance, r0).astype(np.float32)
+
+
+class PT100Table(object):
+    """
+    Code to temperature lookup for one reference resistor and RTD.
+
+    Args:
+        r_ref (float): The reference resistor in ohms.
+        r0 (float): The RTD resistance at 0 degC (100 for a PT100).
+        cache_dir (str): Directory of the cached tables, or None to always
+            calculate the table.
+    """
+
+    def __init__(self, r_ref=430.0, r0=100.0, cache_dir=DEFAULT_CACHE_DIR):
+        self.r_ref = r_ref
+        self.r0 = r0
+        self.table = None
+        if cache_dir is not None:
+            path = os.path.join(
+                os.path.expanduser(cache_dir),
+                'pt100_v{}_{:g}_{:g}.npy'.format(TABLE_VERSION, r_ref, r0))
+            self.table = self._load(path)
+        if self.table is None:
+            self.table = build_table(r_ref, r0)
+            if cache_dir is not None:
+                self._save(path)
+
+    def temperature(self, code):
+        """ Return the temperature in degC of one code. """
+        return float(self.table[code])
+
+    def convert(self, codes):
+        """
+        Convert many codes at once.
+
+        Args:
+            codes (numpy.ndarray): 15-bit RTD codes.
+
+        Returns:
+            numpy.ndarray: float32 temperatures in degC.
+        """
+        return self.table[np.asarray(codes, dtype=np.intp)]
+
+    @staticmethod
+    def _load(path):
+        try:
+            table = np.load(path)
+        except (OSError, ValueError):
+            return None
+        if table.shape != (CODES,) or table.dtype != np.float32:
+            return None
+        return table
+
+    def _save(self, path):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp = path + '.{}.tmp'.format(os.getpid())
+            with open(temp, 'wb') as tablefile:
+                np.save(tablefile, self.table)
+            os.replace(temp, path)
+        except OSError:
+            # A read-only home only costs the calculation at every start.
+            pass
+
+
+def lookup_table(r_ref=430.0, r0=100.0):
+    """ Return the shared table of a reference resistor and RTD. """
+    key = (r_ref, r0)
+    table = _TABLES.get(key)
+    if table is None:
+        table = _TABLES[key] = PT100Table(r_ref, r0)
+    return table
@@ -0,0 +1,84 @@
+"""
+    Tests of the PT100 conversion and the MAX31865 fault handling.
+
+    Run from the mcc172 directory with ``python -m pytest temperature`` or
+    ``python -m unittest temperature.test_pt100``.
+"""
+import unittest
+import numpy as np
+from temperature import pt100_table
+from temperature.pt100_table import PT100Table, CODES, cvd_resistance, \
+    cvd_temperature
+from temperature.max31865 import MAX31865, FaultError, FAULT_HIGH, FAULT_LOW
+
+
+class _FakeSpi(object):
+    """ Returns one RTD code from every register read. """
+
+    def __init__(self):
+        self.code = 0
+        self.writes = []
+
+    def xfer2(self, data):
+        if data[0] & 0x80:
+            self.writes.append(list(data))
+            return [0] * len(data)
+        rtd = self.code << 1
+        return [0, rtd >> 8, rtd & 0xff, 0, 0, 0, 0, 0][:len(data)]
+
+    def close(self):
+        pass
+
+
+class CallendarVanDusenTest(unittest.TestCase):
+    """ cvd_temperature inverts cvd_resistance. """
+
+    def test_round_trip(self):
+        temperatures = np.linspace(-200.0, 850.0, 2101)
+        np.testing.assert_allclose(
+            cvd_temperature(cvd_resistance(temperatures)), temperatures,
+            atol=1e-6)
+
+    def test_scalar(self):
+        self.assertIsInstance(cvd_temperature(100.0), float)
+        self.assertAlmostEqual(cvd_temperature(100.0), 0.0, places=9)
+        self.assertAlmostEqual(cvd_temperature(cvd_resistance(-150.0)),
+                               -150.0, places=6)
+        self.assertTrue(np.isnan(cvd_temperature(0.0)))
+        self.assertTrue(np.isnan(cvd_temperature(500.0)))
+
+    def test_table(self):
+        table = PT100Table(cache_dir=None)
+        codes = np.array([7621, 9000, 20000])
+        expected = cvd_temperature(codes * (430.0 / CODES))
+        np.testing.assert_allclose(table.convert(codes), expected,
+                                   rtol=1e-6)
+        self.assertTrue(np.isnan(table.temperature(0)))
+        self.assertTrue(np.isnan(table.temperature(CODES - 1)))
+
+
+class Max31865Test(unittest.TestCase):
+    """ Open and shorted RTDs raise FaultError. """
+
+    def setUp(self):
+        # Keep the test table out of the user's cache directory.
+        pt100_table._TABLES[(430.0, 100.0)] = PT100Table(cache_dir=None)
+        self.addCleanup(pt100_table._TABLES.pop, (430.0, 100.0), None)
+        self.spi = _FakeSpi()
+        self.sensor = MAX31865(spi=self.spi)
+
+    def test_read(self):
+        # 100 ohm is 0 degC.
+        self.spi.code = int(round(100.0 / 430.0 * CODES))
+        self.assertAlmostEqual(self.sensor.read(), 0.0, delta=0.1)
+
+    def test_out_of_range(self):
+        for code, status in ((0, FAULT_LOW), (CODES - 1, FAULT_HIGH)):
+            self.spi.code = code
+            with self.assertRaises(FaultError) as raised:
+                self.sensor.read()
+            self.assertEqual(raised.exception.status, status)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+    Tests of the periodic task scheduler.
+
+    Run from the mcc172 directory with ``python -m pytest test_scheduler.py``
+    or ``python -m unittest test_scheduler``.
+"""
+import threading
+import time
+import unittest
+from scheduler import PeriodicTask, Scheduler
+
+
+class PeriodicTaskTest(unittest.TestCase):
+    """ Deadlines, missed periods and errors of one task. """
+
+    def test_deadline(self):
+        task = PeriodicTask('fast', 10.0, lambda: None)
+        start = task.deadline = time.monotonic()
+        task.run(start + 0.5)
+        # The next deadline follows the previous one, not the finish time.
+        self.assertEqual(task.deadline, start + 10.0)
+        task.run(start + 10.25)
+        self.assertEqual(task.deadline, start + 20.0)
+        stats = task.stats()
+        self.assertEqual((stats['runs'], stats['missed']), (2, 0))
+        self.assertAlmostEqual(stats['jitter_max'], 0.5)
+        self.assertAlmostEqual(stats['jitter_mean'], 0.375)
+
+    def test_missed(self):
+        interval = 0.02
+        task = PeriodicTask('slow', interval, lambda: time.sleep(0.07))
+        start = task.deadline = time.monotonic()
+        task.run(start)
+        # The overrun periods are skipped and the deadline stays on the
+        # grid of the interval, in the future.
+        periods = round((task.deadline - start) / interval)
+        self.assertAlmostEqual(task.deadline, start + periods * interval)
+        self.assertGreater(task.deadline, time.monotonic())
+        self.assertGreaterEqual(periods, 4)
+        self.assertEqual(task.missed, periods - 1)
+        self.assertEqual(task.runs, 1)
+
+    def test_errors(self):
+        def fail():
+            raise RuntimeError('sensor')
+        task = PeriodicTask('failing', 10.0, fail)
+        task.deadline = time.monotonic()
+        task.run(task.deadline)
+        task.run(task.deadline)
+        self.assertEqual(task.errors, 2)
+        self.assertEqual(task.runs, 2)
+        self.assertIn('sensor', task.stats()['last_error'])
+
+
+class SchedulerTest(unittest.TestCase):
+    """ Tasks run on the scheduler thread. """
+
+    def test_run(self):
+        scheduler = Scheduler()
+        done = threading.Event()
+        calls = []
+
+        def count():
+            calls.append(time.monotonic())
+            if len(calls) == 5:
+                done.set()
+        scheduler.start()
+        task = scheduler.add('count', 0.02, count)
+        cancelled = scheduler.add('cancelled', 0.02, calls.append,
+                                  delay=10.0)
+        scheduler.cancel(cancelled)
+        self.assertTrue(done.wait(5.0))
+        scheduler.stop()
+        stats = scheduler.stats()
+        self.assertEqual(set(stats), {'count'})
+        self.assertGreaterEqual(stats['count']['runs'], 5)
+        self.assertEqual(task.errors, 0)
+        runs = task.runs
+        time.sleep(0.05)
+        self.assertEqual(task.runs, runs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,26 +30,31 @@ from daqhats import mcc172, OptionFlags, SourceType, HatIDs, HatError
 from daqhats_utils import select_hat_device, enum_mask_to_string, \
     chan_list_to_mask
 
-import socket
-import struct
-import datetime, time
+import time
 import logging
-import csv
+import numpy as np
 
-from threading import Lock, Thread
-from paho.mqtt import client as mqtt
+from telemetry import MqttPublisher, ControlSubscriber
+from streaming import UdpStreamer, FORMAT_INT24
+from recording import AsyncRecorder, SegmentRecorder, hat_calibration, \
+    to_codes, CODEC_PRED
 
 READ_ALL_AVAILABLE = -1
 
 CURSOR_BACK_2 = '\x1b[2D'
 ERASE_TO_END_OF_LINE = '\x1b[0K'
 
-#server = ('10.0.0.189', 2001)
-# server = ('10.0.0.140', 2001)
+# Analysis host receiving the waveform stream.
+udp_server = ('SERVER_ADDRESS', 2001)
 
-# socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+broker_address = "SERVER_ADDRESS"
+publisher = MqttPublisher(broker_address, "motor34", spool_dir="~/mqtt_spool")
+# Motors to stream, e.g. {"stream_channels": [0]} for motor 3 only.  The
+# scan settings stay fixed here, since the segments are recorded with one
+# channel layout; scan_with_diagnosis_mqtt.py restarts its scan on them.
+control = ControlSubscriber(publisher, "motor34/control",
+                            {'stream_channels': [0, 1]})
 
-c = 0
 def get_iepe():
     """
     Get IEPE enable from the user.
@@ -150,7 +155,7 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
         print('')
 
         try:
-            read_and_display_data(hat, num_channels)
+            read_and_display_data(hat, channels, actual_scan_rate)
 
         except KeyboardInterrupt:
             # Clear the '^C' from the display.
@@ -177,8 +182,7 @@ def calc_rms(data, channel, num_channels, num_samples_per_channel):
 
     return sqrt(value)
 
-def read_and_display_data(hat, num_channels):
-    global c, control
+def read_and_display_data(hat, channels, scan_rate):
     """
     Reads data from the specified channels on the specified DAQ HAT devices
     and updates the data on the terminal display.  The reads are executed in a
@@ -187,7 +191,9 @@ def read_and_display_data(hat, num_channels):
 
     Args:
         hat (mcc172): The mcc172 HAT device object.
-        num_channels (int): The number of channels to display.
+        channels (list[int]): The scanned channels; motor 3 is on channel 0
+            and motor 4 on channel 1.
+        scan_rate (float): The actual scan rate.
 
     Returns:
         None
@@ -202,126 +208,80 @@ def read_and_display_data(hat, num_channels):
     # samples (up to the default buffer size) be returned.
     timeout = 5.0
 
-    
-    period_timer = time.time()
-    record_timer = time.time()
-    now = time.time()
+    num_channels = len(channels)
 
-    data3 = []
-    data4 = []
-    
-    data3_lock = Lock()
-    data4_lock = Lock()
+    # Both motors are recorded continuously into rotating 10 minute segments,
+    # as compressed ADC codes.
+    calibration = hat_calibration(hat, channels)
+    segments = SegmentRecorder(
+        "/home/raspberry/diagnosis_data/test/records", scan_rate, channels,
+        segment_seconds=600.0, retention_bytes=16 << 30, recorder=recorder,
+        dtype='int32', codec=CODEC_PRED, calibration=calibration,
+        metadata={'motors': {'0': 3, '1': 4}})
+
+    # Both channels as int24 in MTU-sized datagrams (about 160 kB/s).
+    streamer = UdpStreamer(udp_server, 34, scan_rate, num_channels,
+                           channel_numbers=channels, sample_format=FORMAT_INT24,
+                           rate_limit=1.0e6)
+    streamer.start()
 
-    file_num = 50
-    
     recent = time.time()
     # Read all of the available samples (up to the size of the read_buffer which
     # is specified by the user_buffer_size).  Since the read_request_size is set
     # to -1 (READ_ALL_AVAILABLE), this function returns immediately with
     # whatever samples are available (up to user_buffer_size) and the timeout
-    # parameter is ignored.
-    while True:
-
-        read_result = hat.a_in_scan_read(read_request_size, timeout)
-
-        # Check for an overrun error
-        if read_result.hardware_overrun:
-            print('\n\nHardware overrun\n')
-            break
-        elif read_result.buffer_overrun:
-            print('\n\nBuffer overrun\n')
-            break
-
-        samples_read_per_channel = int(len(read_result.data) / num_channels)
-        total_samples_read += samples_read_per_channel
-        samples_read_per_second += samples_read_per_channel
-        now = time.time()
-        """
-        if now - recent >= 1:
-            logger.info(f"samples read per second: {samples_read_per_second}")
-            samples_read_per_second = 0
-            recent = now
-        """
-        print('\r{:12}'.format(samples_read_per_channel),
-                ' {:12} '.format(total_samples_read), end='')
-        # Display the RMS voltage for each channel.
-        if samples_read_per_channel > 0:
-            for i in range(num_channels):
-                value = calc_rms(read_result.data, i, num_channels,
-                                samples_read_per_channel)
-                print('{:10.5f}'.format(value), 'Vrms ',
-                      end='')
-                if file_num > 0: 
-                    if time.time() - period_timer < 60:
-                        if len(data3) < 102400:
-                            data3_lock.acquire()
-                            data3.extend(read_result.data[:samples_read_per_channel])
-                            data3_lock.release()
-                        if len(data4) < 102400:
-                            data4_lock.acquire()
-                            data4.extend(read_result.data[:samples_read_per_channel])
-                            data4_lock.release()
-                    elif time.time() - period_timer > 60:
-                        if len(data3) >= 102400:
-                            data3_lock.acquire()
-                            th3 = Thread(target=recording, args=(3, data3))
-                            th3.start()
-                        # diagnosis_motor(3, interpreter, input_details, output_details, data3)
-                            data3 = []
-                            data3_lock.release()
-                        if len(data4) >= 102400:
-                            data4_lock.acquire()
-                            th4 = Thread(target=recording, args=(4, data4))
-                            th4.start()
-                            # diagnosis_motor(3, interpreter, input_details, output_details, data3)
-                            data4 = []
-                            data4_lock.release()
-                        period_timer = time.time()
-                        file_num -= 1
-
-                """
-                data_lock.acquire()
-                if control == "3" and i == 1:
-                     data = struct.pack('%sd' %len(read_result.data[:samples_read_per_channel]), *read_result.data[:samples_read_per_channel])
-                    socket.sendto(data, server)
-                    c += 1
-                elif control == "4" and i == 0:
-                    data = struct.pack('%sd' %len(read_result.data[samples_read_per_channel:]), *read_result.data[samples_read_per_channel:])
-                    socket.sendto(data, server)
-                print('{:10.5f}'.format(value), 'Vrms ',
-                    end='')
-                data_lock.release()
-                """
-            stdout.flush()
-            sleep(0.1)
-
+    # parameter is ignored.  Ctrl-C ends the loop; the open segment is still
+    # closed, so it is flushed and indexed before the recorder stops.
+    try:
+        while True:
+            # Apply control commands between blocks.
+            if 'stream_channels' in control.take_changes():
+                streamer.channels = {
+                    channels.index(chan)
+                    for chan in control.settings['stream_channels']
+                    if chan in channels}
+
+            read_result = hat.a_in_scan_read(read_request_size, timeout)
+
+            # Check for an overrun error
+            if read_result.hardware_overrun:
+                print('\n\nHardware overrun\n')
+                break
+            elif read_result.buffer_overrun:
+                print('\n\nBuffer overrun\n')
+                break
+
+            samples_read_per_channel = int(len(read_result.data) / num_channels)
+            total_samples_read += samples_read_per_channel
+            samples_read_per_second += samples_read_per_channel
+            now = time.time()
+            """
+            if now - recent >= 1:
+                logger.info(f"samples read per second: {samples_read_per_second}")
+                samples_read_per_second = 0
+                recent = now
+            """
+            print('\r{:12}'.format(samples_read_per_channel),
+                    ' {:12} '.format(total_samples_read), end='')
+            # Display the RMS voltage for each channel.
+            if samples_read_per_channel > 0:
+                block = np.reshape(read_result.data, (-1, num_channels)).T
+                streamer.push(block)
+                segments.write(to_codes(block, calibration),
+                               timestamp=now - samples_read_per_channel / scan_rate)
+                for i in range(num_channels):
+                    value = calc_rms(read_result.data, i, num_channels,
+                                    samples_read_per_channel)
+                    print('{:10.5f}'.format(value), 'Vrms ',
+                          end='')
+                stdout.flush()
+                sleep(0.1)
+    finally:
+        streamer.stop()
+        segments.close()
     print('\n')
 
 
-def on_message(client, userdata, message):
-    global control
-    data_lock.acquire()
-    control = str(message.payload.decode("utf-8"))
-    logger.info(f'/ - Control Command: {control}\n')
-    data_lock.release()
-"""
-def mqtt_client():
-    logger.info("/ - Starting MQTT Service...\n")
-    broker_address = "10.0.0.118"
-    client = mqtt.Client("motor34")
-    client.connect(broker_address, 1883)
-    client.subscribe("motor34")
-    client.on_message = on_message
-    logger.info("/ - Start MQTT Loop\n")
-    client.loop_forever()
-"""
-def recording(motor_num, data):
-    n = datetime.datetime.now().strftime('%m%d-%H.%M.%S')
-    with open(f"/home/raspberry/diagnosis_data/test/records/{motor_num}_{n}", "w") as f:
-        writer = csv.writer(f, delimiter=",")
-        writer.writerow(data)
-
 if __name__ == '__main__':
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
@@ -336,14 +296,13 @@ if __name__ == '__main__':
     # logger.addHandler(file_handler)
 
 
-    data_lock = Lock()
-    control = "00"
-
-    # th = Thread(target=mqtt_client, args=())
-    # th.start()
+    recorder = AsyncRecorder()
+    recorder.start()
+    publisher.start()
+    control.publish_state()
 
     main()
+    recorder.stop()
+    publisher.stop()
     
-    # t = Thread(target=mqtt_client, args=())
-    # t.start()
     # sys.exit(app.exec_())